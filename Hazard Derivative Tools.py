@@ -8,17 +8,21 @@ geologic hazards in Colorado (rockfall, swelling soil, landslides, debris flows,
 """
 #-----------------------------------------------------------------------------
 
-import arcpy, os
+import arcpy, os, sys
 from arcpy import env
 arcpy.CheckOutExtension('3D')
 
+#the array engines live next to the toolbox in the gdt package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gdt import arcio, cache, flow, graph, profiling, store, terrain, tiling, units
+
 class Toolbox (object):
     def __init__(self):
         self.label = 'Geohazard Derivative Tools'
         self.alias = 'GDT'
 
         # List of tool classes associated with this toolbox
-        self.tools = [Rockfall, Problematic_Soils, Landslide]  #update this every time I add a new tool
+        self.tools = [Rockfall, Debris_Flow, Problematic_Soils, Landslide, Geologic_Hazards]  #update this every time I add a new tool
 
 
 class Rockfall(object):
@@ -67,8 +71,24 @@ class Rockfall(object):
             parameterType = 'Required',
             direction = 'Output')
         
+        #Fourth Parameter
+        param3 = arcpy.Parameter(
+            displayName = 'Tile Size (cells, leave blank to process the whole DEM at once)',
+            name = 'tile_size',
+            datatype = 'GPLong',
+            parameterType = 'Optional',
+            direction = 'Input')
         
-        params = [param0, param1, param2]
+        #Fifth Parameter
+        param4 = arcpy.Parameter(
+            displayName = 'Slope Thresholds (degrees, leave blank for the single 30 degree cut)',
+            name = 'slope_thresholds',
+            datatype = 'GPDouble',
+            parameterType = 'Optional',
+            direction = 'Input',
+            multiValue = True)
+        
+        params = [param0, param1, param2, param3, param4]
         return params
 
     def isLicensed(self):
@@ -88,19 +108,233 @@ class Rockfall(object):
         sW = parameters[0].valueAsText
         inDEM = parameters[1].valueAsText
         outPolys = parameters[2].valueAsText
+        tileSize = parameters[3].value #None = whole raster in memory
+        thresholds = parameters[4].valueAsText #e.g. '25;30;35;40', None = classic rockfall classes
         queryValue1 = 2 #All values > 30 degrees slope
         queryValue2 = 1000 #Most of the erroneous polygons have a small shape area. This filters out the junk
+        #per-stage timings (see gdt/profiling.py); the whole-DEM arrays stay in memory (or memory-mapped)
+        with profiling.Trace('Rockfall', arcpy.AddMessage) as trace, store.IntermediateStore() as intermediates:
+            env.scratchWorkspace = sW #only arcpy's own temporary rasters land here now
+            
+            if thresholds:
+                #severity bands: one sorted-breakpoint lookup per cell gives the band
+                #(how many thresholds the slope is over), polygons get tagged by band.
+                #The same Shape_Area junk filter as the classic classes applies to each band polygon
+                thresholds = sorted(float(t) for t in thresholds.split(';'))
+                classify = lambda sl: terrain.severity_bands(sl, thresholds)
+                bands = list(range(1, len(thresholds) + 1))
+            else:
+                classify = lambda sl: terrain.classify_slope(sl, terrain.ROCKFALL_REMAP)
+            
+            #slope -> int -> reclassify in one pass over the DEM array, so the _sl and _int
+            #rasters no longer get written to (and read back from) sW
+            rcRaster = None
+            if tileSize:
+                #big mosaics: walk the DEM in haloed tiles and mosaic each tile's classes into an
+                #_rc raster in sW, so only one tile is ever in memory; _rc is deleted once polygonized
+                with trace.stage('slope + reclassify (tiled)') as st:
+                    source = arcio.RasterSource(inDEM)
+                    info = source.info
+                    rcRaster = os.path.join(sW, os.path.basename(inDEM)[:-4] + '_rc')
+                    writer = arcio.RasterWriter(rcRaster, info, '32_BIT_SIGNED', terrain.CLASS_NODATA)
+                    stage = lambda block: classify(terrain.slope(block, info.cellWidth, info.cellHeight))
+                    sl_int2 = tiling.map_tiles(source, stage, writer, tileSize)
+                    st.cellsIn = st.cellsOut = info.rows * info.cols
+            else:
+                #recorded as a lazy workflow: Int and Reclassify are fused into one chunked pass
+                #over the slope, and each array is let go once the next step has read it
+                info = arcio.describe_raster(inDEM)
+                wf = graph.Workflow(intermediates)
+                #slope comes from the derivative cache when this DEM has been seen before
+                sl = wf.source('slope', lambda: arcio.cached_terrain(inDEM, ['slope'])[0]['slope'])
+                #no sieve: _rf has a polygon for every class region, the area cut happens in the select below
+                classes = wf.severity_bands(sl, thresholds) if thresholds else wf.reclassify(wf.int(sl), terrain.ROCKFALL_REMAP)
+                sl_int2, = wf.compute([wf.apply('to raster', arcio.to_raster, [classes], info=info, nodata=terrain.CLASS_NODATA)], trace)
+                arcpy.AddMessage(cache.default_cache().report())
+            #ct = arcpy.Contour_3d(inDEM, sW + '\\' + os.path.basename(inDEM)[:-4] + '_ct', 20)
+            with trace.stage('RasterToPolygon', cellsIn=info.rows * info.cols) as st:
+                rockfall = arcpy.RasterToPolygon_conversion(sl_int2, outPolys + '_rf', 'SIMPLIFY', 'Value')
+                st.featuresOut = arcio.feature_count(rockfall)
+            if rcRaster is not None:
+                del sl_int2
+                arcpy.Delete_management(rcRaster)
+            
+            env.addOutputsToMap = 1
+            if thresholds:
+                #every band polygon over the junk filter, tagged with its band
+                where_clause = "{} >= {}".format('gridcode', 1) + ' AND ' + "{} > {}".format('Shape_Area', queryValue2)
+                bandNames = terrain.band_names(thresholds)
+                with trace.stage('Select + tag bands', featuresIn=st.featuresOut) as st:
+                    st.featuresOut = arcio.export_stamped(rockfall, outPolys + '_final', where_clause, 'gridcode',
+                                                          [('Slope_Band', 'TEXT', 20)],
+                                                          dict((band, (name,)) for band, name in zip(bands, bandNames)))
+            else:
+                where_clause = "{} = {}".format('gridcode', queryValue1) + ' AND ' + "{} > {}".format('Shape_Area', queryValue2)
+                with trace.stage('Select', featuresIn=st.featuresOut) as st:
+                    st.featuresOut = arcio.feature_count(arcpy.Select_analysis(rockfall, outPolys + '_final', where_clause))
+            arcpy.AddMessage(intermediates.report())
         
+        return
+
+class Debris_Flow(object):
+    """
+    Debris flow hazards: channels (cells with enough upslope contributing
+    area) on slopes in the severity bands, tagged by whether they cross
+    debris flow / landslide units of the input geology. The flow routing
+    (fill, D8 direction, accumulation) runs on arrays in gdt/flow.py.
+    """
+    def __init__(self):
+        self.label = 'Debris Flow Hazards Polygon Tool'
+        self.description = 'Creates polygons of debris flow hazards from a high resolution digital elevation model (i.e Lidar) and mapped geology'
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
         
-        sl = arcpy.Slope_3d (inDEM, sW + '\\' + os.path.basename(inDEM)[:-4] + '_sl', 'DEGREE')
-        #ct = arcpy.Contour_3d(inDEM, sW + '\\' + os.path.basename(inDEM)[:-4] + '_ct', 20)
-        sl_int = arcpy.Int_3d(sl, sW + '\\' + os.path.basename(inDEM)[:-4] + '_int') 
-        sl_int2 = arcpy.Reclassify_3d(sl_int, 'VALUE', '0 30 1; 30.01 90 2', sW + '\\' + os.path.basename(inDEM)[:-4] + '_rc')
-        rockfall = arcpy.RasterToPolygon_conversion(sl_int2, outPolys + '_rf', 'SIMPLIFY', 'Value')
+        #First Parameter
+        param0 = arcpy.Parameter(
+            displayName = 'Scratch Workspace',
+            name = 'scratch_workspace',
+            datatype = 'DEWorkspace',
+            parameterType = 'Required',
+            direction = 'Input')
+        
+        #Second Parameter 
+        param1 = arcpy.Parameter(
+            displayName = 'input DEM',
+            name = 'inDEM',
+            datatype = 'DERasterDataset',
+            parameterType = 'Required',
+            direction = 'Input')
         
-        where_clause = "{} = {}".format('gridcode', queryValue1) + ' AND ' + "{} > {}".format('Shape_Area', queryValue2)
-        env.addOutputsToMap = 1
-        arcpy.Select_analysis(rockfall, outPolys + '_final', where_clause)
+        #Third Parameter
+        param2 = arcpy.Parameter(
+            displayName = 'input Geology (leave blank to skip the geology tags)',
+            name = 'inGeo',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Optional',
+            direction = 'Input')
+        
+        #Fourth Parameter
+        param3 = arcpy.Parameter(
+            displayName = 'Output Debris Flow Polygons',
+            name = 'debris_flow',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Required',
+            direction = 'Output')
+        
+        #Fifth Parameter
+        param4 = arcpy.Parameter(
+            displayName = 'Tile Size (cells, leave blank to process the whole DEM at once; tiles trace flow within a halo, '
+                          'so depressions spilling beyond it can differ)',
+            name = 'tile_size',
+            datatype = 'GPLong',
+            parameterType = 'Optional',
+            direction = 'Input')
+        
+        #Sixth Parameter
+        param5 = arcpy.Parameter(
+            displayName = 'Slope Thresholds (degrees, leave blank for the single 30 degree cut)',
+            name = 'slope_thresholds',
+            datatype = 'GPDouble',
+            parameterType = 'Optional',
+            direction = 'Input',
+            multiValue = True)
+        
+        #Seventh Parameter
+        param6 = arcpy.Parameter(
+            displayName = 'Minimum Contributing Area (square map units, leave blank for 10000)',
+            name = 'min_area',
+            datatype = 'GPDouble',
+            parameterType = 'Optional',
+            direction = 'Input')
+        
+        params = [param0, param1, param2, param3, param4, param5, param6]
+        return params
+
+    def isLicensed(self):
+        return True
+
+    def updateParameters(self, parameters):
+        return
+
+    def updateMessages(self, parameters):
+        return
+
+    def execute(self, parameters, messages):
+        
+        env.overwriteOutput = True
+        env.addOutputsToMap = 0
+        #### User defined variables ####
+        sW = parameters[0].valueAsText
+        inDEM = parameters[1].valueAsText
+        inGeo = parameters[2].valueAsText
+        outPolys = parameters[3].valueAsText
+        tileSize = parameters[4].value #None = whole raster in memory
+        thresholds = parameters[5].valueAsText #e.g. '15;30;40', None = the single 30 degree cut
+        minArea = parameters[6].value or 10000 #upslope area (square map units) where flow becomes a channel
+        fmt = 'FMT'
+        thresholds = sorted(float(t) for t in thresholds.split(';')) if thresholds else [30.0]
+        #per-stage timings (see gdt/profiling.py); the whole-DEM class raster stays in memory (or memory-mapped)
+        with profiling.Trace('Debris_Flow', arcpy.AddMessage) as trace, store.IntermediateStore() as intermediates:
+            env.scratchWorkspace = sW
+            
+            #the debris flow and landslide units are burned onto the DEM grid, so channels over
+            #them can move up into the second set of classes as each tile is classified
+            labelRaster = None
+            if inGeo:
+                with trace.stage('geology') as st:
+                    geology = arcio.load_geology(inGeo, [fmt]) #loaded once, shared with the other tools run on this layer
+                    st.featuresIn = len(geology)
+                    unitClasses = units.classify(geology.values(fmt))
+                    unitList = sorted(set(units.units_for(unitClasses, units.DEBRIS_FLOW)) | set(units.units_for(unitClasses, units.LANDSLIDE)))
+                    if unitList:
+                        labelRaster, _ = arcio.burn_units(inGeo, fmt, unitList, inDEM)
+            
+            #slope, fill -> flow direction -> flow accumulation and the channel test in one
+            #pass over the DEM. Tiles carry a wide halo so flow paths run across the tile edges
+            #and are streamed into a _dc raster in sW; without a tile size the whole DEM is one tile
+            with trace.stage('slope + flow accumulation') as st:
+                source = arcio.RasterSource(inDEM)
+                info = source.info
+                cw, ch = info.cellWidth, info.cellHeight
+                others = [arcio.RasterSource(labelRaster)] if labelRaster else []
+                stage = lambda block, *labels: flow.debris_flow_classes(terrain.slope(block, cw, ch), flow.contributing_area(block, cw, ch),
+                                                                        labels[0] if labels else 0, thresholds, minArea)
+                dcRaster = None
+                if tileSize:
+                    halo = flow.flow_halo(minArea, cw, ch)
+                    if halo > flow.FLOW_HALO:
+                        arcpy.AddMessage('Minimum Contributing Area {} needs a halo of {} cells around each tile (default {}), '
+                                         'so tiles take more memory; a smaller Tile Size makes up for it'.format(minArea, halo, flow.FLOW_HALO))
+                    dcRaster = os.path.join(sW, os.path.basename(inDEM)[:-4] + '_dc')
+                    writer = arcio.RasterWriter(dcRaster, info, '32_BIT_SIGNED', terrain.CLASS_NODATA)
+                    df_int = tiling.map_tiles(source, stage, writer, tileSize, halo, others)
+                else:
+                    classes = intermediates.allocate('classes', (info.rows, info.cols), arcio.PIXEL_TYPES['32_BIT_SIGNED'], terrain.CLASS_NODATA)
+                    writer = tiling.ArrayWriter(info.rows, info.cols, out=classes)
+                    tiling.map_tiles(source, stage, writer, max(info.rows, info.cols), 1, others)
+                st.cellsIn = st.cellsOut = info.rows * info.cols
+            if labelRaster:
+                arcpy.Delete_management(labelRaster)
+            if not tileSize:
+                with trace.stage('to raster', cellsIn=classes.size):
+                    df_int = arcio.to_raster(classes, info, terrain.CLASS_NODATA)
+            
+            #no Shape_Area junk filter here: channels are one cell wide, so even long ones make small polygons
+            with trace.stage('RasterToPolygon', cellsIn=info.rows * info.cols) as st:
+                debrisFlow = arcpy.RasterToPolygon_conversion(df_int, outPolys + '_df', 'SIMPLIFY', 'Value')
+                st.featuresOut = arcio.feature_count(debrisFlow)
+            if dcRaster is not None:
+                del df_int
+                arcpy.Delete_management(dcRaster)
+            
+            env.addOutputsToMap = 1
+            where_clause = "{} >= {}".format('gridcode', 1)
+            with trace.stage('Select + tag classes', featuresIn=st.featuresOut) as st:
+                st.featuresOut = arcio.export_stamped(debrisFlow, outPolys + '_final', where_clause, 'gridcode',
+                                                      [('Slope_Band', 'TEXT', 20), ('Geology', 'TEXT', 40)],
+                                                      dict(enumerate(flow.class_names(thresholds), 1)))
+            arcpy.AddMessage(intermediates.report())
         
         return
 
@@ -167,157 +401,27 @@ class Problematic_Soils(object):
         outRock = parameters[2].valueAsText
         outSoil = parameters[3].valueAsText
         fmt = 'FMT'
-        outGeo = os.path.join(sW, os.path.basename(inGeo))
-        lyr = arcpy.MakeFeatureLayer_management(inGeo, outGeo)
-        
-        def geo_units(table, field):
-            with arcpy.da.SearchCursor (table, field) as cursor:
-                return sorted ({row[0] for row in cursor})
-        geoUnits = geo_units(inGeo, fmt)
-        #print (geoUnits)
-        rockList = []
-        for g in geoUnits:
-            if 'Ta'.lower() in g.lower(): #Paleocene and Upper Cretaceous Animas Formation
-                if 'Ta' not in rockList:
-                    rockList.append(g)
-            if 'Tkda1' in g: #Paleocene and Upper Cretaceous Dawson Formation, Facies Unit 1
-                if 'TKda1' not in rockList:
-                    rockList.append(g)
-            if 'Tkda2' in g: #Paleocene and Upper Cretaceous Dawson Formation, Facies Unit 2
-                if 'TKda2' not in rockList:
-                    rockList.append(g)
-            if 'Tkda3' in g: #Paleocene and Upper Cretaceous Dawson Formation, Facies Unit 3
-                if 'TKda3' not in rockList:
-                    rockList.append(g)
-            if 'Ka' in g: #Paleocene and Upper Cretaceous Animas Formation
-                if 'Ka' not in rockList:
-                    rockList.append(g)
-            if 'Kb' in g: #Cretaceous Benton Group (Synonymous with Kcgg)
-                if 'Kb' not in rockList:
-                    rockList.append(g)
-            if 'Kcgg' in g: #Cretaceous Carlile Shale, Greenhorn Limestone and Graneros Shale
-                if 'Kcgg' not in rockList:
-                    rockList.append(g)
-            if 'Kch' in g: #Cretaceous Cliff House Sandstone
-                if 'Kch' not in rockList:
-                    rockList.append(g)
-            if 'Kk' in g: #Cretaceous Kirtland Formation
-                if 'Kk' not in rockList:
-                    rockList.append(g)
-            if 'Kl' in g: #Cretaceous Mancos Shale
-                if 'Kl' not in rockList:
-                    rockList.append(g)
-            if 'Km' in g: #Cretaceous Mancos Shale
-                if 'Km' not in rockList:
-                    rockList.append(g)
-            if 'Kp' in g: #Cretaceous Pierre Shale
-                if 'Kp' not in rockList:
-                    rockList.append(g)
-            if 'Jm' in g: #Jurassic Morrison Formation
-                if 'Km' not in rockList:
-                    rockList.append(g)
-        for g in rockList:
-            where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), g)
-            arcpy.SelectLayerByAttribute_management(lyr, 'ADD_TO_SELECTION', where_clause)
-            arcpy.Select_analysis(lyr, outRock)
-        arcpy.SelectLayerByAttribute_management(lyr, 'CLEAR_SELECTION')
-           
-        #print (rockList)
-        
-        #Add this in when I figure out how...
-        # if len(rockList) == 0:
-        #     arcpy.AddMessage("{} has no problematic rock".format(inGeo))
-
-        # if len(rockList) >= 1:
-        #     for g in rockList:
-        #         where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), g)
-        #         arcpy.SelectLayerByAttribute_management(lyr, 'ADD_TO_SELECTION', where_clause) 
-        #         arcpy.Select_analysis(lyr, outRock)
-        #     arcpy.SelectLayerByAttribute_management(lyr, 'CLEAR_SELECTION')
-        
-        geoUnits = geo_units(inGeo, fmt)
-        #print (geoUnits)
-        soilList = []
-        for g in geoUnits:
-            if 'af' in g: #Artificial fill
-                if 'af' not in soilList:
-                    soilList.append(g)
-            if 'dg' in g: #Disturbed Ground
-                if 'dg' not in soilList:
-                    soilList.append(g)
-            if 'Qacc1' in g: #Alluvium one of Coal Creek
-                if 'Qacc1' not in soilList:
-                    soilList.append(g)
-            if 'Qacc2' in g: #Alluvium two of Coal Creek
-                if 'Qacc2' not in soilList:
-                    soilList.append(g)
-            if 'Qad1' in g: #Alluvium one of Dry Creek
-                if 'Qad1' not in soilList:
-                    soilList.append(g)
-            if 'Qad2' in g: #Alluvium two of Dry Creek
-                if 'Qad2' not in soilList:
-                    soilList.append(g)
-            if 'Qaeo' in g: #Old alluvium of East Creek
-                if 'Qaeo' not in soilList:
-                    soilList.append(g)
-            if 'Qag2' in g: #Alluvium two of the Gunnison River
-                if 'Qag2' not in soilList:
-                    soilList.append(g)
-            if 'Qag3' in g: #Alluvium three of the Gunnison River
-                if 'Qag3' not in soilList:
-                    soilList.append(g)
-            if 'Qamf' in g: #Alluvial mud flow and mud fan deposits 
-                if 'Qamf' not in soilList:
-                    soilList.append(g)
-            if 'Qamfo' in g: #Old alluvial mud flow and mud fan deposits
-                if 'Qamfo' not in soilList:
-                    soilList.append(g)
-            if 'Qau' in g: #Undifferentiated alluvium of the Uncompaghre River
-                if 'Qau' not in soilList:
-                    soilList.append(g)
-            if 'Qau2' in g: #Alluvium two of the Uncompaghre River
-                if 'Qau2' not in soilList:
-                    soilList.append(g)
-            if 'Qau3' in g: #Alluvium three of the Uncompaghre River
-                if 'Qau3' not in soilList:
-                    soilList.append(g)
-            if 'Qau4' in g: #Alluvium four of the Uncompaghre River
-                if 'Qau4' not in soilList:
-                    soilList.append(g)
-            if 'Qau5' in g: #Alluvium five of the Uncompaghre River
-                if 'Qau5' not in soilList:
-                    soilList.append(g)
-            if 'Qc' in g: #Colluvial deposits
-                if 'Qc' not in soilList:
-                    soilList.append(g)
-            if 'Qco' in g: #Old Colluvial deposits
-                if 'Qco' not in soilList:
-                    soilList.append(g)
-            if 'Qf' in g: #Fan deposits
-                if 'Qf' not in soilList:
-                    soilList.append(g)
-            if 'Qfy' in g: #Young Fan deposits
-                if 'Qfy' not in soilList:
-                    soilList.append(g)
-            if 'Qsw' in g: #Young Fan deposits
-                if 'Qsw' not in soilList:
-                    soilList.append(g)
-        for g in soilList:
-            where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), g)
-            arcpy.SelectLayerByAttribute_management(lyr, 'ADD_TO_SELECTION', where_clause) 
-            arcpy.Select_analysis(lyr, outSoil)
-        arcpy.SelectLayerByAttribute_management(lyr, 'CLEAR_SELECTION')
-        
-        #Add this in when I figure out how...
-        # if len(soilList) == 0:
-        #     arcpy.AddMessage("{} has no problematic soil".format(inGeo))
-
-        # if len(soilList) >= 1:
-        #     for g in soilList:
-        #         where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), g)
-        #         arcpy.SelectLayerByAttribute_management(lyr, 'ADD_TO_SELECTION', where_clause) 
-        #         arcpy.Select_analysis(lyr, outSoil)
-        # arcpy.SelectLayerByAttribute_management(lyr, 'CLEAR_SELECTION')
+        
+        with profiling.Trace('Problematic_Soils', arcpy.AddMessage) as trace:
+            
+            #one pass over the distinct units with the shared rule table (gdt/unit_rules.csv)
+            with trace.stage('classify units') as st:
+                geology = arcio.load_geology(inGeo, [fmt]) #loaded once, shared with the other tools run on this layer
+                st.featuresIn = len(geology)
+                unitClasses = units.classify(geology.values(fmt))
+                rockList = units.units_for(unitClasses, units.PROBLEMATIC_ROCK)
+                soilList = units.units_for(unitClasses, units.PROBLEMATIC_SOIL)
+            #each output is a mask over the unit codes; both are exported in one pass over the geology
+            with trace.stage('select problematic units') as st:
+                picks = {}
+                for outFC, which, label in [(outRock, geology.mask(fmt, rockList), 'problematic rock'),
+                                            (outSoil, geology.mask(fmt, soilList), 'problematic soil')]:
+                    if which.any():
+                        picks[outFC] = which
+                    else:
+                        arcpy.AddMessage('{} has no {}'.format(inGeo, label))
+                st.featuresOut = sum(arcio.write_geology(inGeo, geology, picks).values())
+        return
 
 class Landslide(object):
     def __init__(self):
@@ -372,46 +476,97 @@ class Landslide(object):
         inGeo = parameters[1].valueAsText
         outPolys = parameters[2].valueAsText
         fmt = 'FMT'
-        outGeo = os.path.join(sW, os.path.basename(inGeo))
-        lyr = arcpy.MakeFeatureLayer_management(inGeo, outGeo)
-        
-        def geo_units(table, field):
-            with arcpy.da.SearchCursor (table, field) as cursor:
-                return sorted ({row[0] for row in cursor})
-        geoUnits = geo_units(inGeo, fmt)
-        #print (geoUnits)
-        rockList = []
-        for g in geoUnits:
-            if 'Qls' in g: #Quaternary Landslide Deposits
-                if 'Qls' not in rockList:
-                    rockList.append(g)
-            if 'Qlsp' in g: #Quaternary Preglacial Landslide Deposits
-                if 'Qlsp' not in rockList:
-                    rockList.append(g)
-            if 'Qlso' in g: #Quaternary Old Landslide Deposits
-                if 'Qlso' not in rockList:
-                    rockList.append(g) 
-            if 'Qlsr' in g: #Quaternary Recent Landslide Deposits
-                if 'Qlsr' not in rockList:
-                    rockList.append(g)  
-            if 'Qlsy' in g: #Quaternary Young Landslide Deposits
-                if 'Qlsy' not in rockList:
-                    rockList.append(g) 
-            if 'Qt' in g: #Quaternary Talus Deposits
-                if 'Qt' not in rockList:
-                    rockList.append(g)
-            if 'Qta' in g: #Quaternary Talus Deposits
-                if 'Qta' not in rockList:
-                    rockList.append(g)
-            #if 'Qc' in g:
-                #if 'Qc' not in rockList:
-                    #if slope raster > x degrees:
-                        #rockList.append(g)
-           
-        
-        for g in rockList:
-            where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), g)
-            arcpy.SelectLayerByAttribute_management(lyr, 'ADD_TO_SELECTION', where_clause)   
+        
+        with profiling.Trace('Landslide', arcpy.AddMessage) as trace:
             
-        arcpy.Select_analysis(lyr, outPolys)
-        return
\ No newline at end of file
+            with trace.stage('classify units') as st:
+                geology = arcio.load_geology(inGeo, [fmt]) #loaded once, shared with the other tools run on this layer
+                st.featuresIn = len(geology)
+                unitClasses = units.classify(geology.values(fmt))
+                rockList = units.units_for(unitClasses, units.LANDSLIDE)
+            #Qc could be added here with a slope rule, once that's worked out
+            
+            with trace.stage('select landslide units') as st:
+                st.featuresOut = arcio.feature_count(arcio.select_units(inGeo, fmt, rockList, outPolys, 'landslide units', geology))
+        return
+
+class Geologic_Hazards(object):
+    """
+    All of the geology-based hazards at once, in one pass over the geology
+    feature class (arcio.fan_out): each unit is classified once and its
+    features go to the landslide, problematic rock and problematic soil
+    outputs it belongs to. The pass also loads the geology store
+    (gdt/geostore.py); when another tool already loaded it, the outputs are
+    masks over its unit codes.
+    """
+    def __init__(self):
+        self.label = 'All Geologic Hazards Polygon Tool'
+        self.description = 'Creates landslide, problematic rock and problematic soil polygons from mapped geology in one pass'
+        self.canRunInBackground = False
+
+    def getParameterInfo(self):
+        
+        #First Parameter
+        param0 = arcpy.Parameter(
+            displayName = 'input Geology',
+            name = 'inGeo',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Required',
+            direction = 'Input')
+        
+        #Second Parameter
+        param1 = arcpy.Parameter(
+            displayName = 'Output Landslide Polygons',
+            name = 'landslide',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Required',
+            direction = 'Output')
+        
+        #Third Parameter
+        param2 = arcpy.Parameter(
+            displayName = 'Output Problematic Rock Polygons',
+            name = 'problematic_rock',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Required',
+            direction = 'Output')
+        
+        #Fourth Parameter
+        param3 = arcpy.Parameter(
+            displayName = 'Output Problematic Soil Polygons',
+            name = 'problematic_soil',
+            datatype = 'DEFeatureClass',
+            parameterType = 'Required',
+            direction = 'Output')
+        
+        params = [param0, param1, param2, param3]
+        return params
+
+    def isLicensed(self):
+        return True
+
+    def updateParameters(self, parameters):
+        return
+
+    def updateMessages(self, parameters):
+        return
+
+    def execute(self, parameters, messages):
+        
+        env.overwriteOutput = True
+        #### User defined variables ####
+        inGeo = parameters[0].valueAsText
+        outputs = {units.LANDSLIDE: parameters[1].valueAsText,
+                   units.PROBLEMATIC_ROCK: parameters[2].valueAsText,
+                   units.PROBLEMATIC_SOIL: parameters[3].valueAsText}
+        fmt = 'FMT'
+        
+        with profiling.Trace('Geologic_Hazards', arcpy.AddMessage) as trace:
+            with trace.stage('route features') as st:
+                counts, st.featuresIn = arcio.fan_out(inGeo, fmt, outputs)
+                st.featuresOut = sum(counts.values())
+            for hazard in sorted(counts):
+                if counts[hazard] == 0:
+                    arcpy.AddMessage('{} has no {} units'.format(inGeo, hazard.replace('_', ' ')))
+                else:
+                    arcpy.AddMessage('{} {} polygons written to {}'.format(counts[hazard], hazard.replace('_', ' '), outputs[hazard]))
+        return
@@ -0,0 +1,242 @@
+#Headless batch runs of the Hazard Derivative Tools. Every tool x AOI
+#combination is one job on a shared pool of worker processes, so a statewide
+#refresh is one command instead of hundreds of runs through the tool dialogs:
+#
+#    python "Hazard batch.py" hazard_aois.csv --tools Rockfall Landslide --workers 6
+#
+#The AOI list is a CSV file with one row per AOI (county, quad, ...):
+#
+#    aoi,dem,geology,workspace
+#    Summit,N:\...\summit_dem.img,N:\...\geol_poly.shp,C:\...\Summit.gdb
+#
+#dem or geology can be left blank if none of the tools being run reads it. The
+#outputs go into the AOI's workspace (created if it doesn't exist) as
+#<aoi>_rockfall_final, <aoi>_landslide, ...
+#
+#Each worker loads the sources of an AOI once, the first time it runs a job
+#for it: the geology into the geology store (packed polygons and coded units,
+#see gdt/geostore.py) and the DEM into the worker's own scratch gdb (off the
+#N:\ share), and every later tool the worker runs on that AOI reads those. The slope itself comes from the
+#shared derivative cache, so it is computed once per DEM, not once per worker.
+#
+#A summary of every job (status, seconds, source load time and output
+#feature counts) is written as CSV and JSON next to the AOI list.
+#---------------------
+
+
+#import system modules
+#---------------------
+import argparse, collections, csv, importlib.util, json, os, sys, time
+import arcpy
+from arcpy import env
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gdt import arcio, geostore, parallel, profiling
+arcpy.CheckOutExtension('3D')
+
+#define variables
+#----------------
+aoiList = r'C:\Users\mpalkovic\Documents\ArcGIS\hazard_aois.csv'
+tools = ['Rockfall', 'Problematic_Soils', 'Landslide'] #run on every AOI
+workers = parallel.default_workers() #set to 1 to run the jobs one at a time in this process
+tileSize = None #Rockfall, Debris_Flow: cells per tile, None = whole DEM in memory
+slopeThresholds = None #Rockfall, Debris_Flow: e.g. '25;30;35;40' for severity bands, None = the single 30 degree cut
+sourcesPerWorker = 8 #AOIs whose loaded sources a worker keeps around
+unitField = 'FMT' #the geology field the tools sort units by, loaded into the geology store
+toolboxFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Hazard Derivative Tools.py')
+
+
+class ToolParameter(object):
+    #the part of arcpy.Parameter the tools' execute methods read
+    def __init__(self, value):
+        self.value = value
+        self.valueAsText = None if value is None else str(value)
+
+
+def safe_name(text):
+    return ''.join(c if c.isalnum() else '_' for c in text)
+
+
+def out_path(aoi, suffix):
+    return os.path.join(aoi['workspace'], safe_name(aoi['aoi']) + suffix)
+
+
+#the tools: the sources each one reads, and its parameters and outputs for an AOI
+#(outputs are {name in the summary: feature class})
+def rockfall_job(aoi, sources, scratch):
+    out = out_path(aoi, '_rockfall')
+    return [scratch, sources['dem'], out, tileSize, slopeThresholds], {'rockfall': out + '_rf', 'rockfall_final': out + '_final'}
+
+
+def debris_flow_job(aoi, sources, scratch):
+    out = out_path(aoi, '_debris_flow')
+    return [scratch, sources['dem'], sources['geology'], out, tileSize, slopeThresholds, None], {'debris_flow': out + '_final'}
+
+
+def problematic_soils_job(aoi, sources, scratch):
+    rock, soil = out_path(aoi, '_problematic_rock'), out_path(aoi, '_problematic_soil')
+    return [scratch, sources['geology'], rock, soil], {'problematic_rock': rock, 'problematic_soil': soil}
+
+
+def landslide_job(aoi, sources, scratch):
+    out = out_path(aoi, '_landslide')
+    return [scratch, sources['geology'], out], {'landslide': out}
+
+
+def geologic_hazards_job(aoi, sources, scratch):
+    outs = collections.OrderedDict((n, out_path(aoi, '_' + n)) for n in ('landslide', 'problematic_rock', 'problematic_soil'))
+    return [sources['geology']] + list(outs.values()), outs
+
+
+TOOLS = {'Rockfall': (['dem'], rockfall_job),
+         'Debris_Flow': (['dem', 'geology'], debris_flow_job),
+         'Problematic_Soils': (['geology'], problematic_soils_job),
+         'Landslide': (['geology'], landslide_job),
+         'Geologic_Hazards': (['geology'], geologic_hazards_job)}
+DEM_TOOLS = ['Rockfall', 'Debris_Flow'] #the slow ones; they go on the pool first
+
+
+def read_aois(aoiCSV):
+    with open(aoiCSV, newline='') as f:
+        aois = [dict((k.strip().lower(), (v or '').strip()) for k, v in row.items()) for row in csv.DictReader(f)]
+    for row in aois:
+        if not row.get('aoi') or not row.get('workspace'):
+            raise ValueError('{}: every AOI needs an aoi name and a workspace'.format(aoiCSV))
+    names = [safe_name(row['aoi']) for row in aois]
+    if len(set(names)) != len(names):
+        raise ValueError('{}: AOI names have to be unique'.format(aoiCSV))
+    return aois
+
+
+#worker side
+#-----------
+_worker = {}
+
+
+def init_worker(root, toolbox, keep):
+    #every worker gets a private scratch gdb and imports the toolbox once
+    gdb = 'batch_{}.gdb'.format(os.getpid())
+    if not arcpy.Exists(os.path.join(root, gdb)):
+        arcpy.CreateFileGDB_management(root, gdb)
+    env.workspace = env.scratchWorkspace = os.path.join(root, gdb)
+    env.overwriteOutput = True
+    env.addOutputsToMap = False
+    spec = importlib.util.spec_from_file_location('hazard_derivative_tools', toolbox)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _worker.update(toolbox=module, scratch=env.workspace, keep=keep, sources=collections.OrderedDict())
+    geostore.MAX_STORES = max(geostore.MAX_STORES, keep)
+
+
+def load_sources(aoi, kinds):
+    #the worker's copies of an AOI's sources, made the first time they're needed
+    cached = _worker['sources'].setdefault(aoi['aoi'], {})
+    _worker['sources'].move_to_end(aoi['aoi'])
+    for kind in kinds:
+        if kind in cached:
+            continue
+        if not aoi.get(kind):
+            raise ValueError('AOI {} has no {} source'.format(aoi['aoi'], kind))
+        if kind == 'geology':
+            arcio.load_geology(aoi[kind], [unitField]) #the tools find it in the store
+            cached[kind] = aoi[kind]
+        else:
+            cached[kind] = arcpy.CopyRaster_management(aoi[kind], os.path.join(_worker['scratch'], safe_name(aoi['aoi']) + '_dem')).getOutput(0)
+    while len(_worker['sources']) > _worker['keep']:
+        name, old = _worker['sources'].popitem(last=False)
+        for kind, path in old.items():
+            if kind == 'geology':
+                geostore.forget(arcpy.Describe(path).catalogPath)
+            else:
+                arcpy.Delete_management(path)
+    return cached
+
+
+def run_job(toolName, aoi):
+    #one tool on one AOI. Returns {'load': seconds, 'run': seconds, 'outputs': {name: features}}
+    kinds, build = TOOLS[toolName]
+    start = time.time()
+    try:
+        sources = load_sources(aoi, kinds)
+        loaded = time.time()
+        parameters, outputs = build(aoi, sources, _worker['scratch'])
+        getattr(_worker['toolbox'], toolName)().execute([ToolParameter(p) for p in parameters], None)
+    except arcpy.ExecuteError:
+        raise RuntimeError(arcpy.GetMessages(2))
+    counts = dict((name, arcio.feature_count(path) if arcpy.Exists(path) else 0) for name, path in outputs.items())
+    return {'load': loaded - start, 'run': time.time() - loaded, 'outputs': counts}
+
+
+#summary
+#-------
+def write_summary(results, jobs, outCSV):
+    #one row per job plus a JSON copy; output counts get a column each
+    names = sorted(set(n for r in results if r.ok for n in r.value['outputs']))
+    rows = []
+    for r, (key, (toolName, aoi)) in zip(results, jobs):
+        row = collections.OrderedDict([('aoi', aoi['aoi']), ('tool', toolName), ('status', 'OK' if r.ok else 'FAILED'),
+                                       ('seconds', round(r.seconds, 2)),
+                                       ('load_seconds', round(r.value['load'], 2) if r.ok else ''),
+                                       ('run_seconds', round(r.value['run'], 2) if r.ok else '')])
+        for n in names:
+            row[n] = r.value['outputs'].get(n, '') if r.ok else ''
+        row['error'] = (r.error or '').strip()
+        rows.append(row)
+    with open(outCSV, 'w', newline='') as f:
+        w = csv.DictWriter(f, list(rows[0]) if rows else ['aoi', 'tool', 'status'])
+        w.writeheader()
+        w.writerows(rows)
+    with open(os.path.splitext(outCSV)[0] + '.json', 'w') as f:
+        json.dump(rows, f, indent=1)
+    return outCSV
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the hazard tools on every AOI in a list')
+    parser.add_argument('aois', nargs='?', default=aoiList, help='CSV with aoi, dem, geology and workspace columns')
+    parser.add_argument('--tools', nargs='+', default=tools, choices=sorted(TOOLS))
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--summary', help='summary CSV (default: hazard_batch_summary.csv next to the AOI list)')
+    args = parser.parse_args()
+    root = os.path.dirname(os.path.abspath(args.aois))
+    scratchRoot = os.path.join(root, 'batch_scratch') #one scratch gdb per worker goes in here
+    summary = args.summary or os.path.join(root, 'hazard_batch_summary.csv')
+    #per-stage timings; set GDT_TRACE / GDT_PROFILE for a JSON trace / cProfile
+    with profiling.Trace('Hazard batch') as trace:
+
+        #the output workspaces are made up front, so the workers never race to create one
+        #-------------------------------------------------------------------------------
+        with trace.stage('prepare workspaces') as st:
+            aois = read_aois(args.aois)
+            for aoi in aois:
+                if not arcpy.Exists(aoi['workspace']):
+                    arcpy.CreateFileGDB_management(os.path.dirname(aoi['workspace']), os.path.basename(aoi['workspace']))
+            if not os.path.isdir(scratchRoot):
+                os.makedirs(scratchRoot)
+            st.featuresOut = len(aois)
+
+        #every tool x AOI job on one pool, the DEM tools first so they don't finish last
+        #------------------------------------------------------------------------------
+        order = [t for t in args.tools if t in DEM_TOOLS] + [t for t in args.tools if t not in DEM_TOOLS]
+        jobs = [('{} {}'.format(t, aoi['aoi']), (t, aoi)) for t in order for aoi in aois]
+        print ('{} jobs: {} tools on {} AOIs, {} workers'.format(len(jobs), len(order), len(aois), args.workers))
+        with trace.stage('run jobs', featuresIn=len(jobs)) as st:
+            results = parallel.run_jobs(run_job, jobs, args.workers, init_worker, (scratchRoot, toolboxFile, sourcesPerWorker))
+            st.featuresOut = sum(1 for r in results if r.ok)
+
+        #summary
+        #-------
+        write_summary(results, jobs, summary)
+        for r in results:
+            if not r.ok:
+                print ('{} FAILED\n{}'.format(r.key, r.error))
+        for t in order:
+            done = [r for r, (key, (toolName, aoi)) in zip(results, jobs) if toolName == t and r.ok]
+            print ('{}: {} of {} AOIs, {:.1f} s'.format(t, len(done), len(aois), sum(r.seconds for r in done)))
+        print ('summary written to {}'.format(summary))
+
+        #delete the worker scratch gdbs (the DEM copies)
+        #-----------------------------------------------
+        env.workspace = env.scratchWorkspace = None #workers=1 ran init_worker in this process
+        for gdb in os.listdir(scratchRoot):
+            if gdb.startswith('batch_') and gdb.endswith('.gdb'):
+                arcpy.Delete_management(os.path.join(scratchRoot, gdb))
@@ -1,131 +1,81 @@
 #import system modules + define environmental variables
-import arcpy, os
+import os, sys
 from arcpy import env
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gdt import arcio, cache, graph, profiling, store, terrain, units, zonal
 env.overwriteOutput = True
 env.addOutputsToMap = 0 #Note that env.addOutputsToMap is boolean. 0 = False, 1 = True
 env.workspace = r'C:\Users\mpalkovic\Documents\ArcGIS\Default.gdb'
 env.scratchWorkspace = r'C:\Users\mpalkovic\Documents\ArcGIS\scratch.gdb'
 
 #define local variables
-outPolys = os.path.join (env.workspace, 'BreckLandslidePolys')
 inGeo = r'N:\LIBRARY\Archive\PUBLISHED\OF-OPEN-FILE_SERIES\2000s\OF-02-07 Breckenridge\OF-02-07 FINAL FILES\GIS_Data\geol_poly.shp'
 inDEM = os.path.join(env.workspace, 'BreckDEM')
-lyr = arcpy.MakeFeatureLayer_management(inGeo, outPolys)
 fmt = 'DESCRIPTIO'
-opTemp = os.path.join (env.workspace, 'Breckintpolys')
 county = 'Summit'
 ht = 'Landslide Hazard'
+trace = profiling.Trace('LandslideTesting') #per-stage timings; set GDT_TRACE / GDT_PROFILE for a JSON trace / cProfile
+intermediates = store.IntermediateStore() #the hazard raster and its polygons stay in memory, only the result goes to the gdb
 
-#Create a list of potential units that can exhibit landslide hazards here. We'll then make county specific rules below
-def geo_units(table, field):
-    with arcpy.da.SearchCursor (table, field) as cursor:
-        return sorted ({row[0] for row in cursor})
-    
-geoUnits = geo_units(inGeo, fmt)
-#print (geoUnits)
-rockList = []
-for g in geoUnits:
-    if 'Qls' in g: #Quaternary Landslide Deposits
-        if 'Qls' not in rockList:
-            rockList.append(g)
-    if 'Qlsp' in g: #Quaternary Preglacial Landslide Deposits
-        if 'Qlsp' not in rockList:
-            rockList.append(g)
-    if 'Qlso' in g: #Quaternary Old Landslide Deposits
-        if 'Qlso' not in rockList:
-            rockList.append(g) 
-    if 'Qlsr' in g: #Quaternary Recent Landslide Deposits
-        if 'Qlsr' not in rockList:
-            rockList.append(g)  
-    if 'Qlsy' in g: #Quaternary Young Landslide Deposits
-        if 'Qlsy' not in rockList:
-            rockList.append(g) 
-    if 'Qt' in g: #Quaternary Talus Deposits
-        if 'Qt' not in rockList:
-            rockList.append(g)
-    if 'Qta' in g: #Quaternary Talus Deposits
-        if 'Qta' not in rockList:
-            rockList.append(g)
-    if 'PPm' in g: #Pennsylvanian and Permian Maroon Formation
-        if 'PPm' not in rockList:
-            rockList.append(g)
-    if 'Pm' in g: #Pennsylvanian Minturn Formation
-        if 'Pm' not in rockList:
-            rockList.append(g)
-#print (rockList)
-
-sl = arcpy.Slope_3d (inDEM, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_sl'), 'DEGREE') 
+try:
+    #Sort the units into landslide classes with the shared rule table (gdt/unit_rules.csv).
+    #County specific rules (e.g. the Summit County PPm/Pm units) are rows in that table too
+    with trace.stage('classify units') as st:
+        geology = arcio.load_geology(inGeo, [fmt]) #packed rings and coded units, read once; rasterize_units reuses it
+        unitClasses = units.classify(geology.values(fmt), county)
+        rockList = units.units_for(unitClasses, units.LANDSLIDE)
+        st.featuresIn = len(geology)
+    #print (rockList)
 
-if county == 'Summit':
-    try:
-        if 'PPm' in rockList: #Maroon Formation. This is the codeblock we'll need to modify for each geologic unit, but this is in essence a template of what we need to do for landslide and rockfall hazards.
-            index = rockList.index('PPm')
-            index_v2 = rockList[index]
-            where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), index_v2)
-            queryValue1 = 2 #All values > x degrees after we reclassify the raster
-            queryValue2 = 1000 #Most of the erroneous polygons have a small shape area. This filters out the junk
-            
-            #create a slope map
-            #sl = arcpy.Slope_3d (inDEM, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_sl'), 'DEGREE')     
-            
-            #select all of the Maroon Formation Polygons
-            slba = arcpy.SelectLayerByAttribute_management (lyr, 'ADD_TO_SELECTION', where_clause)
-            
-            #clip the raster based on the geology polygons we just selected
-            clip = arcpy.Clip_management(sl, '#', opTemp, slba, '#', 'ClippingGeometry')
-            
-            #convert that raster to integer type
-            sl_int = arcpy.Int_3d(clip, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_int'))
-            
-            #reclassify the raster (example: 0-25 degrees, >25 degree slope)
-            sl_rc = arcpy.Reclassify_3d(sl_int, 'VALUE', '0 25 1; 25.01 90 2', os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_rc'))
-            ls = arcpy.RasterToPolygon_conversion(sl_rc, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_rtp'), 'SIMPLIFY', 'Value')
-            
-            #export the final polygons
-            where_clause2 = "{} = {}".format('gridcode', queryValue1) + ' AND ' + "{} > {}".format('Shape_Area', queryValue2)
-            env.addOutputsToMap = 1
-            target = arcpy.Select_analysis(ls, os.path.join(env.workspace, os.path.basename(inDEM)[:-4] + '_LandslideHazards'), where_clause2)
-            
-            arcpy.AddField_management (target, 'fmt', 'TEXT')
-            arcpy.AddField_management (target, 'Hazard_Type', 'TEXT')
-            fields = ['fmt', 'Hazard_Type']
-            with arcpy.da.UpdateCursor (target, fields) as cursor:
-                for row in cursor:
-                    row[0] = index_v2
-                    row[1] = ht
-                    cursor.updateRow(row)
-            del cursor, row
-    except:
-        pass
+    #The per-unit slope rules (Summit: Maroon Fm PPm > 25 degrees, Minturn Fm Pm > 27.5 degrees)
+    #are the slope column of the rule table, so every unit is handled by the same code below
+    unitThresholds = units.classifier(county).slope_thresholds(unitClasses, units.LANDSLIDE)
+    queryValue2 = 1000 #Most of the erroneous polygons have a small shape area. This filters out the junk
+    bandOffsets = [0] #degrees over each unit's threshold that start a severity band, e.g. [0, 5, 10]; [0] = plain pass / fail
+    base = os.path.basename(inDEM)[:-4]
 
-env.addOutputsToMap = 0 
-    try:
-        if 'Pm' in rockList:
-            index = rockList.index('Pm') #Minturn Formation
-            index_v2 = rockList[index]
-            where_clause = "{} = '{}'".format(arcpy.AddFieldDelimiters(lyr, fmt), index_v2)
-            queryValue1 = 2 #All values > x degrees after we reclassify the raster
-            queryValue2 = 1000 #Most of the erroneous polygons have a small shape area. This filters out the junk
-            
-            slba = arcpy.SelectLayerByAttribute_management (lyr, 'ADD_TO_SELECTION', where_clause)
-            clip = arcpy.Clip_management(sl, '#', opTemp, slba, '#', 'ClippingGeometry')
-            sl_int = arcpy.Int_3d(clip, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_int'))
-            sl_rc = arcpy.Reclassify_3d(sl_int, 'VALUE', '0 27.5 1; 27.51 90 2', os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_rc'))
-            ls = arcpy.RasterToPolygon_conversion(sl_rc, os.path.join(env.scratchWorkspace, os.path.basename(inDEM)[:-4] + '_rtp'), 'SIMPLIFY', 'Value')
-            
-            #export the final polygons
-            where_clause2 = "{} = {}".format('gridcode', queryValue1) + ' AND ' + "{} > {}".format('Shape_Area', queryValue2)
-            append = arcpy.Select_analysis(ls, os.path.join(env.workspace, os.path.basename(inDEM)[:-4] + index_v2 + '_LandslideHazards'), where_clause2)
-            arcpy.Append_management(append, target, 'NO_TEST')
-            
-            fields = ['fmt', 'Hazard_Type']
-            with arcpy.da.UpdateCursor(target, fields) as cursor:
-                for row in cursor:
-                    if (row[0] == None):
-                        row[0] = index_v2
-                        row[1] = ht
-                    cursor.updateRow(row)
-            del cursor, row
-            
-    except:
-        pass
\ No newline at end of file
+    if unitThresholds:
+        #burn the geology units onto the DEM grid once, then test every cell against its own unit's threshold
+        info = arcio.describe_raster(inDEM)
+        with trace.stage('rasterize units', cellsOut=info.rows * info.cols):
+            labels, idToUnit = arcio.rasterize_units(inGeo, fmt, list(unitThresholds), inDEM)
+        bands = len(bandOffsets)
+        stamps = {}
+        for labelId, unit in idToUnit.items():
+            bandNames = terrain.band_names([unitThresholds[unit] + o for o in bandOffsets])
+            for band, bandName in enumerate(bandNames, 1):
+                stamps[(labelId - 1) * bands + band] = (unitClasses[unit][units.LANDSLIDE], ht, bandName)
+        fields = [('gridcode', 'LONG', None), ('fmt', 'TEXT', 50), ('Hazard_Type', 'TEXT', 50), ('Slope_Band', 'TEXT', 20)]
+    
+        #record the workflow, then run only what the final polygons need. The zonal test and
+        #the band lookup are fused into one chunked pass; no raster or feature class in between
+        #goes to disk, and each one is let go as soon as the next step has read it
+        wf = graph.Workflow(intermediates)
+        #slope from the shared Horn-gradient engine (same values Slope_3d 'DEGREE' gives),
+        #through the derivative cache so Rockfall and reruns on this DEM reuse it
+        slope = wf.source('slope', lambda: arcio.cached_terrain(inDEM, ['slope'])[0]['slope'])
+        #one sorted lookup per cell for all of the bands; gridcode = (label id - 1) * bands + band
+        hazard = wf.zonal_bands(slope, wf.source('unit labels', lambda: labels), zonal.threshold_array(idToUnit, unitThresholds), bandOffsets)
+        #drop the regions too small to pass the Shape_Area filter before they get polygonized
+        hazard = wf.sieve(hazard, info.cellWidth * info.cellHeight, queryValue2)
+        #polygonize all of the units and bands at once, into columns rather than a scratch _rtp feature class
+        ls = wf.apply('RasterToPolygon', lambda h: arcio.polygonize(arcio.to_raster(h, info, terrain.CLASS_NODATA)), [hazard])
+        #filter the junk and stamp the unit code, hazard type and band on the columns
+        final = wf.apply('filter + stamp', lambda p: p.take(p['Shape_Area'] > queryValue2).stamp(
+            'gridcode', [name for name, ftype, length in fields[1:]], stamps), [ls])
+        final, = wf.compute([final], trace)
+        del labels
+        print (cache.default_cache().report())
+    
+        #write the final polygons in one pass
+        target = os.path.join(env.workspace, base + '_LandslideHazards')
+        env.addOutputsToMap = 1
+        with trace.stage('export', featuresIn=len(final)) as st:
+            st.featuresOut = arcio.write_columns(final, target, info.spatialReference, fields)
+        env.addOutputsToMap = 0
+    else:
+        print ('{} has no units with a landslide slope rule in {} County'.format(inGeo, county))
+    print (intermediates.report())
+finally:
+    intermediates.close()
+    trace.close()
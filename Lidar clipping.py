@@ -2,67 +2,236 @@
 #of Interest (AOI) and clips a DEM (in this case, lidar) for that area by 
 #quadrangle, and then creates a hillshade for that. This logic can be applied
 #to work in other Areas of Interest (AOI)
+#
+#The quads are independent, so they are farmed out to a pool of worker
+#processes. Each worker writes into its own scratch geodatabase (file gdbs
+#don't like several processes writing at once) and the finished products are
+#merged into env.workspace at the end, in quad-name order. The quad buffers
+#are geometries in memory and never become feature classes.
+#
+#Reruns are incremental: a manifest records what every quad was built from
+#(quad geometry, mosaic signature, parameters), and only quads that are new,
+#stale or missing outputs get rebuilt.
+#
+#The quads in the county are found with an in-process spatial index and the
+#clips read only the part of the mosaic under each buffered quad, so the
+#script runs from the feature classes themselves and doesn't need the
+#project open in ArcGIS Pro.
+#
+#The mosaic is on the N:\ share, so it is read through a local tile cache
+#(gdt.prefetch): while the workers clip, the main process reads the windows
+#of the next few quads down the list into the cache on background threads, so
+#the share reads overlap the computing, and a rerun reads its windows from the
+#local disk.
 #--------------------- 
 
 
 #import system modules
 #---------------------
-import arcpy, os
+import arcpy, hashlib, os, sys
 from arcpy import env
-from arcpy.sa import *
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gdt import arcio, contour, manifest, parallel, profiling, terrain, tiling
 arcpy.CheckOutExtension('Spatial')
 arcpy.CheckOutExtension('3D')
 env.workspace = r'C:\Users\mpalkovic\Documents\ArcGIS\Projects\WeldCoMaps\WeldCoMaps.gdb'
 env.overwriteOutput = False
 env.addOutputsToMap = False
-
-#definition query
-#---------------
-aprx = arcpy.mp.ArcGISProject('CURRENT')
-m = aprx.listMaps('WeldCo')[0]
-for l in m.listLayers():
-    if l.name == 'COUNTIES_DOLA_2016':
-        l.definitionQuery = """"COUNTY" = 'WELD'"""
+outWorkspace = env.workspace #the workers swap env.workspace for their own scratch gdb
 
 #define variables
 #----------------
 inLidar = r'N:\LIBRARY\Data\GIS data library\LiDAR\Lincoln, Elbert, Arapahoe, Adams, Denver, Morgan, Weld counties composite\Blocks_1_4\total_mosaic.img'
-inQuads = 'Quads24k_USDA_python' #SelectLayerByLocation wont accept a file path for an input, must be local to the mxd/aprx project
-inCounty = 'COUNTIES_DOLA_2016'
-fields = ['quad_name', 'SHAPE@']
-arcpy.SelectLayerByLocation_management (inQuads, 'WITHIN', inCounty)
-
-#iterate through each row in a feature class using a search cursor
-#-----------------------------------------------------------------
-with arcpy.da.SearchCursor (inQuads, fields) as cursor:
-    for row in cursor:
-        try:
-            #outFC = os.path.join(env.workspace, (row[0][:13]))
-            outBuff = arcpy.Buffer_analysis(row[1], (row[0][:10]) + '_bf', '1 mile')
-            outClip = arcpy.Clip_management(inLidar, '#', (row[0][:9]) + '_dem', outBuff, '#', 'ClippingGeometry', 'NO_MAINTAIN_EXTENT')
-            arcpy.HillShade_3d(outClip, (row[0][:10]) + '_hs')
-            arcpy.Slope_3d(outClip, (row[0][:10]) + '_sl')
-            arcpy.Aspect_3d(outClip, (row[0][:10]) + '_as')
-            arcpy.Contour_3d(outClip, (row[0][:10]) + '_ct', 100)
-        except:
-            print (arcpy.GetMessages())
-            pass
-
-#delete the buffered polygons
-#----------------------------
-dList = [fc for fc in arcpy.ListFeatureClasses() if fc.endswith('bf')]
-#print (dList)
-for fc in dList:
-    arcpy.Delete_management(fc)
-
-#Build pyramids for the rasters
-#-------------------------------
-pList = arcpy.ListRasters()
-print (pList)
-
-for raster in pList:
+inQuads = os.path.join(outWorkspace, 'Quads24k_USDA_python') #feature class paths; no mxd/aprx layers needed
+inCounty = os.path.join(outWorkspace, 'COUNTIES_DOLA_2016')
+countyQuery = """"COUNTY" = 'WELD'"""
+fields = ['quad_name', 'SHAPE@JSON'] #JSON so the geometry can be shipped to the worker processes
+tileSize = tiling.DEFAULT_TILE_SIZE #cells per side for the windowed derivatives, bounds peak memory
+workers = parallel.default_workers() #set to 1 to process the quads one at a time in this process
+scratchRoot = os.path.join(os.path.dirname(outWorkspace), 'quad_scratch') #one scratch gdb per worker goes in here
+suffixes = ['_dem', '_hs', '_sl', '_as', '_ct'] #products kept for every quad
+bufferDistance = '1 mile'
+contourInterval = 100
+contourBase = 0 #contours are drawn at contourBase + k * contourInterval
+manifestFile = os.path.join(os.path.dirname(outWorkspace), 'quad_manifest.json') #what each quad was last built from
+useTileCache = True #read the mosaic through the local tile cache (GDT_TILE_CACHE) with read-ahead; False reads the share directly
+readAheadQuads = 2 #quads after the running ones whose windows are read into the tile cache at a time
+
+
+def out_names(quadName):
+    #deterministic output names, same as the serial script has always used
+    return {'_dem': quadName[:9] + '_dem',
+            '_hs': quadName[:10] + '_hs',
+            '_sl': quadName[:10] + '_sl',
+            '_as': quadName[:10] + '_as',
+            '_ct': quadName[:10] + '_ct'}
+
+
+def init_worker(root):
+    #every worker process gets a private scratch gdb as its workspace
+    gdb = 'worker_{}.gdb'.format(os.getpid())
+    if not arcpy.Exists(os.path.join(root, gdb)):
+        arcpy.CreateFileGDB_management(root, gdb)
+    env.workspace = env.scratchWorkspace = os.path.join(root, gdb)
+    env.overwriteOutput = True #only ever overwrites this worker's own leftovers
+    env.addOutputsToMap = False
+
+
+def buffered_quad(quadJSON, bufferDistance):
+    #an empty Geometry as the output makes Buffer return the geometries instead of writing a _bf feature class
+    return arcpy.Buffer_analysis(arcpy.AsShape(quadJSON, True), arcpy.Geometry(), bufferDistance)[0]
+
+
+def clip_quad(quadName, quadJSON, inLidar, tileSize, bufferDistance, contourInterval, contourBase, useTileCache=False):
+    #buffer, clip and derive one quad. Returns the full paths of its products
+    names = out_names(quadName)
+    trace = profiling.Trace('clip_quad ' + quadName, None) #silent in the workers; GDT_TRACE gets one JSON per quad
     try:
-        arcpy.BuildPyramids_management(raster)
-    except:
-        print (arcpy.GetMessages())
-        pass   
+        with trace.stage('buffer + clip') as st:
+            buffGeometry = buffered_quad(quadJSON, bufferDistance)
+            #reads only the mosaic window under the buffer's bounding box, from the tile cache where it can
+            mosaic = arcio.cached_source(inLidar) if useTileCache else None
+            try:
+                outClip = arcio.clip_to_geometry(inLidar, buffGeometry, os.path.join(env.workspace, names['_dem']), tileSize,
+                                                 source=mosaic)
+            finally:
+                if mosaic is not None:
+                    mosaic.close()
+            demSource = arcio.RasterSource(outClip)
+            info = demSource.info
+            st.cellsOut = info.rows * info.cols
+        #hillshade, slope and aspect from one gradient pass, streamed tile by
+        #tile so the quad never has to fit in memory
+        writers = {}
+        for product, sfx, pixelType, nodata in [('hillshade', '_hs', '16_BIT_SIGNED', -1),
+                                                ('slope', '_sl', '32_BIT_FLOAT', None),
+                                                ('aspect', '_as', '32_BIT_FLOAT', None)]:
+            writers[product] = arcio.RasterWriter(os.path.join(env.workspace, names[sfx]), info, pixelType, nodata)
+        stage = lambda block: terrain.derivatives(block, info.cellWidth, info.cellHeight, list(writers))
+        with trace.stage('derivatives', cellsIn=info.rows * info.cols, cellsOut=3 * info.rows * info.cols):
+            tiling.map_tiles(demSource, stage, writers, tileSize)
+        #contours tile by tile, stitched across the seams and written in batches
+        with trace.stage('contours', cellsIn=info.rows * info.cols) as st:
+            ctWriter = arcio.ContourWriter(os.path.join(env.workspace, names['_ct']), info)
+            st.featuresOut = contour.contour_tiles(demSource, contourInterval, ctWriter, contourBase, tileSize)
+            ctWriter.close()
+    except arcpy.ExecuteError:
+        #hand the geoprocessing messages back to the main process for the report
+        raise RuntimeError(arcpy.GetMessages(2))
+    finally:
+        trace.close()
+    return dict((s, os.path.join(env.workspace, names[s])) for s in suffixes)
+
+
+def merge_outputs(results, workspace):
+    #copy each finished quad's products into the project gdb, in job order,
+    #replacing the stale copies from an earlier run
+    for r in results:
+        if not r.ok:
+            continue
+        for s in sorted(r.value):
+            target = os.path.join(workspace, os.path.basename(r.value[s]))
+            try:
+                if arcpy.Exists(target):
+                    arcpy.Delete_management(target)
+                arcpy.Copy_management(r.value[s], target)
+            except arcpy.ExecuteError:
+                r.ok = False
+                r.error = (r.error or '') + 'merge of {} failed: {}\n'.format(target, arcpy.GetMessages(2))
+
+
+if __name__ == '__main__':
+    #per-stage timings; set GDT_TRACE / GDT_PROFILE for a JSON trace / cProfile
+    with profiling.Trace('Lidar clipping') as trace:
+
+        #the quads within the county, sorted so the run is repeatable
+        #-------------------------------------------------------------
+        with trace.stage('select quads') as st:
+            quads = sorted(arcio.select_within(inQuads, fields, inCounty, countyQuery))
+            st.featuresOut = len(quads)
+        seen = {}
+        for q, shape in quads:
+            for s, name in out_names(q).items():
+                if name in seen and seen[name] != q:
+                    raise ValueError('{} and {} would both write {}'.format(seen[name], q, name))
+                seen[name] = q
+
+        #skip the quads whose outputs are current
+        #-----------------------------------------
+        done = manifest.Manifest(manifestFile, arcpy.Exists)
+        mosaicSignature = arcio.raster_identity(inLidar)
+        signatures = {}
+        for q, shape in quads:
+            signatures[q] = manifest.signature(quad=hashlib.sha1(shape.encode()).hexdigest(), mosaic=mosaicSignature,
+                                               buffer=bufferDistance, contour=contourInterval, base=contourBase, products=suffixes)
+        stale = [(q, shape) for q, shape in quads if not done.is_current(q, signatures[q])]
+        print ('{} of {} quads are current, rebuilding {}'.format(len(quads) - len(stale), len(quads), len(stale)))
+
+        #clip the quads in parallel
+        #--------------------------
+        if not os.path.isdir(scratchRoot):
+            os.makedirs(scratchRoot)
+        jobs = [(q, (q, shape, inLidar, tileSize, bufferDistance, contourInterval, contourBase, useTileCache))
+                for q, shape in stale]
+        #read-ahead: the mosaic windows of the quads after the first batch go into the
+        #tile cache in job order while the workers are busy (the first batch starts
+        #right away, so it reads for itself). Only readAheadQuads of them at a time,
+        #one more as each job finishes, so the warmed blocks stay well under the
+        #cache cap and the threads don't take the share from the workers
+        readAhead = arcio.cached_source(inLidar) if useTileCache and stale else None
+        ahead = stale[workers:] if readAhead is not None else []
+        def read_ahead(result=None):
+            while ahead:
+                window = arcio.raster_window(readAhead.info, buffered_quad(ahead.pop(0)[1], bufferDistance).extent)
+                if window is not None:
+                    readAhead.prefetch(*window, keep=False)
+                    return
+        for k in range(readAheadQuads):
+            read_ahead()
+        with trace.stage('clip quads', featuresIn=len(jobs)) as st:
+            try:
+                results = parallel.run_jobs(clip_quad, jobs, workers, init_worker, (scratchRoot,), onDone=read_ahead)
+            finally:
+                if readAhead is not None:
+                    readAhead.close()
+            st.featuresOut = sum(1 for r in results if r.ok)
+        if readAhead is not None:
+            print ('{} ({} blocks read ahead from the share)'.format(readAhead.cache.report(), readAhead.sourceReads))
+        env.workspace = outWorkspace #workers=1 ran init_worker in this process
+        env.overwriteOutput = False
+
+        #merge the products into the project gdb and report on every quad
+        #---------------------------------------------------------------
+        with trace.stage('merge'):
+            merge_outputs(results, outWorkspace)
+        for r in results:
+            if r.ok:
+                outputs = [os.path.join(outWorkspace, os.path.basename(p)) for p in r.value.values()]
+                #products of the quad's last build that this one didn't make (e.g. the _ovN sidecars of earlier versions)
+                for old in done.jobs.get(r.key, {}).get('outputs', []):
+                    if old not in outputs and arcpy.Exists(old):
+                        arcpy.Delete_management(old)
+                done.record(r.key, signatures[r.key], outputs)
+            else:
+                done.forget(r.key)
+        report = parallel.write_report(results, os.path.join(scratchRoot, 'quad_report.csv'))
+        failed = [r for r in results if not r.ok]
+        for r in failed:
+            print ('{} FAILED\n{}'.format(r.key, r.error))
+        print ('{} of {} quads done, report in {}'.format(len(results) - len(failed), len(results), report))
+
+        #delete the worker scratch gdbs (the pre-merge copies)
+        #----------------------------------------------------------------
+        for gdb in os.listdir(scratchRoot):
+            if gdb.startswith('worker_') and gdb.endswith('.gdb'):
+                arcpy.Delete_management(os.path.join(scratchRoot, gdb))
+
+        #Build pyramids for the rasters rebuilt in this run, spread over the worker pool
+        #-------------------------------------------------------------------------------
+        pList = [os.path.join(outWorkspace, os.path.basename(r.value[sfx])) for r in results if r.ok for sfx in suffixes if sfx != '_ct']
+        print (pList)
+        with trace.stage('pyramids', featuresIn=len(pList)):
+            pyramids = parallel.run_jobs(arcio.build_pyramids, [(p, (p,)) for p in pList], workers)
+        for r in pyramids:
+            if not r.ok:
+                print ('pyramids for {} FAILED\n{}'.format(r.key, r.error))
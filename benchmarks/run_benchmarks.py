@@ -0,0 +1,469 @@
+"""
+Source Name:   run_benchmarks.py
+Description:   Times the hazard workflows on synthetic data, without ArcGIS.
+
+               The arcpy stand-in in benchmarks/standin is put first on
+               sys.path, synthetic DEMs and geology are registered in its
+               catalog (at the N:\\ and C:\\ paths the scripts hardcode), and
+               then the real code runs: the Rockfall and Debris_Flow (whole
+               DEM and tiled), Landslide, Problematic_Soils and Geologic_Hazards tools from
+               the toolbox, LandslideTesting.py, Lidar clipping.py and
+               Hazard batch.py. lidar_clipping_share runs Lidar clipping
+               twice against a mosaic whose reads are throttled like the
+               N:\\ share, to show the read-ahead and the tile cache.
+
+               For every workflow and size it reports wall time, peak traced
+               memory and output counts, plus the same per stage: every
+               arcpy tool and the gdt engine functions. Stage times are
+               inclusive, so an engine stage that reads tiles through
+               RasterToNumPyArray also counts that read.
+
+               --check instead runs the tiled and whole-DEM paths of Rockfall
+               and Debris_Flow (on a drained DEM, see check_debris_flow), and
+               a cached and a freshly computed slope, on DEMs larger than a
+               tile plus its halo, and compares the results cell for cell
+               (np.array_equal); it exits non-zero if any pair differs.
+
+               usage: python benchmarks/run_benchmarks.py [--sizes 512 1024 2048]
+                          [--workflows rockfall landslide ...] [--warm] [--json out.json]
+                      python benchmarks/run_benchmarks.py --check [--seed 0]
+
+               Run it on a machine without arcpy (the scripts' C:\\ folders
+               end up relative to a temporary directory there).
+"""
+#-----------------------------------------------------------------------------
+
+import argparse, contextlib, functools, json, os, runpy, shutil, sys, tempfile, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(HERE, 'standin'))
+sys.path.insert(1, ROOT)
+sys.path.insert(2, HERE)
+
+import arcpy
+import numpy as np
+
+from gdt import cache, contour, flow, geostore, parallel, prefetch, regions, terrain, tiling, units, zonal
+import synthetic
+
+CELL_SIZE = 3.0 #metres, about 10 ft lidar
+SR = arcpy.SpatialReference(26913, 'NAD_1983_UTM_Zone_13N')
+LANDSLIDE_GEO = r'N:\LIBRARY\Archive\PUBLISHED\OF-OPEN-FILE_SERIES\2000s\OF-02-07 Breckenridge\OF-02-07 FINAL FILES\GIS_Data\geol_poly.shp'
+LANDSLIDE_WS = r'C:\Users\mpalkovic\Documents\ArcGIS\Default.gdb'
+LIDAR_MOSAIC = r'N:\LIBRARY\Data\GIS data library\LiDAR\Lincoln, Elbert, Arapahoe, Adams, Denver, Morgan, Weld counties composite\Blocks_1_4\total_mosaic.img'
+LIDAR_WS = r'C:\Users\mpalkovic\Documents\ArcGIS\Projects\WeldCoMaps\WeldCoMaps.gdb'
+WORKFLOWS = ['rockfall', 'rockfall_tiled', 'rockfall_bands', 'debris_flow', 'debris_flow_tiled', 'landslide', 'problematic_soils', 'geologic_hazards',
+             'landslide_testing', 'lidar_clipping', 'lidar_clipping_share', 'hazard_batch']
+SHARE_LATENCY = 0.02 #seconds per read of the throttled mosaic
+SHARE_BANDWIDTH = 50 * 1024 ** 2 #bytes per second
+
+#gdt functions timed as stages, (module, name)
+ENGINE_STAGES = [(terrain, 'derivatives'), (terrain, 'classify_slope'),
+                 (terrain, 'severity_bands'), (regions, 'sieve'), (zonal, 'zonal_bands'), (units, 'classify'),
+                 (geostore, 'cached'), (geostore.GeologyStore, 'mask'),
+                 (flow, 'fill_depressions'), (flow, 'flow_directions'), (flow, 'accumulate'),
+                 (tiling, 'map_tiles'), (contour, 'contour_tiles'),
+                 (cache.DerivativeCache, 'terrain_products')]
+
+
+#stage timing
+#------------
+class StageLog(object):
+    """
+    Wall time, peak traced memory and sizes per stage. Peaks are tracked
+    through nested stages with tracemalloc.reset_peak, so each stage gets the
+    highest memory in use while it ran (above what was in use when it began).
+    """
+    def __init__(self):
+        self.stages = {}
+        self.stack = []
+
+    def start(self):
+        tracemalloc.start()
+        self.stack = [[0, 0]]
+
+    def stop(self):
+        """Peak traced bytes since start."""
+        peak = max(self.stack[0][1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        return peak
+
+    def wrap(self, name, func, size):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            current, peak = tracemalloc.get_traced_memory()
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.stack.append([current, current])
+            start = time.perf_counter()
+            try:
+                out = func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                began, highest = self.stack.pop()
+                highest = max(highest, tracemalloc.get_traced_memory()[1])
+                self.stack[-1][1] = max(self.stack[-1][1], highest)
+                s = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_mb': 0.0, 'size': 0})
+                s['calls'] += 1
+                s['seconds'] += seconds
+                s['peak_mb'] = max(s['peak_mb'], (highest - began) / 1024.0 ** 2)
+            s['size'] += size(args, out)
+            return out
+        return timed
+
+
+def _cells(args, out):
+    #cells in the first array argument, else a count the stage returned (e.g. contour lines)
+    for a in args:
+        if isinstance(a, np.ndarray):
+            return int(a.size)
+    return out if isinstance(out, int) else 0
+
+
+def instrument(log):
+    """Wrap the arcpy tools and the gdt engine stages; returns the undo list."""
+    undo = []
+    for name in dir(arcpy):
+        func = getattr(arcpy, name)
+        if callable(func) and (name.endswith(('_management', '_analysis', '_conversion'))
+                               or name in ('NumPyArrayToRaster', 'RasterToNumPyArray')):
+            undo.append((arcpy, name, func))
+            setattr(arcpy, name, log.wrap(name, func, lambda args, out: arcpy.output_size(out)))
+    for owner, name in ENGINE_STAGES:
+        func = owner.__dict__[name]
+        undo.append((owner, name, func))
+        setattr(owner, name, log.wrap('gdt.{}.{}'.format(getattr(owner, '__name__', owner).split('.')[-1], name), func, _cells))
+    return undo
+
+
+def uninstrument(undo):
+    for owner, name, func in reversed(undo):
+        setattr(owner, name, func)
+
+
+#synthetic data in the stand-in catalog
+#-------------------------------------
+def register_dem(path, dem, x0=500000.0, y0=4400000.0):
+    data = arcpy._RasterData(dem, x0, y0 + dem.shape[0] * CELL_SIZE, CELL_SIZE, CELL_SIZE, None, SR)
+    return arcpy.register(path, data)
+
+
+def register_polygons(path, boxes, fields):
+    """boxes is [((xmin, ymin, xmax, ymax), {field: value})]."""
+    fc = arcpy._FeatureData('Polygon', [arcpy.Field(f, 'String', 254) for f in fields], SR)
+    for b, attrs in boxes:
+        row = dict((k.lower(), v) for k, v in attrs.items())
+        row['shape'] = arcpy.box(*b, spatialReference=SR)
+        fc.insert(row)
+    return arcpy.register(path, fc)
+
+
+def build_inputs(size, seed):
+    dem = synthetic.fractal_dem(size, size, CELL_SIZE, seed)
+    extent = (500000.0, 4400000.0, 500000.0 + size * CELL_SIZE, 4400000.0 + size * CELL_SIZE)
+    geo = synthetic.geology(*extent, count=max(24, size * size // 20000), seed=seed)
+    return dem, extent, [(b, {'FMT': u, 'DESCRIPTIO': u}) for b, u in geo]
+
+
+#workflows
+#---------
+class _Param(object):
+    def __init__(self, value):
+        self.value = value
+        self.valueAsText = None if value is None else str(value)
+
+
+def _toolbox():
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('hazard_derivative_tools', os.path.join(ROOT, 'Hazard Derivative Tools.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _features(path):
+    return len(arcpy._get(path).rows) if arcpy.Exists(path) else 0
+
+
+def run_rockfall(work, dem, extent, geo, tileSize=None, thresholds=None):
+    inDEM = register_dem(os.path.join(work, 'data', 'dem.tif'), dem).path
+    outPolys = os.path.join(work, 'out.gdb', 'rockfall')
+    _toolbox().Rockfall().execute([_Param(os.path.join(work, 'scratch.gdb')), _Param(inDEM), _Param(outPolys), _Param(tileSize),
+                                   _Param(thresholds)], None)
+    return {'rockfall_polygons': _features(outPolys + '_rf'), 'rockfall_final': _features(outPolys + '_final')}
+
+
+def run_rockfall_tiled(work, dem, extent, geo):
+    return run_rockfall(work, dem, extent, geo, tileSize=512)
+
+
+def run_rockfall_bands(work, dem, extent, geo):
+    return run_rockfall(work, dem, extent, geo, thresholds='30;40;50')
+
+
+def run_debris_flow(work, dem, extent, geo, tileSize=None, minArea=None):
+    inDEM = register_dem(os.path.join(work, 'data', 'dem.tif'), dem).path
+    inGeo = register_polygons(os.path.join(work, 'data', 'geol_poly.shp'), geo, ['FMT', 'DESCRIPTIO']).path
+    outPolys = os.path.join(work, 'out.gdb', 'debris_flow')
+    _toolbox().Debris_Flow().execute([_Param(os.path.join(work, 'scratch.gdb')), _Param(inDEM), _Param(inGeo), _Param(outPolys),
+                                      _Param(tileSize), _Param('15;30'), _Param(minArea)], None)
+    return {'debris_flow_polygons': _features(outPolys + '_df'), 'debris_flow_final': _features(outPolys + '_final')}
+
+
+def run_debris_flow_tiled(work, dem, extent, geo):
+    return run_debris_flow(work, dem, extent, geo, tileSize=512)
+
+
+def run_landslide(work, dem, extent, geo):
+    inGeo = register_polygons(os.path.join(work, 'data', 'geol_poly.shp'), geo, ['FMT', 'DESCRIPTIO']).path
+    out = os.path.join(work, 'out.gdb', 'landslide')
+    _toolbox().Landslide().execute([_Param(work), _Param(inGeo), _Param(out)], None)
+    return {'geology': len(geo), 'landslide': _features(out)}
+
+
+def run_problematic_soils(work, dem, extent, geo):
+    inGeo = register_polygons(os.path.join(work, 'data', 'geol_poly.shp'), geo, ['FMT', 'DESCRIPTIO']).path
+    rock, soil = os.path.join(work, 'out.gdb', 'rock'), os.path.join(work, 'out.gdb', 'soil')
+    _toolbox().Problematic_Soils().execute([_Param(work), _Param(inGeo), _Param(rock), _Param(soil)], None)
+    return {'geology': len(geo), 'problematic_rock': _features(rock), 'problematic_soil': _features(soil)}
+
+
+def run_geologic_hazards(work, dem, extent, geo):
+    inGeo = register_polygons(os.path.join(work, 'data', 'geol_poly.shp'), geo, ['FMT', 'DESCRIPTIO']).path
+    outs = [os.path.join(work, 'out.gdb', n) for n in ('landslide', 'rock', 'soil')]
+    _toolbox().Geologic_Hazards().execute([_Param(inGeo)] + [_Param(o) for o in outs], None)
+    return dict([('geology', len(geo))] + [(os.path.basename(o), _features(o)) for o in outs])
+
+
+def run_landslide_testing(work, dem, extent, geo):
+    register_dem(LANDSLIDE_WS + '\\BreckDEM', dem)
+    register_polygons(LANDSLIDE_GEO, geo, ['FMT', 'DESCRIPTIO'])
+    runpy.run_path(os.path.join(ROOT, 'LandslideTesting.py'), run_name='landslide_testing')
+    return {'geology': len(geo), 'landslide_hazards': _features(LANDSLIDE_WS + '\\Brec_LandslideHazards')}
+
+
+def run_lidar_clipping(work, dem, extent, geo, runs=1):
+    register_dem(LIDAR_MOSAIC, dem)
+    n = max(2, dem.shape[0] // 1024)
+    quads = synthetic.quads(*extent, nx=n, ny=n)
+    xmin, ymin, xmax, ymax = extent
+    #plus a row of quads in the next county over, which the selection has to leave out
+    outside = synthetic.quads(xmax, ymin, xmax + (xmax - xmin), ymax, nx=n, ny=n)
+    register_polygons(LIDAR_WS + '\\Quads24k_USDA_python', [(b, {'quad_name': 'L' + q[1:]}) for q, b in outside] +
+                      [(b, {'quad_name': q}) for q, b in quads], ['quad_name'])
+    counties = [((xmin, ymin, xmax, ymax), {'COUNTY': 'WELD'}),
+                ((xmax, ymin, xmax + (xmax - xmin), ymax), {'COUNTY': 'LARIMER'})]
+    register_polygons(LIDAR_WS + '\\COUNTIES_DOLA_2016', counties, ['COUNTY'])
+    defaultWorkers = parallel.default_workers
+    parallel.default_workers = lambda: 1 #the stand-in catalog lives in this process
+    try:
+        for k in range(runs):
+            if k:
+                os.remove(os.path.join(os.path.dirname(LIDAR_WS), 'quad_manifest.json')) #rebuild every quad
+            runpy.run_path(os.path.join(ROOT, 'Lidar clipping.py'), run_name='__main__')
+    finally:
+        parallel.default_workers = defaultWorkers
+    prefix = arcpy._key(LIDAR_WS) + '/'
+    outputs = [k for k in arcpy._catalog if k.startswith(prefix)]
+    contours = sum(len(arcpy._catalog[k].rows) for k in outputs if k.endswith('_ct'))
+    return {'quads': len(quads), 'rasters': sum(1 for k in outputs if isinstance(arcpy._catalog[k], arcpy._RasterData)),
+            'contour_lines': contours}
+
+
+def run_lidar_clipping_share(work, dem, extent, geo):
+    #every read of the mosaic waits like one over the network; the second run should find its windows in the tile cache
+    reads = {'count': 0, 'bytes': 0}
+    def throttled(func):
+        @functools.wraps(func)
+        def read(in_raster, *args, **kwargs):
+            out = func(in_raster, *args, **kwargs)
+            if arcpy.Describe(in_raster).catalogPath == arcpy._get(LIDAR_MOSAIC).path:
+                reads['count'] += 1
+                reads['bytes'] += out.nbytes
+                time.sleep(SHARE_LATENCY + out.nbytes / float(SHARE_BANDWIDTH))
+            return out
+        return read
+    rasterToNumPyArray = arcpy.RasterToNumPyArray
+    arcpy.RasterToNumPyArray = throttled(rasterToNumPyArray)
+    try:
+        counts = run_lidar_clipping(work, dem, extent, geo, runs=2)
+    finally:
+        arcpy.RasterToNumPyArray = rasterToNumPyArray
+    counts['share_reads'] = reads['count']
+    counts['share_mb'] = round(reads['bytes'] / 1024.0 ** 2, 1)
+    return counts
+
+
+def run_hazard_batch(work, dem, extent, geo, aois=3):
+    #the same DEM and geology under several AOI names, three tools each, on one in-process worker
+    aoiCSV = os.path.join(work, 'hazard_aois.csv')
+    with open(aoiCSV, 'w') as f:
+        f.write('aoi,dem,geology,workspace\n')
+        for k in range(aois):
+            inDEM = register_dem(os.path.join(work, 'data', 'dem{}.tif'.format(k)), dem).path
+            inGeo = register_polygons(os.path.join(work, 'data', 'geol{}.shp'.format(k)), geo, ['FMT', 'DESCRIPTIO']).path
+            f.write('AOI {},{},{},{}\n'.format(k, inDEM, inGeo, os.path.join(work, 'aoi{}.gdb'.format(k))))
+    argv = sys.argv
+    sys.argv = ['Hazard batch.py', aoiCSV, '--workers', '1'] #the stand-in catalog lives in this process
+    try:
+        runpy.run_path(os.path.join(ROOT, 'Hazard batch.py'), run_name='__main__')
+    finally:
+        sys.argv = argv
+    import csv
+    with open(os.path.join(work, 'hazard_batch_summary.csv')) as f:
+        rows = list(csv.DictReader(f))
+    counts = {'jobs': len(rows), 'failed': sum(1 for r in rows if r['status'] != 'OK')}
+    for name in ('rockfall_final', 'landslide', 'problematic_rock', 'problematic_soil'):
+        counts[name] = sum(int(r[name]) for r in rows if r.get(name))
+    return counts
+
+
+@contextlib.contextmanager
+def workspace():
+    """A temporary working directory with an empty catalog and empty caches, removed afterwards."""
+    work = tempfile.mkdtemp(prefix='gdt_bench_')
+    cwd = os.getcwd()
+    os.chdir(work)
+    arcpy.reset()
+    cache._default = cache.DerivativeCache(os.path.join(work, 'cache'))
+    prefetch._default = prefetch.TileCache(os.path.join(work, 'tiles'))
+    geostore._stores.clear()
+    try:
+        yield work
+    finally:
+        os.chdir(cwd)
+        cache._default = None
+        prefetch._default = None
+        geostore._stores.clear()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def run_one(workflow, size, seed, warm=False):
+    """Run one workflow on fresh synthetic data; returns its report dict."""
+    dem, extent, geo = build_inputs(size, seed)
+    func = globals()['run_' + workflow]
+    log = StageLog()
+    with workspace() as work:
+        if warm:
+            func(work, dem, extent, geo) #fills the derivative cache
+            arcpy.reset()
+        undo = instrument(log)
+        log.start()
+        start = time.perf_counter()
+        try:
+            counts = func(work, dem, extent, geo)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = log.stop()
+            uninstrument(undo)
+    return {'workflow': workflow, 'size': size, 'cells': size * size, 'warm': warm, 'seconds': seconds,
+            'peak_mb': peak / 1024.0 ** 2, 'outputs': counts, 'stages': log.stages}
+
+
+CHECK_TILE = 512
+CHECK_MIN_AREA = 6000.0 #m2, over FLOW_HALO cells of 3 m, so flow.flow_halo widens the halo (to 667 cells)
+CHECKS = [('rockfall', 1300), ('rockfall_bands', 1300), ('debris_flow', 1900), ('derivative_cache', 1300)] #> tile + 2 halos, ragged last tile
+
+
+def _polygonized(func, *args, **kwargs):
+    """
+    Run a workflow and keep the class raster of every RasterToPolygon call,
+    keyed by the suffix of the output ('rf', 'df'). Returns (outputs, arrays).
+    """
+    arrays = {}
+    rasterToPolygon = arcpy.RasterToPolygon_conversion
+    def capture(in_raster, out_polygon_features, *a, **kw):
+        arrays[str(out_polygon_features).rsplit('_', 1)[-1]] = arcpy._get(in_raster).array().copy()
+        return rasterToPolygon(in_raster, out_polygon_features, *a, **kw)
+    arcpy.RasterToPolygon_conversion = capture
+    try:
+        counts = func(*args, **kwargs)
+    finally:
+        arcpy.RasterToPolygon_conversion = rasterToPolygon
+    return counts, arrays
+
+
+def _same_runs(name, suffix, func, work, dem, extent, geo, **kwargs):
+    whole = _polygonized(func, work, dem, extent, geo, tileSize=None, **kwargs)
+    tiled = _polygonized(func, work, dem, extent, geo, tileSize=CHECK_TILE, **kwargs)
+    return [(name + ' classes, tiled vs whole', np.array_equal(whole[1][suffix], tiled[1][suffix])),
+            (name + ' outputs, tiled vs whole', whole[0] == tiled[0])]
+
+
+def check_rockfall(work, dem, extent, geo):
+    return _same_runs('rockfall', 'rf', run_rockfall, work, dem, extent, geo)
+
+
+def check_rockfall_bands(work, dem, extent, geo):
+    return _same_runs('rockfall_bands', 'rf', run_rockfall, work, dem, extent, geo, thresholds='30;40;50')
+
+
+def check_debris_flow(work, dem, extent, geo):
+    #the fractal DEM has depressions that spill further away than the halo, which
+    #filling a tile can't see; on a drained surface tiled flow has to match exactly
+    dem = synthetic.drained_dem(dem.shape[0], dem.shape[1], CELL_SIZE)
+    return _same_runs('debris_flow', 'df', run_debris_flow, work, dem, extent, geo, minArea=CHECK_MIN_AREA)
+
+
+def check_derivative_cache(work, dem, extent, geo):
+    from gdt import arcio
+    inDEM = register_dem(os.path.join(work, 'data', 'dem.tif'), dem).path
+    fresh = terrain.slope(arcio.read_raster(inDEM)[0], CELL_SIZE, CELL_SIZE)
+    miss = arcio.cached_terrain(inDEM, ['slope'])[0]['slope']
+    hit = arcio.cached_terrain(inDEM, ['slope'])[0]['slope']
+    reopened = cache.DerivativeCache(cache.default_cache().root) #another process on the same folder
+    disk = arcio.cached_terrain(inDEM, ['slope'], reopened)[0]['slope']
+    return [('slope, cache miss vs fresh', np.array_equal(miss, fresh, equal_nan=True)),
+            ('slope, cache hit vs fresh', np.array_equal(hit, fresh, equal_nan=True) and cache.default_cache().hits >= 1),
+            ('slope, reopened cache vs fresh', np.array_equal(disk, fresh, equal_nan=True) and reopened.hits == 1)]
+
+
+def run_checks(seed):
+    """Run the equivalence checks; returns [(name, passed)]."""
+    results = []
+    for name, size in CHECKS:
+        dem, extent, geo = build_inputs(size, seed)
+        with workspace() as work:
+            for check, passed in globals()['check_' + name](work, dem, extent, geo):
+                print ('{:<4} {} ({size}x{size})'.format('PASS' if passed else 'FAIL', check, size=size))
+                results.append((check, passed))
+    return results
+
+
+def print_report(r):
+    print ('{workflow} {size}x{size}{w}: {seconds:.2f} s, peak {peak_mb:.0f} MB, outputs {out}'.format(
+        w=' (warm cache)' if r['warm'] else '', out=', '.join('{}={}'.format(k, v) for k, v in sorted(r['outputs'].items())), **r))
+    for name, s in sorted(r['stages'].items(), key=lambda kv: -kv[1]['seconds']):
+        print ('    {:<44} {:>5} calls {:>9.3f} s {:>8.1f} MB {:>12}'.format(name, s['calls'], s['seconds'], s['peak_mb'], s['size']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hazard workflows on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048], help='DEM rows/columns')
+    parser.add_argument('--workflows', nargs='+', default=WORKFLOWS, choices=WORKFLOWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warm', action='store_true', help='time a second run with the derivative cache filled')
+    parser.add_argument('--json', help='also write the reports to this file')
+    parser.add_argument('--check', action='store_true', help='compare tiled vs whole and cached vs fresh results instead of timing')
+    args = parser.parse_args(argv)
+    if args.check:
+        results = run_checks(args.seed)
+        if not all(passed for name, passed in results):
+            sys.exit(1)
+        return results
+    reports = []
+    for size in args.sizes:
+        for workflow in args.workflows:
+            for warm in ([False, True] if args.warm else [False]):
+                r = run_one(workflow, size, args.seed, warm)
+                print_report(r)
+                reports.append(r)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=1)
+    return reports
+
+
+if __name__ == '__main__':
+    main()
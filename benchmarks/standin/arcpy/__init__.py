@@ -0,0 +1,825 @@
+"""
+Source Name:   arcpy (benchmark stand-in)
+Description:   Minimal in-memory stand-in for the arcpy calls the toolbox,
+               LandslideTesting.py and Lidar clipping.py make, so the
+               workflows can be timed on machines without ArcGIS. It is only
+               put on sys.path by benchmarks/run_benchmarks.py.
+
+               Datasets live in a catalog keyed by normalised path; rasters
+               are NumPy arrays and feature classes are lists of rows. It is
+               not a GIS: geometries are simple rings, buffers and clips work
+               on bounding boxes, and RasterToPolygon makes one bounding-box
+               polygon per region carrying that region's exact area. That is
+               enough for the workflows to produce the same selections and
+               counts, which is what the benchmarks check.
+
+               The runner times the tools from the outside, so nothing in
+               here knows about benchmarking beyond reset() and
+               output_size().
+"""
+#-----------------------------------------------------------------------------
+
+import copy, json, math, os, re, shutil, time
+
+import numpy as np
+
+
+class ExecuteError(Exception):
+    pass
+
+
+def _error(message):
+    #like a failed tool, the error is also what GetMessages(2) returns
+    _lastError[0] = message
+    return ExecuteError(message)
+
+
+#environment
+#-----------
+class _Env(object):
+    def __init__(self):
+        self.workspace = None
+        self.scratchWorkspace = None
+        self.overwriteOutput = False
+        self.addOutputsToMap = True
+        self.snapRaster = None
+        self.extent = None
+        self.cellSize = None
+
+env = _Env()
+
+
+class EnvManager(object):
+    def __init__(self, **settings):
+        self.settings = settings
+        self.saved = {}
+
+    def __enter__(self):
+        for k, v in self.settings.items():
+            self.saved[k] = getattr(env, k)
+            setattr(env, k, v)
+        return self
+
+    def __exit__(self, *args):
+        for k, v in self.saved.items():
+            setattr(env, k, v)
+
+
+#messages
+#--------
+messages = []
+_lastError = ['']
+
+
+def reset():
+    """Empty the catalog and the messages and reset env, for the next benchmark run."""
+    _catalog.clear()
+    _layers.clear()
+    del messages[:]
+    env.__init__()
+
+
+def output_size(out):
+    """Features in, or cells of, the dataset a tool returned; 0 for anything else."""
+    data = _catalog.get(_key(out)) if isinstance(out, (Result, Raster)) else None
+    if isinstance(data, _FeatureData):
+        return len(data.rows)
+    if isinstance(data, _RasterData):
+        return data.cells()
+    return 0
+
+
+def AddMessage(message):
+    messages.append(str(message))
+
+
+def GetMessages(severity=0):
+    return _lastError[0] if severity == 2 else '\n'.join(messages)
+
+
+def CheckOutExtension(name):
+    return 'CheckedOut'
+
+
+def AddFieldDelimiters(dataset, field):
+    return '"{}"'.format(field)
+
+
+class Parameter(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        self.value = None
+
+    @property
+    def valueAsText(self):
+        return None if self.value is None else str(self.value)
+
+
+#geometry
+#--------
+class SpatialReference(object):
+    def __init__(self, code=0, name='Unknown'):
+        self.factoryCode = code
+        self.name = name
+
+
+class Point(object):
+    def __init__(self, X=0.0, Y=0.0):
+        self.X = X
+        self.Y = Y
+
+
+class Array(list):
+    pass
+
+
+class Extent(object):
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin, self.YMin, self.XMax, self.YMax = XMin, YMin, XMax, YMax
+
+    @property
+    def lowerLeft(self):
+        return Point(self.XMin, self.YMin)
+
+    @property
+    def width(self):
+        return self.XMax - self.XMin
+
+    @property
+    def height(self):
+        return self.YMax - self.YMin
+
+    def within(self, other):
+        return (self.XMin >= other.XMin and self.YMin >= other.YMin
+                and self.XMax <= other.XMax and self.YMax <= other.YMax)
+
+
+class Geometry(object):
+    """Polygon (rings) or polyline (paths) of (x, y) tuples. area overrides the ring area."""
+    def __init__(self, type=None, parts=(), spatialReference=None, area=None):
+        self.type = type
+        self.parts = parts
+        self.spatialReference = spatialReference
+        self._area = area
+
+    @property
+    def area(self):
+        if self._area is not None:
+            return self._area
+        if self.type != 'polygon':
+            return 0.0
+        total = 0.0
+        for ring in self.parts:
+            x, y = np.asarray(ring, dtype=np.float64).T
+            total += 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+        return total
+
+    @property
+    def length(self):
+        total = 0.0
+        for part in self.parts:
+            p = np.asarray(part, dtype=np.float64)
+            total += np.hypot(*np.diff(p, axis=0).T).sum()
+        return total
+
+    @property
+    def extent(self):
+        p = np.concatenate([np.asarray(part, dtype=np.float64) for part in self.parts])
+        return Extent(p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max())
+
+    @property
+    def JSON(self):
+        return json.dumps({'rings' if self.type == 'polygon' else 'paths': [[list(p) for p in part] for part in self.parts]})
+
+    def within(self, other):
+        #every vertex inside other; enough for the boxes and rings the benchmarks use
+        if not self.extent.within(other.extent):
+            return False
+        p = np.concatenate([np.asarray(part, dtype=np.float64) for part in self.parts])
+        e = other.extent
+        onEdge = (np.isclose(p[:, 0], e.XMin) | np.isclose(p[:, 0], e.XMax) |
+                  np.isclose(p[:, 1], e.YMin) | np.isclose(p[:, 1], e.YMax))
+        return bool(np.all(onEdge | other.contains_points(p[:, 0], p[:, 1])))
+
+    def densify(self, method, distance, deviation=0):
+        return self
+
+    def contains_points(self, x, y):
+        """Even-odd test of many points at once."""
+        inside = np.zeros(x.shape, dtype=bool)
+        for ring in self.parts:
+            r = np.asarray(ring, dtype=np.float64)
+            for (x1, y1), (x2, y2) in zip(r, np.roll(r, -1, axis=0)):
+                if y1 == y2:
+                    continue
+                cross = (y1 > y) != (y2 > y)
+                xs = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+                inside ^= cross & (x < xs)
+        return inside
+
+
+def Polygon(array, spatial_reference=None):
+    return Geometry('polygon', [[(p.X, p.Y) for p in array]], spatial_reference)
+
+
+def Polyline(array, spatial_reference=None):
+    return Geometry('polyline', [[(p.X, p.Y) for p in array]], spatial_reference)
+
+
+def box(xmin, ymin, xmax, ymax, spatialReference=None, area=None):
+    return Geometry('polygon', [[(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]],
+                    spatialReference, area)
+
+
+def AsShape(geojson, esri_json=False):
+    d = json.loads(geojson) if isinstance(geojson, str) else geojson
+    if 'rings' in d:
+        return Geometry('polygon', [[tuple(p) for p in r] for r in d['rings']])
+    return Geometry('polyline', [[tuple(p) for p in r] for r in d['paths']])
+
+
+#catalog
+#-------
+_catalog = {} #normalised path -> _RasterData / _FeatureData / _Workspace
+_layers = {} #layer name (lower case) -> _Layer
+
+
+class Result(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def getOutput(self, index=0):
+        return self.path
+
+
+def _path(x):
+    if isinstance(x, (Result, Raster)):
+        return x.path
+    return str(x)
+
+
+def _key(x):
+    #layers by name; bare names go in env.workspace; everything else is a path
+    p = _path(x)
+    if p.lower() in _layers:
+        return p.lower()
+    p = p.replace('\\', '/')
+    if '/' not in p:
+        p = str(env.workspace or '').replace('\\', '/') + '/' + p
+    if not (':' in p or p.startswith('/') or p.lower().startswith('memory/')):
+        p = os.path.abspath(p)
+    return os.path.normpath(p).replace('\\', '/').lower()
+
+
+def _join(path, name):
+    return str(path).replace('\\', '/').rstrip('/') + '/' + str(name)
+
+
+def _get(x):
+    k = _key(x)
+    if k in _layers:
+        return _layers[k]
+    if k not in _catalog:
+        raise _error('ERROR 000732: Dataset {} does not exist or is not supported'.format(_path(x)))
+    return _catalog[k]
+
+
+def _put(path, data):
+    k = _key(path)
+    if k in _catalog and not env.overwriteOutput and not k.startswith('memory/'):
+        raise _error('ERROR 000725: Dataset {} already exists.'.format(path))
+    data.path = str(path)
+    _catalog[k] = data
+    return data
+
+
+def register(path, data):
+    """Add a dataset to the catalog at any path (e.g. the N:\\ share)."""
+    data.path = str(path)
+    _catalog[_key(path)] = data
+    return data
+
+
+class _Workspace(object):
+    pass
+
+
+class Field(object):
+    def __init__(self, name, type='String', length=50, editable=True, required=False):
+        self.name = name
+        self.type = type
+        self.length = length
+        self.editable = editable
+        self.required = required
+
+
+_FIELD_TYPES = {'TEXT': 'String', 'LONG': 'Integer', 'SHORT': 'SmallInteger', 'DOUBLE': 'Double',
+                'FLOAT': 'Single', 'DATE': 'Date'}
+
+
+class _FeatureData(object):
+    def __init__(self, shapeType, fields=(), spatialReference=None):
+        self.shapeType = shapeType
+        self.spatialReference = spatialReference
+        self.fields = [Field('OBJECTID', 'OID', 4, False, True), Field('Shape', 'Geometry', 0, True, True)]
+        if shapeType.lower() == 'polygon':
+            self.fields += [Field('Shape_Length', 'Double', 8, False, True), Field('Shape_Area', 'Double', 8, False, True)]
+        self.fields += [copy.copy(f) for f in fields]
+        self.rows = [] #dicts keyed by lower-case field name; 'shape' holds the geometry
+        self.nextId = 1
+
+    def add_field(self, name, ftype, length=50):
+        if not any(f.name.lower() == name.lower() for f in self.fields):
+            self.fields.append(Field(name, _FIELD_TYPES.get(ftype.upper(), ftype), length))
+
+    def insert(self, row):
+        row['objectid'] = self.nextId
+        self.nextId += 1
+        self.rows.append(row)
+
+    @property
+    def extent(self):
+        exts = [r['shape'].extent for r in self.rows]
+        if not exts: #arcpy reports NaN bounds for an empty feature class
+            return Extent(float('nan'), float('nan'), float('nan'), float('nan'))
+        return Extent(min(e.XMin for e in exts), min(e.YMin for e in exts),
+                      max(e.XMax for e in exts), max(e.YMax for e in exts))
+
+
+class _Layer(object):
+    def __init__(self, name, source, where=None):
+        self.name = name
+        self.source = source
+        self.where = where
+        self.selection = None #objectids, None = no selection
+
+    def rows(self):
+        data = _get(self.source)
+        test = _where(self.where)
+        return [r for r in data.rows if test(r) and (self.selection is None or r['objectid'] in self.selection)]
+
+    def __getattr__(self, name):
+        return getattr(_get(self.source), name)
+
+
+def _rows(data, where=None):
+    rows = data.rows() if isinstance(data, _Layer) else data.rows
+    test = _where(where)
+    return [r for r in rows if test(r)]
+
+
+#where clauses
+#-------------
+_TOKEN = re.compile(r"\s*(?:(?P<str>'(?:[^']|'')*')|(?P<num>-?\d+(?:\.\d+)?)|(?P<op><>|>=|<=|=|>|<|\(|\)|,)|(?P<name>\"[^\"]+\"|\[[^\]]+\]|[A-Za-z_][A-Za-z0-9_]*))")
+_KEYWORDS = {'and': 'and', 'or': 'or', 'not': 'not', 'in': 'in', 'is': 'is', 'null': 'None'}
+_compiled = {}
+
+
+def _where(where):
+    """SQL where clause (=, <>, <, >, IN, AND/OR/NOT, IS NULL) -> predicate on a row dict."""
+    if not where:
+        return lambda row: True
+    if where in _compiled:
+        return _compiled[where]
+    out, pos, inList = [], 0, 0
+    where = where.strip()
+    while pos < len(where):
+        m = _TOKEN.match(where, pos)
+        if m is None:
+            raise _error('ERROR 000358: Invalid expression {}'.format(where))
+        pos = m.end()
+        if m.group('str'):
+            out.append(repr(m.group('str')[1:-1].replace("''", "'")))
+        elif m.group('num'):
+            out.append(m.group('num'))
+        elif m.group('op'):
+            op = m.group('op')
+            if op == '(' and out and out[-1] == ' in ':
+                op, inList = '{', inList + 1
+            elif op == ')' and inList:
+                op, inList = '}', inList - 1
+            out.append({'=': '==', '<>': '!='}.get(op, op))
+        else:
+            name = m.group('name')
+            if name.lower() in _KEYWORDS:
+                out.append(' ' + _KEYWORDS[name.lower()] + ' ')
+            else:
+                out.append('_v(row, {!r})'.format(name.strip('"[]').lower()))
+    code = compile(''.join(out), '<where>', 'eval')
+    test = _compiled[where] = lambda row: eval(code, {'_v': _value}, {'row': row})
+    return test
+
+
+def _value(row, name):
+    if name == 'shape_area':
+        return row['shape'].area
+    if name == 'shape_length':
+        return row['shape'].length
+    return row.get(name)
+
+
+#rasters
+#-------
+_PIXEL_TYPES = {'8_BIT_UNSIGNED': np.uint8, '16_BIT_SIGNED': np.int16, '16_BIT_UNSIGNED': np.uint16,
+                '32_BIT_SIGNED': np.int32, '32_BIT_FLOAT': np.float32}
+
+
+class _RasterData(object):
+    """
+    A raster as an array whose top-left corner is at (x0, yTop). Rasters
+    built with Mosaic keep their tiles and are assembled the first time
+    they're read.
+    """
+    def __init__(self, array=None, x0=0.0, yTop=0.0, cellWidth=1.0, cellHeight=1.0, noData=None,
+                 spatialReference=None, dtype=None):
+        self._array = array
+        self.x0, self.yTop = x0, yTop
+        self.cellWidth, self.cellHeight = cellWidth, cellHeight
+        self.noData = noData
+        self.spatialReference = spatialReference
+        self.dtype = array.dtype if array is not None else dtype
+        self.tiles = []
+        self.vat = None #[(Value, Count, label)] for PolygonToRaster output
+        self.vatField = None
+
+    def cells(self):
+        #without assembling the tiles
+        return sum(a.size for a in [self._array] + [t[2] for t in self.tiles] if a is not None)
+
+    def array(self):
+        if self.tiles:
+            self._assemble()
+        return self._array
+
+    def _assemble(self):
+        cw, ch = self.cellWidth, self.cellHeight
+        x0 = min(t[0] for t in self.tiles)
+        yTop = max(t[1] for t in self.tiles)
+        if self._array is not None:
+            self.tiles.insert(0, (self.x0, self.yTop, self._array))
+            x0, yTop = min(x0, self.x0), max(yTop, self.yTop)
+        cols = max(int(round((t[0] - x0) / cw)) + t[2].shape[1] for t in self.tiles)
+        rows = max(int(round((yTop - t[1]) / ch)) + t[2].shape[0] for t in self.tiles)
+        fill = self.noData if self.noData is not None else 0
+        out = np.full((rows, cols), fill, dtype=self.dtype)
+        for tx, ty, a in self.tiles:
+            r, c = int(round((yTop - ty) / ch)), int(round((tx - x0) / cw))
+            keep = a != self.noData if self.noData is not None else np.ones(a.shape, bool)
+            out[r:r + a.shape[0], c:c + a.shape[1]][keep] = a[keep]
+        self._array, self.x0, self.yTop, self.tiles = out, x0, yTop, []
+
+    @property
+    def extent(self):
+        a = self.array()
+        return Extent(self.x0, self.yTop - a.shape[0] * self.cellHeight,
+                      self.x0 + a.shape[1] * self.cellWidth, self.yTop)
+
+
+class Raster(object):
+    def __init__(self, inRaster):
+        self.path = _path(inRaster)
+        self._data = _get(inRaster)
+
+    @property
+    def extent(self):
+        return self._data.extent
+
+    @property
+    def meanCellWidth(self):
+        return self._data.cellWidth
+
+    @property
+    def meanCellHeight(self):
+        return self._data.cellHeight
+
+    @property
+    def spatialReference(self):
+        return self._data.spatialReference
+
+    @property
+    def height(self):
+        return self._data.array().shape[0]
+
+    @property
+    def width(self):
+        return self._data.array().shape[1]
+
+    @property
+    def noDataValue(self):
+        return self._data.noData
+
+    @property
+    def pixelType(self):
+        d = np.dtype(self._data.dtype)
+        return {'f': 'F', 'i': 'S'}.get(d.kind, 'U') + str(d.itemsize * 8) #e.g. 'F32', 'S16'
+
+    def _valid(self):
+        a = self._data.array()
+        return a[a != self._data.noData] if self._data.noData is not None else a.ravel()
+
+    def _stat(self, func):
+        a = self._valid()
+        return float(func(a)) if a.size else None
+
+    @property
+    def minimum(self):
+        return self._stat(np.min)
+
+    @property
+    def maximum(self):
+        return self._stat(np.max)
+
+    @property
+    def mean(self):
+        return self._stat(np.mean)
+
+    @property
+    def standardDeviation(self):
+        return self._stat(np.std)
+
+    @property
+    def catalogPath(self):
+        return self.path
+
+    def save(self, outRaster):
+        data = copy.copy(self._data)
+        _put(outRaster, data)
+        self.path = str(outRaster)
+
+
+_temp = [0]
+
+def _temp_name(prefix):
+    _temp[0] += 1
+    return 'memory/{}_{}'.format(prefix, _temp[0])
+
+
+def NumPyArrayToRaster(in_array, lower_left_corner=None, x_cell_size=1.0, y_cell_size=None, value_to_nodata=None):
+    y_cell_size = y_cell_size or x_cell_size
+    ll = lower_left_corner or Point(0, 0)
+    a = np.array(in_array)
+    data = _RasterData(a, ll.X, ll.Y + a.shape[0] * y_cell_size, x_cell_size, y_cell_size, value_to_nodata)
+    return Raster(_put(_temp_name('np'), data).path)
+
+
+def RasterToNumPyArray(in_raster, lower_left_corner=None, ncols=None, nrows=None, nodata_to_value=None):
+    data = _get(in_raster)
+    a = data.array()
+    if lower_left_corner is None:
+        out = a.copy()
+    else:
+        nrows, ncols = nrows or a.shape[0], ncols or a.shape[1]
+        top = lower_left_corner.Y + nrows * data.cellHeight
+        r0 = int(round((data.yTop - top) / data.cellHeight))
+        c0 = int(round((lower_left_corner.X - data.x0) / data.cellWidth))
+        fill = data.noData if data.noData is not None else 0
+        out = np.full((nrows, ncols), fill, dtype=a.dtype)
+        rs, cs = max(r0, 0), max(c0, 0)
+        re_, ce = min(r0 + nrows, a.shape[0]), min(c0 + ncols, a.shape[1])
+        if rs < re_ and cs < ce:
+            out[rs - r0:re_ - r0, cs - c0:ce - c0] = a[rs:re_, cs:ce]
+    if nodata_to_value is not None and data.noData is not None:
+        out[out == data.noData] = nodata_to_value
+    return out
+
+
+def CreateRasterDataset_management(out_path, out_name, cellsize=1.0, pixel_type='32_BIT_FLOAT',
+                                   raster_spatial_reference=None, number_of_bands=1):
+    data = _RasterData(None, 0, 0, float(cellsize), float(cellsize), None, raster_spatial_reference,
+                       _PIXEL_TYPES[pixel_type])
+    return Result(_put(_join(out_path, out_name), data).path)
+
+
+def Mosaic_management(inputs, target, mosaic_type='LAST', colormap='FIRST', background_value='', nodata_value=None):
+    tile = _get(inputs)
+    data = _get(target)
+    if nodata_value not in (None, ''):
+        data.noData = nodata_value
+    a = tile.array()
+    data.tiles.append((tile.x0, tile.yTop, a.astype(data.dtype, copy=False)))
+    return Result(data.path)
+
+
+def DefineProjection_management(in_dataset, coor_system):
+    _get(in_dataset).spatialReference = coor_system
+    return Result(_path(in_dataset))
+
+
+def BuildPyramids_management(in_raster_dataset, *args):
+    _get(in_raster_dataset)
+    return Result(_path(in_raster_dataset))
+
+
+def Clip_management(in_raster, rectangle, out_raster, in_template_dataset=None, nodata_value=None,
+                    clipping_geometry=None, maintain_clipping_extent=None):
+    data = _get(in_raster)
+    ext = _get(in_template_dataset).extent
+    a = data.array()
+    c0 = max(int(math.floor((ext.XMin - data.x0) / data.cellWidth)), 0)
+    c1 = min(int(math.ceil((ext.XMax - data.x0) / data.cellWidth)), a.shape[1])
+    r0 = max(int(math.floor((data.yTop - ext.YMax) / data.cellHeight)), 0)
+    r1 = min(int(math.ceil((data.yTop - ext.YMin) / data.cellHeight)), a.shape[0])
+    if r1 <= r0 or c1 <= c0:
+        raise _error('ERROR 001566: the clip extent does not overlap {}'.format(_path(in_raster)))
+    out = _RasterData(a[r0:r1, c0:c1].copy(), data.x0 + c0 * data.cellWidth, data.yTop - r0 * data.cellHeight,
+                      data.cellWidth, data.cellHeight, data.noData, data.spatialReference)
+    return Result(_put(out_raster, out).path)
+
+
+def RasterToPolygon_conversion(in_raster, out_polygon_features, simplify='SIMPLIFY', raster_field='Value'):
+    #one polygon per 4-connected region: its bounding box, with the region's area
+    from gdt import regions
+    data = _get(in_raster)
+    a = data.array()
+    nodata = data.noData if data.noData is not None else -1
+    labels, count = regions.label_regions(a, nodata)
+    fc = _FeatureData('Polygon', [Field('Id', 'Integer'), Field('gridcode', 'Integer')], data.spatialReference)
+    if count:
+        flat = labels.ravel()
+        valid = flat > 0
+        rr, cc = np.divmod(np.nonzero(valid)[0], a.shape[1])
+        ids = flat[valid]
+        cells = np.bincount(ids, minlength=count + 1)
+        rmin = np.full(count + 1, a.shape[0]); np.minimum.at(rmin, ids, rr)
+        rmax = np.zeros(count + 1, np.int64); np.maximum.at(rmax, ids, rr)
+        cmin = np.full(count + 1, a.shape[1]); np.minimum.at(cmin, ids, cc)
+        cmax = np.zeros(count + 1, np.int64); np.maximum.at(cmax, ids, cc)
+        value = np.zeros(count + 1, a.dtype); value[ids] = a.ravel()[valid]
+        cw, ch = data.cellWidth, data.cellHeight
+        for i in range(1, count + 1):
+            shape = box(data.x0 + cmin[i] * cw, data.yTop - (rmax[i] + 1) * ch, data.x0 + (cmax[i] + 1) * cw,
+                        data.yTop - rmin[i] * ch, data.spatialReference, float(cells[i] * cw * ch))
+            fc.insert({'shape': shape, 'id': i, 'gridcode': int(value[i])})
+    return Result(_put(out_polygon_features, fc).path)
+
+
+def PolygonToRaster_conversion(in_features, value_field, out_rasterdataset, cell_assignment='CELL_CENTER',
+                               priority_field='', cellsize=None):
+    src = _get(in_features)
+    ext = env.extent if env.extent is not None else src.extent
+    cs = float(cellsize or env.cellSize)
+    rows, cols = int(round(ext.height / cs)), int(round(ext.width / cs))
+    labels = np.zeros((rows, cols), dtype=np.int32)
+    ids = {}
+    field = value_field.lower()
+    for row in _rows(src):
+        value = row.get(field)
+        label = ids.setdefault(value, len(ids) + 1)
+        e = row['shape'].extent
+        c0, c1 = max(int((e.XMin - ext.XMin) / cs), 0), min(int(math.ceil((e.XMax - ext.XMin) / cs)), cols)
+        r0, r1 = max(int((ext.YMax - e.YMax) / cs), 0), min(int(math.ceil((ext.YMax - e.YMin) / cs)), rows)
+        if r1 <= r0 or c1 <= c0:
+            continue
+        y, x = np.mgrid[r0:r1, c0:c1]
+        inside = row['shape'].contains_points(ext.XMin + (x + 0.5) * cs, ext.YMax - (y + 0.5) * cs)
+        labels[r0:r1, c0:c1][inside] = label
+    data = _RasterData(labels, ext.XMin, ext.YMax, cs, cs, 0)
+    counts = np.bincount(labels.ravel(), minlength=len(ids) + 1)
+    data.vat = [(label, int(counts[label]), value) for value, label in ids.items()]
+    data.vatField = [f.name for f in src.fields if f.name.lower() == field][0]
+    return Result(_put(out_rasterdataset, data).path)
+
+
+#features
+#--------
+def CreateFeatureclass_management(out_path, out_name, geometry_type='POLYGON', template=None, has_m=None,
+                                  has_z=None, spatial_reference=None):
+    fields = []
+    if template not in (None, '', '#'):
+        fields = [f for f in _get(template).fields if f.type not in ('OID', 'Geometry') and not f.required]
+    fc = _FeatureData(geometry_type.title(), fields, spatial_reference)
+    return Result(_put(_join(out_path, out_name), fc).path)
+
+
+def AddField_management(in_table, field_name, field_type, field_precision=None, field_scale=None, field_length=50):
+    _get(in_table).add_field(field_name, field_type, field_length or 50)
+    return Result(_path(in_table))
+
+
+def AddFields_management(in_table, field_description):
+    for d in field_description:
+        _get(in_table).add_field(d[0], d[1], d[3] if len(d) > 3 and d[3] else 50)
+    return Result(_path(in_table))
+
+
+def GetCount_management(in_rows):
+    return Result(str(len(_rows(_get(in_rows)))))
+
+
+def ListFields(dataset, wild_card=None, field_type=None):
+    data = _get(dataset)
+    if isinstance(data, _RasterData):
+        return [Field('Value', 'Integer'), Field('Count', 'Integer'), Field(data.vatField or 'Label')]
+    return list(data.fields)
+
+
+def MakeFeatureLayer_management(in_features, out_layer, where_clause=None):
+    _layers[str(out_layer).lower()] = _Layer(str(out_layer), _path(in_features), where_clause)
+    return Result(str(out_layer))
+
+
+def Select_analysis(in_features, out_feature_class, where_clause=None):
+    src = _get(in_features)
+    fc = _FeatureData(src.shapeType, [f for f in src.fields if f.type not in ('OID', 'Geometry') and not f.required],
+                      src.spatialReference)
+    for row in _rows(src, where_clause):
+        fc.insert(dict(row))
+    return Result(_put(out_feature_class, fc).path)
+
+
+def SelectLayerByLocation_management(in_layer, overlap_type='INTERSECT', select_features=None, *args):
+    #WITHIN on bounding boxes, against the union of the selecting features
+    layer = _get(in_layer)
+    areas = [r['shape'].extent for r in _rows(_get(select_features))]
+    data = _get(layer.source)
+    test = _where(layer.where)
+    layer.selection = set(r['objectid'] for r in data.rows
+                          if test(r) and any(r['shape'].extent.within(a) for a in areas))
+    return Result(layer.name)
+
+
+_UNITS = {'mile': 1609.344, 'miles': 1609.344, 'meter': 1.0, 'meters': 1.0, 'foot': 0.3048, 'feet': 0.3048,
+          'kilometer': 1000.0, 'kilometers': 1000.0}
+
+
+def Buffer_analysis(in_features, out_feature_class, buffer_distance_or_field):
+    number, unit = (str(buffer_distance_or_field).split() + ['meters'])[:2]
+    d = float(number) * _UNITS[unit.lower()]
+    shapes = [in_features] if isinstance(in_features, Geometry) else [r['shape'] for r in _rows(_get(in_features))]
+    buffers = [box(s.extent.XMin - d, s.extent.YMin - d, s.extent.XMax + d, s.extent.YMax + d, s.spatialReference)
+               for s in shapes]
+    if isinstance(out_feature_class, Geometry): #geometry output: the buffers come back as a list
+        return buffers
+    fc = _FeatureData('Polygon')
+    for b in buffers:
+        fc.insert({'shape': b})
+    return Result(_put(out_feature_class, fc).path)
+
+
+#any dataset
+#-----------
+class _Describe(object):
+    def __init__(self, dataset):
+        data = _get(dataset)
+        self.catalogPath = data.path if not isinstance(data, _Layer) else _get(data.source).path
+        self.spatialReference = getattr(data, 'spatialReference', None)
+        self.extent = data.extent
+        if isinstance(data, _RasterData):
+            self.dataType = 'RasterDataset'
+        else:
+            self.dataType = 'FeatureClass'
+            self.shapeType = data.shapeType
+
+
+def Describe(dataset):
+    return _Describe(dataset)
+
+
+def Exists(dataset):
+    k = _key(dataset)
+    return k in _catalog or k in _layers
+
+
+def Copy_management(in_data, out_data, data_type=None):
+    data = copy.copy(_get(in_data)) #arrays and geometries are never changed in place
+    if isinstance(data, _FeatureData):
+        data.rows = [dict(r) for r in data.rows]
+        data.fields = list(data.fields)
+    elif isinstance(data, _RasterData):
+        data.tiles = list(data.tiles)
+    return Result(_put(out_data, data).path)
+
+
+def CopyFeatures_management(in_features, out_feature_class):
+    return Copy_management(in_features, out_feature_class)
+
+
+def CopyRaster_management(in_raster, out_rasterdataset, *args):
+    return Copy_management(in_raster, out_rasterdataset)
+
+
+def Delete_management(in_data, data_type=None):
+    k = _key(in_data)
+    if k in _layers:
+        del _layers[k]
+    elif k in _catalog:
+        if isinstance(_catalog.pop(k), _Workspace):
+            for other in [o for o in _catalog if o.startswith(k + '/')]:
+                del _catalog[other]
+            shutil.rmtree(_path(in_data), ignore_errors=True)
+    else:
+        raise _error('ERROR 000732: Dataset {} does not exist'.format(_path(in_data)))
+    return Result(_path(in_data))
+
+
+def CreateFileGDB_management(out_folder_path, out_name, out_version='CURRENT'):
+    path = _join(out_folder_path, out_name)
+    if not os.path.isdir(path) and ':' not in path:
+        os.makedirs(path)
+    return Result(_put(path, _Workspace()).path)
+
+
+from arcpy import da, sa #noqa: E402 (they use the catalog above)
@@ -0,0 +1,70 @@
+"""
+Source Name:   arcpy.da (benchmark stand-in)
+Description:   Search and insert cursors over the stand-in catalog.
+"""
+#-----------------------------------------------------------------------------
+
+import arcpy
+
+
+def _getter(field):
+    f = field.lower()
+    if f == 'shape@':
+        return lambda row: row['shape']
+    if f == 'shape@json':
+        return lambda row: row['shape'].JSON
+    if f in ('shape@area', 'shape_area'):
+        return lambda row: row['shape'].area
+    if f in ('shape@length', 'shape_length'):
+        return lambda row: row['shape'].length
+    if f == 'oid@':
+        return lambda row: row['objectid']
+    return lambda row: row.get(f)
+
+
+class SearchCursor(object):
+    def __init__(self, in_table, field_names, where_clause=None):
+        if isinstance(field_names, str):
+            field_names = [field_names]
+        self.fields = list(field_names)
+        data = arcpy._get(in_table)
+        if isinstance(data, arcpy._RasterData):
+            #value attribute table
+            self.rows = [{'value': v, 'count': n, data.vatField.lower(): label} for v, n, label in data.vat]
+            self.rows = [r for r in self.rows if arcpy._where(where_clause)(r)]
+        else:
+            self.rows = arcpy._rows(data, where_clause)
+
+    def __iter__(self):
+        getters = [_getter(f) for f in self.fields]
+        for row in self.rows:
+            yield tuple(g(row) for g in getters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class InsertCursor(object):
+    def __init__(self, in_table, field_names):
+        self.data = arcpy._get(in_table)
+        names = set(f.name.lower() for f in self.data.fields)
+        self.fields = []
+        for f in field_names:
+            f = f.lower()
+            if f.startswith('shape@'):
+                f = 'shape'
+            elif f not in names:
+                raise RuntimeError('Cannot find field {}'.format(f))
+            self.fields.append(f)
+
+    def insertRow(self, row):
+        self.data.insert(dict(zip(self.fields, row)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
@@ -0,0 +1,7 @@
+"""
+Source Name:   arcpy.sa (benchmark stand-in)
+Description:   Empty; the scripts only star-import it.
+"""
+#-----------------------------------------------------------------------------
+
+__all__ = []
@@ -0,0 +1,93 @@
+"""
+Source Name:   synthetic.py
+Description:   Synthetic inputs for the benchmarks: fractal DEMs with a
+               realistic slope distribution, geology polygons carrying CGS
+               style map unit codes, a grid of quads and a county outline.
+               Everything is seeded, so a size always gives the same data.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+from gdt import terrain
+
+#map units and how much of the map they cover. The mix hits every rule
+#family in gdt/unit_rules.csv (including the Summit County slope rules) and
+#leaves plenty of units that match nothing
+UNITS = [('Qls', 6), ('Qlsy', 2), ('Qls/Kp', 1), ('Qta', 3), ('Qt', 1),
+         ('PPm', 8), ('Pm', 8), ('Kp', 6), ('Km', 4), ('Jm', 3), ('Kcgg', 2), ('TKda2', 2),
+         ('Qaf', 4), ('Qc', 4), ('Qfy', 3), ('af', 1), ('Qsw', 2),
+         ('Xb', 10), ('Yg', 8), ('Tv', 6), ('Qa', 6), ('Qgo', 5), ('Mlp', 5)]
+
+
+def fractal_dem(rows, cols, cellSize, seed=0, beta=3.2, slopeP90=35.0, base=1550.0):
+    """
+    Spectral (1/f**beta) fractal surface, scaled so that 10% of the cells are
+    steeper than slopeP90 degrees. With the defaults roughly a quarter of
+    the cells are over 30 degrees, like a mountain front in lidar.
+    """
+    rng = np.random.default_rng(seed)
+    fy = np.fft.fftfreq(rows)[:, None]
+    fx = np.fft.rfftfreq(cols)[None, :]
+    f = np.hypot(fx, fy)
+    f[0, 0] = 1.0
+    spectrum = (rng.normal(size=f.shape) + 1j * rng.normal(size=f.shape)) / f ** (beta / 2.0)
+    spectrum[0, 0] = 0
+    z = np.fft.irfft2(spectrum, s=(rows, cols))
+    sl = terrain.slope(z, cellSize)
+    scale = np.tan(np.radians(slopeP90)) / np.tan(np.radians(np.nanpercentile(sl, 90)))
+    return (base + (z - z.min()) * scale).astype(np.float32)
+
+
+def drained_dem(rows, cols, cellSize, seed=0, fall=0.4, relief=500.0, base=1550.0):
+    """
+    Surface with no depressions or flats: a plane falling fall (rise over
+    run) towards row 0, plus fractal valleys and ridges running down it and
+    a little noise, never enough to stop every cell draining to the one
+    above it. Filling leaves it as it is and flow is decided locally, so
+    flow traced within a halo matches the whole-raster flow.
+    """
+    rng = np.random.default_rng(seed)
+    f = np.fft.rfftfreq(cols)
+    f[0] = 1.0
+    spectrum = (rng.normal(size=f.shape) + 1j * rng.normal(size=f.shape)) / f ** 1.5
+    spectrum[0] = 0
+    profile = np.fft.irfft(spectrum, n=cols)
+    profile = relief * (profile - profile.min()) / np.ptp(profile)
+    drop = fall * cellSize
+    noise = rng.uniform(0, 0.4 * drop, size=(rows, cols))
+    z = base + drop * np.arange(rows)[:, None] + profile[None, :] + noise
+    return z.astype(np.float32)
+
+
+def split_rectangles(xmin, ymin, xmax, ymax, count, seed=0):
+    """Cut a rectangle into count smaller ones by repeatedly splitting the largest."""
+    rng = np.random.default_rng(seed)
+    boxes = [(xmin, ymin, xmax, ymax)]
+    while len(boxes) < count:
+        boxes.sort(key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+        x0, y0, x1, y1 = boxes.pop()
+        t = rng.uniform(0.3, 0.7)
+        if x1 - x0 >= y1 - y0:
+            xm = x0 + t * (x1 - x0)
+            boxes += [(x0, y0, xm, y1), (xm, y0, x1, y1)]
+        else:
+            ym = y0 + t * (y1 - y0)
+            boxes += [(x0, y0, x1, ym), (x0, ym, x1, y1)]
+    return sorted(boxes)
+
+
+def geology(xmin, ymin, xmax, ymax, count, seed=0):
+    """[(box, unit)] covering the extent with count polygons."""
+    rng = np.random.default_rng(seed + 1)
+    names = [u for u, w in UNITS]
+    weights = np.array([w for u, w in UNITS], dtype=np.float64)
+    picks = rng.choice(len(names), size=count, p=weights / weights.sum())
+    return [(b, names[i]) for b, i in zip(split_rectangles(xmin, ymin, xmax, ymax, count, seed), picks)]
+
+
+def quads(xmin, ymin, xmax, ymax, nx, ny):
+    """[(name, box)] for an nx by ny grid of quads, named so the 9 character output names stay unique."""
+    w, h = (xmax - xmin) / float(nx), (ymax - ymin) / float(ny)
+    return [('Q{:02d}{:02d}_quad'.format(r, c), (xmin + c * w, ymin + r * h, xmin + (c + 1) * w, ymin + (r + 1) * h))
+            for r in range(ny) for c in range(nx)]
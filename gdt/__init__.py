@@ -0,0 +1,7 @@
+"""
+Source Name:   gdt
+Description:   Array engines behind the Geohazard Derivative Tools toolbox.
+               The modules in here only need NumPy; anything that talks to
+               arcpy lives in gdt.arcio so the engines can be run and timed
+               without an ArcGIS licence.
+"""
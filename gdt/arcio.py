@@ -0,0 +1,559 @@
+"""
+Source Name:   arcio.py
+Description:   The thin layer between arcpy rasters and the NumPy engines in
+               this package. Everything that needs an ArcGIS licence to run
+               goes through here.
+"""
+#-----------------------------------------------------------------------------
+
+import json, math, os
+
+import arcpy
+import numpy as np
+
+from gdt import cache, contour, geostore, prefetch, spatial, store, tiling, units
+
+#array dtype for each CreateRasterDataset pixel type the writers use
+PIXEL_TYPES = {'8_BIT_UNSIGNED': np.uint8,
+               '16_BIT_SIGNED': np.int16,
+               '16_BIT_UNSIGNED': np.uint16,
+               '32_BIT_SIGNED': np.int32,
+               '32_BIT_FLOAT': np.float32}
+FLOAT_NODATA = -3.4028234663852886e+38 #what NaN cells are written as in float rasters
+
+
+def polygon_rings(polygon, step=None):
+    """
+    Rings of a polygon as [[x, y], ...] lists, vertices as they are; only a
+    polygon with true curves gets densified, to about step, or by default a
+    thousandth of the polygon's width or height, whichever is larger, so
+    the step suits the map units. [] for None.
+    """
+    if polygon is None:
+        return []
+    shape = json.loads(polygon.JSON)
+    if 'curveRings' in shape:
+        if step is None:
+            step = max(polygon.extent.width, polygon.extent.height) / 1000.0
+        return geometry_rings(polygon, step)
+    return shape.get('rings', [])
+
+
+def load_geology(inGeo, fields):
+    """
+    inGeo as a geostore.GeologyStore (OIDs, packed rings and the unit fields
+    listed, e.g. ['FMT'], dictionary-encoded), read with one cursor pass the
+    first time and kept for the process, so every tool run on the same
+    unchanged layer shares it. A field the kept store doesn't have yet is
+    added from a pass over just the OIDs and that field.
+    """
+    fields = list(fields)
+    def load():
+        with arcpy.da.SearchCursor(inGeo, ['OID@', 'SHAPE@'] + fields) as cursor:
+            return geostore.GeologyStore.from_rows(((row[0], polygon_rings(row[1])) + tuple(row[2:]) for row in cursor), fields)
+    geology = geostore.cached(arcpy.Describe(inGeo).catalogPath, feature_identity(inGeo), load)
+    missing = [f for f in fields if not geology.has_field(f)]
+    if missing:
+        with arcpy.da.SearchCursor(inGeo, ['OID@'] + missing) as cursor:
+            values = dict((row[0], row[1:]) for row in cursor)
+        for k, f in enumerate(missing):
+            geology.add_field(f, [values[oid][k] for oid in geology.oids.tolist()])
+    return geology
+
+
+def _create_like(inGeo, outFCs, batchSize):
+    #empty feature classes with inGeo's schema and an inserter for each; returns (copy_fields, {outFC: inserter})
+    desc = arcpy.Describe(inGeo)
+    fields = copy_fields(inGeo)
+    sinks = {}
+    for outFC in outFCs:
+        arcpy.CreateFeatureclass_management(os.path.dirname(outFC), os.path.basename(outFC),
+                                            desc.shapeType.upper(), inGeo, 'SAME_AS_TEMPLATE',
+                                            'SAME_AS_TEMPLATE', desc.spatialReference)
+        sinks[outFC] = BufferedInserter(outFC, ['SHAPE@'] + fields, batchSize)
+    return fields, sinks
+
+
+def write_geology(inGeo, geology, picks, batchSize=5000):
+    """
+    Copy the features of inGeo picked in the geology store to new feature
+    classes with inGeo's schema. picks is {outFC: which}, which being a mask
+    or index array over the store; the store only says which OIDs go where,
+    the shapes (curves, z and m included) and attributes are inGeo's own,
+    read in one SearchCursor pass however many outputs there are. Returns
+    {outFC: features written}.
+    """
+    fields, sinks = _create_like(inGeo, picks, batchSize)
+    counts = dict((outFC, 0) for outFC in picks)
+    targets = {} #OID -> the outputs it goes to
+    for outFC, which in picks.items():
+        for oid in geology.oids[which].tolist():
+            targets.setdefault(oid, []).append(outFC)
+    if targets:
+        with arcpy.da.SearchCursor(inGeo, ['OID@', 'SHAPE@'] + fields) as cursor:
+            for row in cursor:
+                for outFC in targets.get(row[0], ()):
+                    sinks[outFC].add(row[1:])
+                    counts[outFC] += 1
+    for sink in sinks.values():
+        sink.flush()
+    return counts
+
+
+def select_units(inFeatures, field, values, outFC, label='matching units', geology=None):
+    """
+    Export every feature whose field is one of values to outFC, picked by a
+    mask over the unit codes of the geology store (load_geology, unless one
+    is given) instead of a Select. When nothing matched, no output is
+    written and a message says so; returns the output, or None in that case.
+    """
+    if geology is None:
+        geology = load_geology(inFeatures, [field])
+    which = geology.mask(field, values)
+    if not which.any():
+        arcpy.AddMessage('{} has no {}'.format(inFeatures, label))
+        return None
+    write_geology(inFeatures, geology, {outFC: which})
+    return outFC
+
+
+class BufferedInserter(object):
+    """
+    Collects rows in memory and writes them to a feature class in batches
+    of batchSize, one short-lived InsertCursor per batch.
+    """
+    def __init__(self, outFC, fields, batchSize=5000):
+        self.outFC = outFC
+        self.fields = fields
+        self.batchSize = batchSize
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            with arcpy.da.InsertCursor(self.outFC, self.fields) as cursor:
+                for row in self.rows:
+                    cursor.insertRow(row)
+            self.rows = []
+
+
+def export_stamped(inFeatures, outFC, where_clause, keyField, fields, lookup, batchSize=5000):
+    """
+    Copy the features matching where_clause to a new feature class that
+    already has its attribute columns, filling them as the rows go in, so
+    no AddField / UpdateCursor pass over the output is needed afterwards.
+    fields is [(name, type, length)] for the new columns and lookup maps a
+    keyField value to their values. Returns the number of features written.
+    """
+    desc = arcpy.Describe(inFeatures)
+    arcpy.CreateFeatureclass_management(os.path.dirname(outFC), os.path.basename(outFC),
+                                        desc.shapeType.upper(), spatial_reference=desc.spatialReference)
+    arcpy.AddFields_management(outFC, [[keyField, 'LONG']] + [[name, ftype, '', length] for name, ftype, length in fields])
+    sink = BufferedInserter(outFC, ['SHAPE@', keyField] + [name for name, ftype, length in fields], batchSize)
+    count = 0
+    with arcpy.da.SearchCursor(inFeatures, ['SHAPE@', keyField], where_clause) as cursor:
+        for shape, key in cursor:
+            sink.add((shape, key) + tuple(lookup[key]))
+            count += 1
+    sink.flush()
+    return count
+
+
+def polygonize(inRaster, simplify='SIMPLIFY'):
+    """
+    RasterToPolygon into the memory workspace, read straight back into a
+    store.FeatureColumns (shapes, gridcode, Shape_Area) and deleted, so the
+    polygons never touch a scratch geodatabase.
+    """
+    polys = arcpy.RasterToPolygon_conversion(inRaster, r'memory\gdt_polygons', simplify, 'Value')
+    with arcpy.da.SearchCursor(polys, ['SHAPE@', 'gridcode', 'SHAPE@AREA']) as cursor:
+        rows = list(cursor)
+    arcpy.Delete_management(polys)
+    shapes = np.empty(len(rows), dtype=object)
+    shapes[:] = [r[0] for r in rows]
+    return store.FeatureColumns(shapes, {'gridcode': np.array([r[1] for r in rows], dtype=np.int32),
+                                         'Shape_Area': np.array([r[2] for r in rows], dtype=np.float64)})
+
+
+def write_columns(features, outFC, spatialReference, fields, shapeType='POLYGON', batchSize=5000):
+    """
+    Write a store.FeatureColumns to a new feature class. fields is
+    [(name, type, length)], each name a column of features. Returns the
+    number of features written.
+    """
+    arcpy.CreateFeatureclass_management(os.path.dirname(outFC), os.path.basename(outFC), shapeType,
+                                        spatial_reference=spatialReference)
+    arcpy.AddFields_management(outFC, [[name, ftype, '', length] if length else [name, ftype] for name, ftype, length in fields])
+    sink = BufferedInserter(outFC, ['SHAPE@'] + [name for name, ftype, length in fields], batchSize)
+    columns = [features[name].tolist() for name, ftype, length in fields]
+    for row in zip(features.shapes, *columns):
+        sink.add(row)
+    sink.flush()
+    return len(features)
+
+
+def feature_count(features):
+    """Rows in a feature class, layer or table; 0 for None (e.g. a select_units that wrote nothing)."""
+    if features is None:
+        return 0
+    return int(arcpy.GetCount_management(features).getOutput(0))
+
+
+def copy_fields(inFeatures):
+    """Editable attribute fields of a feature class, i.e. the ones an insert can write."""
+    return [f.name for f in arcpy.ListFields(inFeatures)
+            if f.editable and f.type not in ('OID', 'Geometry') and not f.required]
+
+
+def fan_out(inGeo, field, outputs, county=None, batchSize=5000):
+    """
+    Write every geology feature into the hazard outputs it belongs to
+    ({hazard: output feature class}), with inGeo's schema, in one pass over
+    inGeo. When the geology store already holds inGeo, the distinct units
+    are classified once and each output is a mask over the unit codes
+    (write_geology). Otherwise the store is loaded by the same cursor pass
+    that writes the outputs, each unit classified the first time it turns
+    up. Returns ({hazard: features written}, features in inGeo).
+    """
+    classifier = units.classifier(county)
+    counts = {}
+    def load():
+        fields, sinks = _create_like(inGeo, outputs.values(), batchSize)
+        cursorFields = ['OID@', 'SHAPE@'] + fields
+        if field.lower() not in [f.lower() for f in fields]:
+            cursorFields.append(field)
+        unitAt = [f.lower() for f in cursorFields].index(field.lower())
+        routes = {} #unit -> the outputs it goes to
+        counts.update((outFC, 0) for outFC in sinks)
+        def rows(cursor):
+            for row in cursor:
+                unit = row[unitAt]
+                if unit not in routes:
+                    hit = classifier.match(unit)
+                    routes[unit] = [outFC for hazard, outFC in outputs.items() if hazard in hit]
+                for outFC in routes[unit]:
+                    sinks[outFC].add(row[1:len(fields) + 2])
+                    counts[outFC] += 1
+                yield row[0], polygon_rings(row[1]), unit
+        with arcpy.da.SearchCursor(inGeo, cursorFields) as cursor:
+            geology = geostore.GeologyStore.from_rows(rows(cursor), [field])
+        for sink in sinks.values():
+            sink.flush()
+        return geology
+    geology = geostore.cached(arcpy.Describe(inGeo).catalogPath, feature_identity(inGeo), load)
+    if not counts: #the store was already loaded
+        if not geology.has_field(field):
+            geology = load_geology(inGeo, [field])
+        unitClasses = classifier.classify(geology.values(field))
+        counts = write_geology(inGeo, geology, dict((outFC, geology.mask(field, units.units_for(unitClasses, hazard)))
+                                                    for hazard, outFC in outputs.items()), batchSize)
+    return dict((hazard, counts[outFC]) for hazard, outFC in outputs.items()), len(geology)
+
+
+def extent_box(extent):
+    return (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+
+
+def select_within(inFeatures, fields, aoiFeatures, aoi_where=None):
+    """
+    Rows (the values of fields) of the inFeatures that lie within one of the
+    AOI features picked by aoi_where, in inFeatures order. This is
+    SelectLayerByLocation 'WITHIN' without layers, so it works on feature
+    class paths with no project open: the inFeatures bounding boxes go in
+    an STR tree, each AOI's box picks the candidates and only those get the
+    exact within test.
+    """
+    with arcpy.da.SearchCursor(aoiFeatures, ['SHAPE@'], aoi_where) as cursor:
+        aois = [row[0] for row in cursor]
+    with arcpy.da.SearchCursor(inFeatures, ['SHAPE@'] + list(fields)) as cursor:
+        rows = [row for row in cursor]
+    tree = spatial.STRtree([extent_box(row[0].extent) for row in rows])
+    hits = set()
+    for aoi in aois:
+        for i in tree.within(extent_box(aoi.extent)):
+            if i not in hits and rows[i][0].within(aoi):
+                hits.add(i)
+    return [tuple(rows[i][1:]) for i in sorted(hits)]
+
+
+def geometry_rings(polygon, step):
+    """Rings of a polygon as [[x, y], ...] lists, true curves (e.g. buffer ends) densified to about step."""
+    return json.loads(polygon.densify('DISTANCE', step, step / 10.0).JSON)['rings']
+
+
+class RasterInfo(object):
+    """Georeferencing needed to turn an array back into a raster."""
+    def __init__(self, lowerLeft, cellWidth, cellHeight, spatialReference, rows, cols):
+        self.lowerLeft = lowerLeft
+        self.cellWidth = cellWidth
+        self.cellHeight = cellHeight
+        self.spatialReference = spatialReference
+        self.rows = rows
+        self.cols = cols
+
+
+def describe_raster(inRaster):
+    r = arcpy.Raster(inRaster)
+    return RasterInfo(r.extent.lowerLeft, r.meanCellWidth, r.meanCellHeight,
+                      r.spatialReference, r.height, r.width)
+
+
+def read_raster(inRaster):
+    """Read a raster into a float64 array with NoData as NaN."""
+    r = arcpy.Raster(inRaster)
+    arr = arcpy.RasterToNumPyArray(r).astype(np.float64)
+    if r.noDataValue is not None:
+        arr[arr == r.noDataValue] = np.nan
+    return arr, describe_raster(r)
+
+
+def burn_units(inGeo, field, unitList, snapRaster):
+    """
+    Burn the polygons of the listed units onto snapRaster's grid (same
+    extent and cells) in one PolygonToRaster call. Returns (labelRaster,
+    {label id: unit}); labelRaster is in the memory workspace, NoData where
+    there is no listed unit, and is the caller's to delete. The polygons
+    come from the geology store, only those of the listed units whose
+    bounding boxes reach the raster.
+    """
+    info = describe_raster(snapRaster)
+    extent = arcpy.Describe(snapRaster).extent
+    geology = load_geology(inGeo, [field])
+    selected = os.path.join('memory', 'gdt_units')
+    labelRaster = r'memory\gdt_unit_labels'
+    write_geology(inGeo, geology, {selected: geology.mask(field, unitList) & geology.intersecting(extent_box(extent))})
+    with arcpy.EnvManager(snapRaster=snapRaster, extent=extent, cellSize=snapRaster):
+        arcpy.PolygonToRaster_conversion(selected, field, labelRaster, 'CELL_CENTER', '', info.cellWidth)
+    #a text value field gets integer cell values with the unit in the attribute table
+    valueField = [f.name for f in arcpy.ListFields(labelRaster) if f.name.lower() == field.lower()][0]
+    with arcpy.da.SearchCursor(labelRaster, ['Value', valueField]) as cursor:
+        idToUnit = dict((row[0], row[1]) for row in cursor)
+    arcpy.Delete_management(selected)
+    return labelRaster, idToUnit
+
+
+def rasterize_units(inGeo, field, unitList, snapRaster):
+    """
+    burn_units, read into memory. Returns (labels, {label id: unit}) where
+    labels is an int array the same shape as snapRaster and 0 means no
+    listed unit. Tiled tools read the burn_units raster a window at a time
+    instead.
+    """
+    info = describe_raster(snapRaster)
+    labelRaster, idToUnit = burn_units(inGeo, field, unitList, snapRaster)
+    labels = arcpy.RasterToNumPyArray(labelRaster, info.lowerLeft, info.cols, info.rows, 0).astype(np.int32)
+    arcpy.Delete_management(labelRaster)
+    return labels, idToUnit
+
+
+def raster_identity(inRaster):
+    """
+    String naming a raster as it currently is on disk: its catalog path plus
+    the size and latest modification time of the files behind it. Used by
+    gdt.cache to skip re-reading an unchanged DEM.
+
+    A file gdb raster's files can't be told apart from those of everything
+    else in the gdb, which changes whenever an output is written next to
+    it, so a gdb raster is named by its own properties instead: size, cell
+    size, extent, pixel type, NoData and statistics.
+    """
+    path = arcpy.Describe(inRaster).catalogPath
+    files = [path]
+    folder = os.path.dirname(path)
+    if folder.lower().endswith('.gdb'):
+        r = arcpy.Raster(path)
+        props = (r.width, r.height, r.meanCellWidth, r.meanCellHeight, extent_box(r.extent), r.pixelType, r.noDataValue,
+                 r.minimum, r.maximum, r.mean, r.standardDeviation)
+        return '{}|{}'.format(os.path.normcase(os.path.abspath(path)), '|'.join(repr(p) for p in props))
+    if os.path.isdir(path): #grids
+        files = [os.path.join(path, f) for f in os.listdir(path)]
+    elif os.path.isfile(path): #and the files next to it, e.g. a shapefile's .dbf or an .img's .ige
+        stem = os.path.basename(path).lower().rsplit('.', 1)[0] + '.'
+        files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().startswith(stem)]
+    stats = [os.stat(f) for f in files if os.path.exists(f)]
+    return '{}|{}|{}'.format(os.path.normcase(os.path.abspath(path)),
+                             sum(st.st_size for st in stats),
+                             max([st.st_mtime for st in stats] or [0]))
+
+
+def feature_identity(inFeatures):
+    """
+    raster_identity for a feature class, plus its feature count and extent,
+    which also tell apart the memory-workspace layers that have no files.
+    """
+    extent = arcpy.Describe(inFeatures).extent
+    return '{}|{}|{}'.format(raster_identity(inFeatures), feature_count(inFeatures),
+                             ','.join(repr(v) for v in extent_box(extent)))
+
+
+def cached_terrain(inRaster, products=('slope',), derivativeCache=None, **params):
+    """
+    Terrain products for a raster through the derivative cache. Returns
+    ({product: array}, RasterInfo); the DEM is only read on a miss.
+    """
+    if derivativeCache is None:
+        derivativeCache = cache.default_cache()
+    info = describe_raster(inRaster)
+    load = lambda: read_raster(inRaster)[0]
+    out = derivativeCache.terrain_products(raster_identity(inRaster), load, info.cellWidth, info.cellHeight, products, **params)
+    return out, info
+
+
+def to_raster(array, info, nodata=None, outRaster=None):
+    """
+    Turn an array back into a raster on the grid described by info. Without
+    outRaster the result is a temporary raster object that can be handed
+    straight to the next geoprocessing tool.
+    """
+    if array.dtype.kind == 'f':
+        if nodata is None:
+            nodata = FLOAT_NODATA
+        array = np.where(np.isnan(array), nodata, array).astype(array.dtype)
+    ras = arcpy.NumPyArrayToRaster(array, info.lowerLeft, info.cellWidth, info.cellHeight, nodata)
+    if outRaster:
+        ras.save(outRaster)
+        ras = arcpy.Raster(outRaster)
+    arcpy.DefineProjection_management(ras, info.spatialReference)
+    return ras
+
+
+class RasterSource(object):
+    """
+    Windowed reader over a raster dataset for gdt.tiling. Only the requested
+    window is pulled into memory.
+    """
+    def __init__(self, inRaster):
+        self.raster = arcpy.Raster(inRaster)
+        self.info = describe_raster(self.raster)
+        self.rows = self.info.rows
+        self.cols = self.info.cols
+        self.noData = self.raster.noDataValue
+
+    def read(self, row0, col0, nrows, ncols):
+        return self.as_float(self.read_raw(row0, col0, nrows, ncols))
+
+    def read_raw(self, row0, col0, nrows, ncols):
+        """The window in the raster's own pixel type, NoData cells left as they are."""
+        ext = self.raster.extent
+        lowerLeft = arcpy.Point(ext.XMin + col0 * self.info.cellWidth,
+                                ext.YMax - (row0 + nrows) * self.info.cellHeight)
+        return arcpy.RasterToNumPyArray(self.raster, lowerLeft, ncols, nrows)
+
+    def as_float(self, arr):
+        """A read_raw array as float64 with NaN for NoData, i.e. what read returns."""
+        arr = arr.astype(np.float64)
+        if self.noData is not None:
+            arr[arr == self.noData] = np.nan
+        return arr
+
+
+class RasterWriter(object):
+    """
+    Streams tiles into a new raster dataset for gdt.tiling. Each tile is
+    turned into a small temporary raster and mosaicked into the output, so
+    only one tile is ever held in memory.
+    """
+    def __init__(self, outRaster, info, pixelType='32_BIT_FLOAT', nodata=None):
+        self.outRaster = outRaster
+        self.info = info
+        if nodata is None and pixelType == '32_BIT_FLOAT':
+            nodata = FLOAT_NODATA
+        self.nodata = nodata
+        self.dtype = PIXEL_TYPES[pixelType]
+        self.top = info.lowerLeft.Y + info.rows * info.cellHeight
+        arcpy.CreateRasterDataset_management(os.path.dirname(outRaster), os.path.basename(outRaster),
+                                             info.cellWidth, pixelType, info.spatialReference, 1)
+
+    def write(self, row0, col0, array):
+        nrows, ncols = array.shape
+        lowerLeft = arcpy.Point(self.info.lowerLeft.X + col0 * self.info.cellWidth,
+                                self.top - (row0 + nrows) * self.info.cellHeight)
+        if array.dtype.kind == 'f' and self.nodata is not None:
+            array = np.where(np.isnan(array), self.nodata, array)
+        array = array.astype(self.dtype, copy=False)
+        tile = arcpy.NumPyArrayToRaster(array, lowerLeft, self.info.cellWidth, self.info.cellHeight, self.nodata)
+        arcpy.Mosaic_management(tile, self.outRaster, 'LAST', 'FIRST', '', self.nodata)
+        arcpy.Delete_management(tile)
+
+    def close(self):
+        return arcpy.Raster(self.outRaster)
+
+
+def cached_source(inRaster, tileCache=None, threads=prefetch.DEFAULT_THREADS):
+    """
+    RasterSource for a raster on the share, read through the local tile
+    cache with read-ahead (gdt.prefetch). Close it when done.
+    """
+    return prefetch.CachedSource(RasterSource(inRaster), raster_identity(inRaster), tileCache, threads=threads)
+
+
+def raster_window(info, extent):
+    """(row0, col0, nrows, ncols) of the cells of a raster under an extent, None if they don't overlap."""
+    cw, ch = info.cellWidth, info.cellHeight
+    xMin, yMax = info.lowerLeft.X, info.lowerLeft.Y + info.rows * ch
+    col0 = max(int(math.floor((extent.XMin - xMin) / cw)), 0)
+    col1 = min(int(math.ceil((extent.XMax - xMin) / cw)), info.cols)
+    row0 = max(int(math.floor((yMax - extent.YMax) / ch)), 0)
+    row1 = min(int(math.ceil((yMax - extent.YMin) / ch)), info.rows)
+    if row1 <= row0 or col1 <= col0:
+        return None
+    return row0, col0, row1 - row0, col1 - col0
+
+
+def clip_to_geometry(inRaster, clipGeometry, outRaster, tileSize=tiling.DEFAULT_TILE_SIZE, pixelType='32_BIT_FLOAT',
+                     source=None):
+    """
+    Clip_management with 'ClippingGeometry' and 'NO_MAINTAIN_EXTENT', except
+    that only the window of inRaster under clipGeometry's bounding box is
+    ever read, tile by tile, instead of starting from the full mosaic. Cells
+    whose centres fall outside the geometry are NoData. source is the reader
+    for inRaster, e.g. cached_source(inRaster); a plain RasterSource when
+    None. Returns the clip as an arcpy Raster.
+    """
+    if source is None:
+        source = RasterSource(inRaster)
+    info = source.info
+    cw, ch = info.cellWidth, info.cellHeight
+    xMin, yMax = info.lowerLeft.X, info.lowerLeft.Y + info.rows * ch
+    window = raster_window(info, clipGeometry.extent)
+    if window is None:
+        raise ValueError('the clip geometry does not overlap {}'.format(inRaster))
+    row0, col0, rows, cols = window
+    x0, yTop = xMin + col0 * cw, yMax - row0 * ch
+    rings = geometry_rings(clipGeometry, cw)
+    mask = lambda r, c, nr, nc: spatial.ring_mask(rings, x0 + c * cw, yTop - r * ch, cw, ch, nr, nc)
+    window = tiling.WindowSource(source, row0, col0, rows, cols, mask)
+    outInfo = RasterInfo(arcpy.Point(x0, yTop - rows * ch), cw, ch, info.spatialReference, rows, cols)
+    return tiling.map_tiles(window, lambda block: block, RasterWriter(outRaster, outInfo, pixelType), tileSize, 0)
+
+
+def build_pyramids(inRaster):
+    """BuildPyramids for one raster; module level so gdt.parallel can run it in a worker."""
+    arcpy.BuildPyramids_management(inRaster)
+    return inRaster
+
+
+class ContourWriter(object):
+    """
+    Sink for contour.contour_tiles: a new polyline feature class with a
+    Contour field, written in batches as the lines are finished.
+    """
+    def __init__(self, outFC, info, batchSize=5000):
+        self.info = info
+        self.yMax = info.lowerLeft.Y + info.rows * info.cellHeight
+        arcpy.CreateFeatureclass_management(os.path.dirname(outFC), os.path.basename(outFC), 'POLYLINE',
+                                            spatial_reference=info.spatialReference)
+        arcpy.AddField_management(outFC, 'Contour', 'DOUBLE')
+        self.sink = BufferedInserter(outFC, ['SHAPE@', 'Contour'], batchSize)
+
+    def __call__(self, level, points):
+        xy = contour.cell_to_map(points, self.info.lowerLeft.X, self.yMax, self.info.cellWidth, self.info.cellHeight)
+        line = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for x, y in xy]), self.info.spatialReference)
+        self.sink.add((line, level))
+
+    def close(self):
+        self.sink.flush()
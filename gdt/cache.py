@@ -0,0 +1,197 @@
+"""
+Source Name:   cache.py
+Description:   Content-addressed cache for DEM derivatives, so the slope that
+               LandslideTesting computes is reused by Rockfall, and a rerun on
+               the same AOI skips the terrain pass entirely.
+
+               Products are stored as .npy files keyed by a hash of the DEM
+               contents plus the operation and its parameters. The cache has
+               a size cap; the least recently used products are evicted
+               first. A small .digest file per raster identity (path plus
+               file sizes and times, see arcio.raster_identity) remembers
+               which content hash it had, so an unchanged DEM doesn't even
+               have to be read on a hit; digests are evicted like products.
+
+               There is no index: what is on disk is what is cached, like
+               gdt.prefetch.TileCache, so the batch workers can share the
+               folder without losing each other's products.
+"""
+#-----------------------------------------------------------------------------
+
+import hashlib, json, os, tempfile
+
+import numpy as np
+
+from gdt import terrain
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3 #10 GB
+DEFAULT_ROOT = os.environ.get('GDT_CACHE', os.path.join(tempfile.gettempdir(), 'gdt_cache'))
+
+
+def array_digest(array):
+    """Hash of an array's shape, dtype and values."""
+    array = np.ascontiguousarray(array)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str((array.shape, array.dtype.str)).encode())
+    h.update(memoryview(array).cast('B'))
+    return h.hexdigest()
+
+
+def product_key(digest, op, params):
+    """Cache key for one operation with its parameters on the DEM with this content digest."""
+    text = json.dumps([digest, op, sorted(params.items())], default=str)
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+class DerivativeCache(object):
+    """
+    On-disk LRU cache of derivative arrays, safe to share between processes:
+    every product and every remembered digest is its own file, written to a
+    temporary name and renamed into place, so there is no index for
+    concurrent runs to overwrite. A product's last use is its file's
+    modification time. hits, misses and evictions count this process's
+    product lookups.
+    """
+    def __init__(self, root=DEFAULT_ROOT, maxBytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.hits = self.misses = self.evictions = 0
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.npy')
+
+    def _digest_path(self, identity):
+        return os.path.join(self.root, hashlib.blake2b(identity.encode(), digest_size=20).hexdigest() + '.digest')
+
+    def _replace(self, path, write):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def digest(self, identity):
+        """Content digest remembered for a raster identity, or None."""
+        path = self._digest_path(identity)
+        try:
+            with open(path) as f:
+                digest = f.read().strip() or None
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return digest
+
+    def remember(self, identity, digest):
+        self._replace(self._digest_path(identity), lambda f: f.write(digest.encode()))
+
+    def _products(self, suffixes=('.npy',)):
+        """(last used, bytes, path) of every product (or every file with one of suffixes) in the folder."""
+        entries = []
+        for e in os.scandir(self.root):
+            if e.name.endswith(suffixes):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def size(self):
+        return sum(size for used, size, path in self._products())
+
+    def get(self, key):
+        """The cached array for key, or None."""
+        path = self._path(key)
+        try:
+            array = np.load(path)
+        except (IOError, OSError, ValueError): #missing, or evicted / half-written by another process
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        self._replace(self._path(key), lambda f: np.save(f, array))
+        self._evict(keep=self._path(key))
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently used products and digests, other than
+        keep, until the cache is under its cap, so the digests of rasters
+        that are gone or changed don't pile up either.
+        """
+        entries = self._products(('.npy', '.digest'))
+        total = sum(size for used, size, path in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def terrain_products(self, identity, load, cellWidth, cellHeight=None, products=('slope',), **params):
+        """
+        Slope/aspect/hillshade arrays for a DEM, from the cache where
+        possible. identity is a string naming the DEM as it is on disk (see
+        arcio.raster_identity) and load() reads it into an array, which only
+        happens when something has to be computed or the DEM is new. Missing
+        products are computed together in one gradient pass.
+        """
+        params = dict(params, cellWidth=cellWidth, cellHeight=cellHeight)
+        out = {}
+        digest = self.digest(identity)
+        if digest is not None:
+            for p in products:
+                out[p] = self.get(product_key(digest, p, params))
+            if all(a is not None for a in out.values()):
+                return out
+        dem = load()
+        newDigest = array_digest(dem)
+        if newDigest != digest:
+            self.remember(identity, newDigest)
+            #new or changed DEM; the same contents may be cached under another path
+            out = dict((p, self.get(product_key(newDigest, p, params))) for p in products)
+        missing = [p for p in products if out[p] is None]
+        if missing:
+            computed = terrain.derivatives(dem, cellWidth, cellHeight, missing, **_terrain_params(params))
+            for p in missing:
+                out[p] = computed[p]
+                self.put(product_key(newDigest, p, params), computed[p])
+        return out
+
+    def stats(self):
+        entries = self._products()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(entries), 'bytes': sum(size for used, size, path in entries), 'maxBytes': self.maxBytes}
+
+    def report(self):
+        s = self.stats()
+        return 'derivative cache: {hits} hits, {misses} misses, {evictions} evictions, {entries} products ({mb:.0f} of {cap:.0f} MB)'.format(
+            mb=s['bytes'] / 1024.0 ** 2, cap=s['maxBytes'] / 1024.0 ** 2, **s)
+
+
+def _terrain_params(params):
+    return dict((k, v) for k, v in params.items() if k in ('zFactor', 'azimuth', 'altitude'))
+
+
+_default = None
+
+def default_cache():
+    """The cache under GDT_CACHE (or the temp folder), opened once per process."""
+    global _default
+    if _default is None:
+        _default = DerivativeCache()
+    return _default
@@ -0,0 +1,213 @@
+"""
+Source Name:   contour.py
+Description:   Vectorized marching-squares contours, generated tile by tile
+               with the lines stitched back together across tile seams.
+
+               Contour vertices sit on the edges between cell centres. Each
+               crossing is named by the grid edge it lies on, in whole-raster
+               row/col terms, so two tiles that share a seam produce the same
+               name (and the same interpolated point) for it, and stitching is
+               a dictionary lookup. A line is handed to the sink as soon as
+               neither end can be extended by a tile still to come, so only
+               the lines crossing the current seam are held in memory.
+"""
+#-----------------------------------------------------------------------------
+
+import math
+
+import numpy as np
+
+from gdt import tiling
+
+#quad corners: tl=8, tr=4, br=2, bl=1. Edges: T(op), R(ight), B(ottom), L(eft)
+_SEGMENTS = {1: [('L', 'B')], 2: [('B', 'R')], 3: [('L', 'R')], 4: [('T', 'R')],
+             6: [('T', 'B')], 7: [('L', 'T')], 8: [('L', 'T')], 9: [('T', 'B')],
+             11: [('T', 'R')], 12: [('L', 'R')], 13: [('B', 'R')], 14: [('L', 'B')]}
+#saddles: segments when the quad centre is above / below the level
+_SADDLES = {5: ([('L', 'T'), ('B', 'R')], [('T', 'R'), ('L', 'B')]),
+            10: ([('T', 'R'), ('L', 'B')], [('L', 'T'), ('B', 'R')])}
+
+
+def levels_for(zmin, zmax, interval, base=0.0):
+    """Contour values base + k * interval that fall within [zmin, zmax]."""
+    if not (np.isfinite(zmin) and np.isfinite(zmax)):
+        return []
+    first = int(math.ceil((zmin - base) / interval))
+    last = int(math.floor((zmax - base) / interval))
+    return [base + k * interval for k in range(first, last + 1)]
+
+
+def quad_segments(z, level, row0=0, col0=0, keyCols=None):
+    """
+    Marching-squares segments for one level over every quad of z (a block
+    whose top-left cell is whole-raster row0, col0). Returns (keyA, keyB,
+    ptA, ptB): int64 edge keys and (n, 2) arrays of (row, col) positions in
+    whole-raster cell units. keyCols is the whole-raster column count the
+    edge keys are built from. Quads with a NaN corner make no segments.
+    """
+    if keyCols is None:
+        keyCols = col0 + z.shape[1]
+    tl, tr = z[:-1, :-1], z[:-1, 1:]
+    bl, br = z[1:, :-1], z[1:, 1:]
+    with np.errstate(invalid='ignore'):
+        case = ((tl >= level) * 8 + (tr >= level) * 4 + (br >= level) * 2 + (bl >= level) * 1).astype(np.int8)
+        centreHigh = (tl + tr + bl + br) / 4.0 >= level
+    valid = ~(np.isnan(tl) | np.isnan(tr) | np.isnan(bl) | np.isnan(br))
+    case[~valid] = 0
+    keysA, keysB, ptsA, ptsB = [], [], [], []
+    def add(mask, pairs):
+        r, c = np.nonzero(mask)
+        for ea, eb in pairs:
+            ka, pa = _edge_point(z, level, r, c, ea, row0, col0, keyCols)
+            kb, pb = _edge_point(z, level, r, c, eb, row0, col0, keyCols)
+            keysA.append(ka); keysB.append(kb); ptsA.append(pa); ptsB.append(pb)
+    for k, pairs in _SEGMENTS.items():
+        add(case == k, pairs)
+    for k, (high, low) in _SADDLES.items():
+        add((case == k) & centreHigh, high)
+        add((case == k) & ~centreHigh, low)
+    if not keysA:
+        empty = np.zeros(0, np.int64)
+        return empty, empty, np.zeros((0, 2)), np.zeros((0, 2))
+    return np.concatenate(keysA), np.concatenate(keysB), np.concatenate(ptsA), np.concatenate(ptsB)
+
+
+def _edge_point(z, level, r, c, edge, row0, col0, keyCols):
+    #crossing on one edge of quads (r, c); always interpolated from the
+    #upper/left end of the edge so neighbouring quads agree to the bit
+    if edge == 'T':
+        r1, c1, r2, c2, kind = r, c, r, c + 1, 0
+    elif edge == 'B':
+        r1, c1, r2, c2, kind = r + 1, c, r + 1, c + 1, 0
+    elif edge == 'L':
+        r1, c1, r2, c2, kind = r, c, r + 1, c, 1
+    else:
+        r1, c1, r2, c2, kind = r, c + 1, r + 1, c + 1, 1
+    z1, z2 = z[r1, c1], z[r2, c2]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(z2 != z1, (level - z1) / (z2 - z1), 0.5)
+    gr, gc = r1 + row0, c1 + col0
+    key = (gr.astype(np.int64) * keyCols + gc) * 2 + kind
+    pts = np.column_stack([gr + t * (r2 - r1), gc + t * (c2 - c1)])
+    return key, pts
+
+
+class _Line(object):
+    __slots__ = ('points', 'head', 'tail')
+    def __init__(self, points, head, tail):
+        self.points = points
+        self.head = head
+        self.tail = tail
+
+
+class Stitcher(object):
+    """
+    Joins segments that share an edge key into polylines, per level. Open
+    line ends live in self.ends until a segment extends them.
+    """
+    def __init__(self):
+        self.ends = {} #(level, key) -> _Line
+
+    def add(self, level, keysA, keysB, ptsA, ptsB):
+        """Add segments; returns the rings closed by them."""
+        ends = self.ends
+        closed = []
+        for a, b, pa, pb in zip(keysA.tolist(), keysB.tolist(), ptsA.tolist(), ptsB.tolist()):
+            a, b = (level, a), (level, b)
+            la, lb = ends.pop(a, None), ends.pop(b, None)
+            if la is None and lb is None:
+                line = _Line([pa, pb], a, b)
+                ends[a] = ends[b] = line
+            elif la is not None and lb is None:
+                self._extend(la, a, b, pb)
+            elif lb is not None and la is None:
+                self._extend(lb, b, a, pa)
+            elif la is lb:
+                la.points.append(la.points[0]) #ring
+                closed.append(la)
+            else:
+                self._join(la, a, lb, b)
+        return closed
+
+    def _extend(self, line, at, newKey, point):
+        if line.tail == at:
+            line.points.append(point)
+            line.tail = newKey
+        else:
+            line.points.insert(0, point)
+            line.head = newKey
+        self.ends[newKey] = line
+
+    def _join(self, la, a, lb, b):
+        #orient la to end at a and lb to start at b, then concatenate
+        if la.tail != a:
+            la.points.reverse()
+            la.head, la.tail = la.tail, la.head
+        if lb.head != b:
+            lb.points.reverse()
+            lb.head, lb.tail = lb.tail, lb.head
+        la.points.extend(lb.points)
+        la.tail = lb.tail
+        self.ends[la.head] = la
+        self.ends[la.tail] = la
+
+    def pop_finished(self, isOpen):
+        """Remove and return the lines whose two ends fail isOpen(key)."""
+        done = []
+        seen = set()
+        for key, line in list(self.ends.items()):
+            if id(line) in seen:
+                continue
+            seen.add(id(line))
+            if not isOpen(line.head[1]) and not isOpen(line.tail[1]):
+                del self.ends[line.head]
+                del self.ends[line.tail]
+                done.append(line)
+        return done
+
+
+def contour_tiles(source, interval, sink, base=0.0, tileSize=tiling.DEFAULT_TILE_SIZE):
+    """
+    Contour a source (see gdt.tiling) tile by tile. sink(level, points) gets
+    every finished line, points being (row, col) positions in cell units
+    measured from the centre of the top-left cell; see cell_to_map. Returns
+    the number of lines written.
+    """
+    rows, cols = source.rows, source.cols
+    stitcher = Stitcher()
+    count = 0
+    for window in tiling.windows(rows, cols, tileSize):
+        row0, col0, nrows, ncols = window
+        #quads whose top-left cell is in this window need one more row and column
+        z = tiling.read_with_halo(source, window, 1)[1:, 1:]
+        if np.isnan(z).all():
+            continue
+        for level in levels_for(np.nanmin(z), np.nanmax(z), interval, base):
+            keysA, keysB, ptsA, ptsB = quad_segments(z, level, row0, col0, cols)
+            for line in stitcher.add(level, keysA, keysB, ptsA, ptsB):
+                sink(level, line.points)
+                count += 1
+        current = (row0 // tileSize, col0 // tileSize)
+        def isOpen(key):
+            #an end stays open while a quad touching its edge is in a tile still to come
+            kind, cell = key % 2, key // 2
+            r, c = cell // cols, cell % cols
+            quads = [(r - 1, c), (r, c)] if kind == 0 else [(r, c - 1), (r, c)]
+            for qr, qc in quads:
+                if 0 <= qr < rows - 1 and 0 <= qc < cols - 1:
+                    tile = (qr // tileSize, qc // tileSize)
+                    if tile > current:
+                        return True
+            return False
+        for line in stitcher.pop_finished(isOpen):
+            sink(line.head[0], line.points)
+            count += 1
+    for line in stitcher.pop_finished(lambda key: False):
+        sink(line.head[0], line.points)
+        count += 1
+    return count
+
+
+def cell_to_map(points, xMin, yMax, cellWidth, cellHeight):
+    """(row, col) cell-unit positions -> map (x, y) tuples."""
+    return [(xMin + (c + 0.5) * cellWidth, yMax - (r + 0.5) * cellHeight) for r, c in points]
@@ -0,0 +1,262 @@
+"""
+Source Name:   flow.py
+Description:   In-process flow routing for the Debris_Flow tool: depression
+               filling, D8 flow directions and flow accumulation on a DEM
+               array, so contributing area doesn't need the Fill ->
+               FlowDirection -> FlowAccumulation chain and its rasters in
+               the scratch workspace.
+
+               Filling raises every cell to the lowest level at which water
+               standing on it could spill off the raster, which is the
+               surface a priority-flood (Barnes et al. 2014) builds. Rather
+               than popping cells off a heap one at a time, the spill levels
+               are found as minimax paths to the outlets (cells on the edge
+               or next to NoData) in Boruvka rounds: every group of cells
+               hooks onto its neighbour across its lowest link, all groups
+               at once, so there are at most log2(n) rounds of array
+               operations, O(n log n) in all.
+
+               Directions are D8: the steepest drop over distance, with the
+               Esri codes (1 = east, 2 = southeast, ... 128 = northeast).
+               Cells on the flats that filling leaves point, breadth first,
+               at a flat neighbour nearer to where the flat drains.
+               Accumulation takes the cells in topological order (a cell
+               once everything upstream of it is done), a frontier at a
+               time, so every cell and link is visited once: O(n).
+
+               DEMs too big for memory go through tiling.map_tiles with a
+               wide halo (flow_halo: FLOW_HALO cells, or more for a large
+               minimum channel area): flow is traced within the tile and its
+               halo, so a catchment reaching further than the halo is cut at
+               its edge, which never changes the channel test. Filling is
+               not local, though: a depression that spills further away than
+               the halo, or a flat that drains there, is filled and routed
+               within the tile, so cells around it can come out differently
+               from a whole-DEM run.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+from gdt import terrain
+from gdt.terrain import CLASS_NODATA
+
+FLOW_HALO = 512 #cells of DEM around a tile that flow is traced through, ~1500 ft on 3 ft lidar
+D8_CODES = [1, 2, 4, 8, 16, 32, 64, 128]
+D8_STEPS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)] #(row, col) each code points to
+
+
+def _padded(values, fill):
+    """values with a one-cell border of fill, flattened, and the row stride of the result."""
+    values = np.asarray(values)
+    return np.pad(values, 1, mode='constant', constant_values=fill).ravel(), values.shape[1] + 2
+
+
+def _unpadded(flat, shape):
+    rows, cols = shape
+    return flat.reshape(rows + 2, cols + 2)[1:-1, 1:-1]
+
+
+def fill_depressions(dem):
+    """
+    Depression-filled copy of dem as float64, like Fill_3d with no z limit.
+    NaN cells stay NaN, and water spills off the edge of the raster and
+    into NoData.
+    """
+    dem = np.asarray(dem, dtype=np.float64)
+    z, step = _padded(dem, np.nan)
+    valid = ~np.isnan(z)
+    n = z.size
+    out = n #the node everything drains to
+    index = np.int32 if n < 2 ** 31 - 1 else np.int64
+    cells = np.flatnonzero(valid).astype(index)
+    #every 8-neighbour link once, plus a link off the raster from each outlet cell
+    a, b = [], []
+    outlet = np.zeros(len(cells), dtype=bool)
+    for dr, dc in D8_STEPS:
+        nb = cells + (dr * step + dc)
+        ok = valid[nb]
+        outlet |= ~ok
+        if (dr, dc) in [(0, 1), (1, 1), (1, 0), (1, -1)]:
+            a.append(cells[ok])
+            b.append(nb[ok])
+    a.append(cells[outlet])
+    b.append(np.full(outlet.sum(), out, dtype=index))
+    a, b = np.concatenate(a), np.concatenate(b)
+    #a link is crossed once the water is as high as both ends; lowest links first
+    zz = np.append(z, -np.inf)
+    order = np.argsort(np.maximum(zz[a], zz[b])) #any order of equal links gives the same levels
+    a, b = a[order], b[order]
+    del order
+
+    #Boruvka rounds: comp is every node's group, named by its root node
+    comp = np.arange(n + 1, dtype=index)
+    rounds = []
+    while len(a):
+        ca, cb = comp[a], comp[b]
+        keep = ca != cb
+        a, b, ca, cb = a[keep], b[keep], ca[keep], cb[keep]
+        if not len(a):
+            break
+        rank = np.arange(len(a), dtype=index)
+        lowest = np.full(n + 1, len(a), dtype=index)
+        np.minimum.at(lowest, ca, rank)
+        np.minimum.at(lowest, cb, rank)
+        lowest[out] = len(a) #off the raster never hooks onto anything
+        hooking = np.flatnonzero(lowest < len(a)).astype(index)
+        e = lowest[hooking]
+        target = np.where(ca[e] == hooking, cb[e], ca[e])
+        up = np.arange(n + 1, dtype=index)
+        up[hooking] = target
+        #two groups whose lowest links are the same one: the lower id stays put
+        mutual = (up[target] == hooking) & (hooking < target)
+        up[hooking[mutual]] = hooking[mutual]
+        hooking, e = hooking[~mutual], e[~mutual]
+        while True:
+            jumped = up[up]
+            if np.array_equal(jumped, up):
+                break
+            up = jumped
+        rounds.append((hooking, np.maximum(zz[a[e]], zz[b[e]]), up[hooking]))
+        comp = up[comp]
+    #a group spills at the level of its own lowest link or of the group it joined, whichever is higher
+    spill = np.full(n + 1, -np.inf)
+    for hooking, level, root in reversed(rounds):
+        spill[hooking] = np.maximum(level, spill[root])
+    return _unpadded(np.maximum(z, spill[:n]), dem.shape).copy()
+
+
+def flow_directions(filled, cellWidth=1.0, cellHeight=None):
+    """
+    D8 flow direction codes (uint8) on a filled DEM: towards the neighbour
+    with the steepest drop per unit distance, the first in code order on
+    ties. Cells on a flat point at a flat neighbour one step closer to
+    where the flat drains. Outlets with nowhere lower to go on the raster
+    and NoData cells get 0.
+    """
+    if cellHeight is None:
+        cellHeight = cellWidth
+    z, step = _padded(np.asarray(filled, dtype=np.float64), np.nan)
+    valid = ~np.isnan(z)
+    cells = np.flatnonzero(valid)
+    zc = z[cells]
+    steepest = np.zeros(len(cells))
+    code = np.zeros(len(cells), dtype=np.uint8)
+    outlet = np.zeros(len(cells), dtype=bool)
+    for c, (dr, dc) in zip(D8_CODES, D8_STEPS):
+        zn = z[cells + dr * step + dc]
+        outlet |= np.isnan(zn)
+        with np.errstate(invalid='ignore'):
+            drop = (zc - zn) / np.hypot(dr * cellHeight, dc * cellWidth)
+            better = drop > steepest
+        steepest[better] = drop[better]
+        code[better] = c
+    direction = np.zeros(z.size, dtype=np.uint8)
+    direction[cells] = code
+    #flats, breadth first from the cells that already drain
+    pending = np.zeros(z.size, dtype=bool)
+    pending[cells] = (code == 0) & ~outlet
+    frontier = cells[(code > 0) | outlet]
+    while len(frontier):
+        found, codes = [], []
+        for c, (dr, dc) in zip(D8_CODES, D8_STEPS):
+            nb = frontier - (dr * step + dc) #the neighbour for which the frontier cell is one step along c
+            ok = pending[nb] & (z[nb] == z[frontier])
+            found.append(nb[ok])
+            codes.append(np.full(ok.sum(), c, dtype=np.uint8))
+        found, codes = np.concatenate(found), np.concatenate(codes)
+        found, first = np.unique(found, return_index=True)
+        direction[found] = codes[first]
+        pending[found] = False
+        frontier = found
+    return _unpadded(direction, np.shape(filled)).copy()
+
+
+def accumulate(directions, weights=None):
+    """
+    Flow accumulation like FlowAccumulation: the summed weight (1 per cell
+    when weights is None) of every cell upstream of each cell, not counting
+    the cell itself, as float64.
+    """
+    d, step = _padded(directions, 0)
+    down = np.full(d.size, -1, dtype=np.int64)
+    for c, (dr, dc) in zip(D8_CODES, D8_STEPS):
+        at = np.flatnonzero(d == c)
+        down[at] = at + (dr * step + dc)
+    if weights is None:
+        own = np.ones(d.size)
+    else:
+        own = _padded(np.nan_to_num(np.asarray(weights, dtype=np.float64)), 0.0)[0]
+    total = own.copy()
+    flows = np.flatnonzero(down >= 0)
+    inflows = np.bincount(down[flows], minlength=d.size)
+    #topological order: a cell goes once everything upstream of it has been added in
+    frontier = flows[inflows[flows] == 0]
+    slot = np.zeros(d.size, dtype=np.int64)
+    while len(frontier):
+        to = down[frontier]
+        np.add.at(total, to, total[frontier])
+        np.subtract.at(inflows, to, 1)
+        ready = to[(inflows[to] == 0) & (down[to] >= 0)]
+        #a cell fed by several frontier cells is in ready once per feeder; keep one
+        slot[ready] = np.arange(len(ready))
+        frontier = ready[slot[ready] == np.arange(len(ready))]
+    return _unpadded(total - own, np.shape(directions)).copy()
+
+
+def contributing_area(dem, cellWidth, cellHeight=None):
+    """
+    Upslope contributing area of every cell in square map units, the cell
+    itself included, as float32 with NaN for NoData: fill, D8 and
+    accumulation in one stage, so it can go through tiling.map_tiles.
+    Rows and columns of NoData around the edge (e.g. the halo of a tile
+    past the edge of the DEM) are left out of the routing; water leaves
+    the raster and enters NoData alike, so nothing changes.
+    """
+    if cellHeight is None:
+        cellHeight = cellWidth
+    dem = np.asarray(dem, dtype=np.float64)
+    valid = ~np.isnan(dem)
+    area = np.full(dem.shape, np.nan, dtype=np.float32)
+    rows, cols = np.flatnonzero(valid.any(axis=1)), np.flatnonzero(valid.any(axis=0))
+    if not len(rows):
+        return area
+    core = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    cells = accumulate(flow_directions(fill_depressions(dem[core]), cellWidth, cellHeight)) + 1
+    area[core] = cells * (cellWidth * cellHeight)
+    area[~valid] = np.nan
+    return area
+
+
+def flow_halo(minArea, cellWidth, cellHeight=None):
+    """
+    Halo (cells) for tiled debris flow classes with channels starting at
+    minArea: FLOW_HALO, or more when minArea is bigger than that many cells.
+    A catchment smaller than minArea then always fits within the halo, and
+    one cut off at the halo's edge still counts at least minArea inside it,
+    so the channel test comes out as it would on the whole DEM.
+    """
+    if cellHeight is None:
+        cellHeight = cellWidth
+    return max(FLOW_HALO, int(np.ceil(minArea / float(cellWidth * cellHeight))))
+
+
+def debris_flow_classes(sl, area, geology, thresholds, minArea, nodata=CLASS_NODATA):
+    """
+    Debris-flow hazard class of every cell: channels (contributing area of
+    at least minArea) that are steep enough to be in one of the slope
+    severity bands. Value band (1..len(thresholds)) on other ground and
+    band + len(thresholds) where geology is non-zero (a debris-flow or
+    landslide unit underneath); 0 is no hazard and nodata is no slope.
+    """
+    bands = terrain.severity_bands(sl, thresholds, nodata)
+    channel = (bands > 0) & (np.nan_to_num(area) >= minArea)
+    out = np.where(channel, bands + len(thresholds) * (np.asarray(geology) > 0), 0).astype(np.int32)
+    out[bands == nodata] = nodata
+    return out
+
+
+def class_names(thresholds):
+    """(slope band, geology) of the debris_flow_classes values 1..2 * len(thresholds)."""
+    names = terrain.band_names(thresholds)
+    return [(name, 'other units') for name in names] + [(name, 'debris flow / landslide units') for name in names]
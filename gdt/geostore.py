@@ -0,0 +1,180 @@
+"""
+Source Name:   geostore.py
+Description:   Compact in-memory copy of a geology feature class, loaded once
+               and shared by every tool that runs on it, so a unit selection
+               is an array lookup instead of a SearchCursor pass that builds
+               Python sets of unit strings and a where clause per output.
+
+               Geometries are packed: all of the vertices in one (n, 2)
+               float64 array, with offsets giving where each ring starts and
+               which rings belong to which feature, plus a bounding box per
+               feature. The packed rings are x / y only (true curves come in
+               densified), good for bounding boxes and spatial tests; an
+               output is never rebuilt from them. Each feature's OBJECTID is
+               kept, so a selection is written by copying the original
+               shapes of the OIDs it picked. Only the unit fields the tools
+               ask for (FMT, DESCRIPTIO, ...) are loaded, each
+               dictionary-encoded: a sorted vocabulary of its distinct values
+               and one small integer code per feature (-1 for null), so a
+               statewide layer costs a few bytes per feature and vertex
+               rather than a Python object per row and value.
+
+               mask(field, values) is then a lookup table over the
+               vocabulary indexed by the codes: one pass over an integer
+               array, however many units are asked for.
+"""
+#-----------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_STORES = 4 #layers kept loaded per process, least recently used dropped first
+
+
+def _code_dtype(count):
+    """Smallest signed integer type holding codes -1..count - 1."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if count <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _pack(index, codes):
+    """
+    (vocabulary, codes) from the codes of values in order of first
+    appearance (index: value -> code), recoded to the sorted vocabulary.
+    """
+    vocabulary = sorted(index)
+    recode = np.empty(len(index) + 1, dtype=_code_dtype(len(index)))
+    recode[[index[v] for v in vocabulary]] = np.arange(len(vocabulary))
+    recode[-1] = -1
+    return vocabulary, recode[np.array(codes, dtype=np.int64)]
+
+
+class GeologyStore(object):
+    """
+    Features as packed rings and dictionary-encoded attributes. Feature i
+    has OBJECTID oids[i] and is rings featureOffsets[i]:featureOffsets[i + 1],
+    and ring k is coords[ringOffsets[k]:ringOffsets[k + 1]]. bboxes is
+    (xmin, ymin, xmax, ymax) per feature, NaN for a null shape.
+    """
+    def __init__(self, oids, coords, ringOffsets, featureOffsets, fields, codes, vocabularies):
+        self.oids = oids
+        self.coords = coords
+        self.ringOffsets = ringOffsets
+        self.featureOffsets = featureOffsets
+        self.fields = list(fields)
+        self.codes = dict(zip(self.fields, codes))
+        self.vocabularies = dict(zip(self.fields, vocabularies))
+        self._index = dict((f, dict((v, i) for i, v in enumerate(self.vocabularies[f]))) for f in self.fields)
+        self.bboxes = self._bboxes()
+
+    @classmethod
+    def from_rows(cls, rows, fields):
+        """
+        Build a store from (oid, rings, value, value, ...) rows, one value
+        per field; rings is a list of [[x, y], ...] lists, empty for a null
+        shape. Values are coded as they come in, so the rows are never all
+        held.
+        """
+        oids, parts, ringEnds, featureEnds = [], [], [], []
+        points = 0
+        seen = [{} for f in fields] #value -> code in order of first appearance
+        codes = [[] for f in fields]
+        for row in rows:
+            oids.append(row[0])
+            for ring in row[1]:
+                ring = np.asarray(ring, dtype=np.float64).reshape(len(ring), -1)[:, :2] #drop z / m
+                parts.append(ring)
+                points += len(ring)
+                ringEnds.append(points)
+            featureEnds.append(len(ringEnds))
+            for value, index, out in zip(row[2:], seen, codes):
+                out.append(-1 if value is None else index.setdefault(value, len(index)))
+        coords = np.concatenate(parts) if parts else np.empty((0, 2))
+        ringOffsets = np.array([0] + ringEnds, dtype=np.int64)
+        featureOffsets = np.array([0] + featureEnds, dtype=np.int64)
+        vocabularies, packed = [], []
+        for index, out in zip(seen, codes):
+            vocabulary, out = _pack(index, out)
+            vocabularies.append(vocabulary)
+            packed.append(out)
+        return cls(np.array(oids, dtype=np.int64), coords, ringOffsets, featureOffsets, fields, packed, vocabularies)
+
+    def _bboxes(self):
+        out = np.full((len(self), 4), np.nan)
+        if not len(self.coords):
+            return out
+        starts = self.ringOffsets[:-1]
+        ringBoxes = np.column_stack([np.minimum.reduceat(self.coords[:, 0], starts), np.minimum.reduceat(self.coords[:, 1], starts),
+                                     np.maximum.reduceat(self.coords[:, 0], starts), np.maximum.reduceat(self.coords[:, 1], starts)])
+        hasRings = np.diff(self.featureOffsets) > 0
+        first = self.featureOffsets[:-1][hasRings]
+        out[hasRings, :2] = np.minimum.reduceat(ringBoxes[:, :2], first)
+        out[hasRings, 2:] = np.maximum.reduceat(ringBoxes[:, 2:], first)
+        return out
+
+    def __len__(self):
+        return len(self.featureOffsets) - 1
+
+    def has_field(self, name):
+        return any(f.lower() == name.lower() for f in self.fields)
+
+    def field(self, name):
+        """The store's spelling of a field name, matched case-insensitively."""
+        for f in self.fields:
+            if f.lower() == name.lower():
+                return f
+        raise KeyError('no field {} in the geology store'.format(name))
+
+    def add_field(self, name, values):
+        """Load one more field, values being one per feature in store order."""
+        index = {}
+        codes = [-1 if value is None else index.setdefault(value, len(index)) for value in values]
+        self.vocabularies[name], self.codes[name] = _pack(index, codes)
+        self._index[name] = dict((v, i) for i, v in enumerate(self.vocabularies[name]))
+        self.fields.append(name)
+
+    def values(self, field):
+        """Sorted distinct (non-null) values of a field, e.g. the geologic unit codes."""
+        return list(self.vocabularies[self.field(field)])
+
+    def mask(self, field, values):
+        """Boolean mask of the features whose field is one of values."""
+        field = self.field(field)
+        index = self._index[field]
+        lookup = np.zeros(len(index) + 1, dtype=bool) #last slot is code -1, null
+        lookup[[index[v] for v in set(values) if v in index]] = True
+        return lookup[self.codes[field]]
+
+    def intersecting(self, box):
+        """Boolean mask of the features whose bounding box overlaps box (xmin, ymin, xmax, ymax)."""
+        with np.errstate(invalid='ignore'):
+            return ((self.bboxes[:, 0] <= box[2]) & (self.bboxes[:, 2] >= box[0]) &
+                    (self.bboxes[:, 1] <= box[3]) & (self.bboxes[:, 3] >= box[1]))
+
+
+_stores = OrderedDict() #key -> (identity, GeologyStore)
+
+def cached(key, identity, load):
+    """
+    The store kept for key (e.g. a catalog path) if it was loaded from the
+    same identity, otherwise load() and keep that, dropping the least
+    recently used store once there are more than MAX_STORES.
+    """
+    hit = _stores.get(key)
+    if hit is not None and hit[0] == identity:
+        _stores.move_to_end(key)
+        return hit[1]
+    store = load()
+    _stores[key] = (identity, store)
+    _stores.move_to_end(key)
+    while len(_stores) > MAX_STORES:
+        _stores.popitem(last=False)
+    return store
+
+
+def forget(key):
+    """Drop the store kept for key, if any."""
+    _stores.pop(key, None)
@@ -0,0 +1,253 @@
+"""
+Source Name:   graph.py
+Description:   Lazy workflow graphs. Instead of running slope -> Int ->
+               Reclassify -> RasterToPolygon -> Select eagerly, a script
+               records the operations on a Workflow and asks for the outputs
+               it wants; nothing runs until compute() is called.
+
+               At compute time the graph is planned from the requested
+               outputs backwards:
+                 - nodes no requested output depends on are never run;
+                 - asking for the same operation on the same inputs twice
+                   returns the node already recorded, so e.g. one slope
+                   raster is shared by every unit that tests against it;
+                 - chains of per-cell operations (Int, Reclassify, band
+                   lookups, per-unit threshold tests) are fused into one
+                   step that runs over the inputs in row chunks, so the
+                   intermediate rasters between them never exist at full
+                   size;
+                 - each result is released as soon as the last step that
+                   reads it has run.
+               Results go through a store.IntermediateStore when one is
+               given, so large ones are memory-mapped under its budget.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+from gdt import regions, terrain, zonal
+from gdt.terrain import CLASS_NODATA
+
+CHUNK_CELLS = 1 << 20 #cells per chunk when a fused per-cell step runs
+
+
+def _freeze(value):
+    """Hashable stand-in for an operation parameter."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return ('array', value.shape, value.dtype.str, value.tobytes())
+    return value
+
+
+class Node(object):
+    """
+    One recorded operation: func(*input values, **params). cellwise nodes
+    compute every output cell from the same cell of their inputs only.
+    """
+    def __init__(self, id, name, func, inputs, params, cellwise):
+        self.id = id
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.params = params
+        self.cellwise = cellwise
+
+    def __repr__(self):
+        return '<{} #{}>'.format(self.name, self.id)
+
+
+class Step(object):
+    """A unit of execution: root node, the cellwise nodes fused into it and the values it reads."""
+    def __init__(self, root, members, leaves):
+        self.root = root
+        self.members = members #topological order, root last
+        self.leaves = leaves
+
+    @property
+    def name(self):
+        return ' + '.join(n.name for n in self.members)
+
+
+class Workflow(object):
+    """
+    Records operations and runs them on demand.
+
+        wf = graph.Workflow(intermediates)
+        sl = wf.source('slope', lambda: load_slope())
+        classes = wf.reclassify(wf.int(sl), terrain.ROCKFALL_REMAP)
+        result, = wf.compute([wf.sieve(classes, cellArea, 1000, keep=[2])])
+    """
+    def __init__(self, intermediates=None, chunkCells=CHUNK_CELLS):
+        self.intermediates = intermediates
+        self.chunkCells = chunkCells
+        self.nodes = []
+        self._byKey = {}
+        self.shared = 0 #operations asked for again and answered with an existing node
+
+    #recording
+    #---------
+    def op(self, name, func, inputs=(), cellwise=False, **params):
+        """Record func(*inputs, **params), or return the node that already does exactly that."""
+        key = (name, func, tuple(n.id for n in inputs), _freeze(params), cellwise)
+        return self._record(key, name, func, inputs, params, cellwise)
+
+    def source(self, name, load):
+        """A leaf whose value is load(); sources are shared by name."""
+        return self._record(('source', name), name, load, [], {}, False)
+
+    def _record(self, key, name, func, inputs, params, cellwise):
+        if key in self._byKey:
+            self.shared += 1
+            return self._byKey[key]
+        node = Node(len(self.nodes), name, func, list(inputs), params, cellwise)
+        self.nodes.append(node)
+        self._byKey[key] = node
+        return node
+
+    def apply(self, name, func, inputs, **params):
+        """Any other (not per-cell) operation, e.g. polygonizing through arcio."""
+        return self.op(name, func, inputs, **params)
+
+    def int(self, values):
+        """Int_3d: truncate toward zero, NaN stays NaN."""
+        return self.op('int', np.trunc, [values], cellwise=True)
+
+    def reclassify(self, values, remap, nodata=CLASS_NODATA):
+        return self.op('reclassify', terrain.reclassify, [values], cellwise=True, remap=remap, nodata=nodata)
+
+    def severity_bands(self, slope, thresholds, nodata=CLASS_NODATA):
+        return self.op('severity bands', terrain.severity_bands, [slope], cellwise=True,
+                       thresholds=tuple(thresholds), nodata=nodata)
+
+    def zonal_bands(self, slope, labels, thresholds, offsets=(0.0,), nodata=CLASS_NODATA):
+        return self.op('zonal test', zonal.zonal_bands, [slope, labels], cellwise=True,
+                       thresholds=thresholds, offsets=tuple(offsets), nodata=nodata)
+
+    def sieve(self, values, cellArea, minArea=None, keep=None, nodata=CLASS_NODATA):
+        return self.op('sieve', regions.sieve, [values], cellArea=cellArea, minArea=minArea,
+                       keep=None if keep is None else tuple(keep), nodata=nodata)
+
+    #planning
+    #--------
+    def plan(self, outputs):
+        """The steps compute(outputs) would run, in order."""
+        needed = {}
+        todo = list(outputs)
+        while todo:
+            n = todo.pop()
+            if n.id not in needed:
+                needed[n.id] = n
+                todo.extend(n.inputs)
+        consumers = dict((i, 0) for i in needed)
+        for n in needed.values():
+            for i in n.inputs:
+                consumers[i.id] += 1
+        wanted = set(o.id for o in outputs)
+        #a cellwise node read only by one cellwise node (and not asked for) runs inside it
+        fused = set()
+        for n in needed.values():
+            if n.cellwise:
+                for i in n.inputs:
+                    if i.cellwise and consumers[i.id] == 1 and i.id not in wanted:
+                        fused.add(i.id)
+        steps = []
+        for id in sorted(needed): #inputs are always recorded before the nodes that use them
+            if id in fused:
+                continue
+            members, leaves = [], []
+            self._collect(needed[id], fused, members, leaves)
+            steps.append(Step(needed[id], members, leaves))
+        return steps
+
+    def _collect(self, node, fused, members, leaves):
+        for i in node.inputs:
+            if i.id in fused:
+                self._collect(i, fused, members, leaves)
+            elif i not in leaves:
+                leaves.append(i)
+        members.append(node)
+
+    #running
+    #-------
+    def compute(self, outputs, trace=None):
+        """
+        Run what the outputs need and return their values, in order. With a
+        profiling.Trace every step is timed as a stage.
+        """
+        steps = self.plan(outputs)
+        uses = {}
+        for s in steps:
+            for leaf in s.leaves:
+                uses[leaf.id] = uses.get(leaf.id, 0) + 1
+        wanted = set(o.id for o in outputs)
+        values = {}
+        for s in steps:
+            args = [values[leaf.id] for leaf in s.leaves]
+            if trace is not None:
+                with trace.stage(s.name) as st:
+                    value = self._run(s, args)
+                    _count(st, args, value)
+            else:
+                value = self._run(s, args)
+            values[s.root.id] = self._keep(s.root, value)
+            for leaf in s.leaves:
+                uses[leaf.id] -= 1
+                if uses[leaf.id] == 0 and leaf.id not in wanted:
+                    self._release(leaf, values)
+        return [values[o.id] for o in outputs]
+
+    def _key(self, node):
+        return 'graph_{}_{}'.format(node.id, node.name)
+
+    def _keep(self, node, value):
+        if self.intermediates is None:
+            return value
+        key = self._key(node)
+        if key in self.intermediates and self.intermediates.get(key) is value: #a chunked step's own allocation
+            return value
+        return self.intermediates.put(key, value)
+
+    def _release(self, node, values):
+        del values[node.id]
+        if self.intermediates is not None:
+            self.intermediates.drop(self._key(node))
+
+    def _run(self, step, args):
+        if not step.root.cellwise:
+            return step.root.func(*args, **step.root.params)
+        arrays = [np.asarray(a) for a in args]
+        shape = arrays[0].shape
+        if any(a.shape != shape for a in arrays):
+            raise ValueError('{} needs inputs of the same shape'.format(step.name))
+        rows = shape[0] if len(shape) else 1
+        chunk = max(1, self.chunkCells // max(1, int(np.prod(shape[1:]))))
+        if len(shape) == 0 or rows <= chunk:
+            return self._evaluate(step, arrays)
+        out = None
+        for r0 in range(0, rows, chunk):
+            block = self._evaluate(step, [a[r0:r0 + chunk] for a in arrays])
+            if out is None:
+                out = (self.intermediates.allocate(self._key(step.root), shape, block.dtype)
+                       if self.intermediates is not None else np.empty(shape, dtype=block.dtype))
+            out[r0:r0 + chunk] = block
+        return out
+
+    def _evaluate(self, step, arrays):
+        """The fused members of a step on one chunk of its inputs."""
+        values = dict((leaf.id, a) for leaf, a in zip(step.leaves, arrays))
+        for n in step.members:
+            values[n.id] = n.func(*[values[i.id] for i in n.inputs], **n.params)
+        return values[step.root.id]
+
+
+def _count(stage, args, value):
+    cells = [a.size for a in args if isinstance(a, np.ndarray)]
+    if cells:
+        stage.cellsIn = max(cells)
+    if isinstance(value, np.ndarray):
+        stage.cellsOut = value.size
+    elif hasattr(value, 'shapes'): #store.FeatureColumns
+        stage.featuresOut = len(value)
@@ -0,0 +1,50 @@
+"""
+Source Name:   manifest.py
+Description:   Manifest of what each job (e.g. a quad) was built from, for
+               incremental reruns. A job is current when the signature of
+               its inputs matches the one recorded when its outputs were
+               made and those outputs still exist; everything else is stale
+               and gets rebuilt.
+"""
+#-----------------------------------------------------------------------------
+
+import hashlib, json, os
+
+
+def signature(**parts):
+    """Stable hash of the inputs a job depends on (geometry, source signature, parameters...)."""
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class Manifest(object):
+    """
+    JSON file of {job: {'signature': ..., 'outputs': [...]}}. exists is the
+    test used for outputs, e.g. arcpy.Exists for geodatabase datasets.
+    """
+    def __init__(self, path, exists=os.path.exists):
+        self.path = path
+        self.exists = exists
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+
+    def is_current(self, job, sig):
+        entry = self.jobs.get(job)
+        return (entry is not None and entry['signature'] == sig
+                and all(self.exists(o) for o in entry['outputs']))
+
+    def record(self, job, sig, outputs):
+        self.jobs[job] = {'signature': sig, 'outputs': list(outputs)}
+        self.save()
+
+    def forget(self, job):
+        if self.jobs.pop(job, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.jobs, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,87 @@
+"""
+Source Name:   parallel.py
+Description:   Process-pool helpers for running independent jobs (quads,
+               AOIs) on all cores. Every job gets a JobResult back, including
+               the ones that failed, so a bad quad is reported instead of
+               swallowed by a bare except.
+"""
+#-----------------------------------------------------------------------------
+
+import csv, multiprocessing, os, sys, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+class JobResult(object):
+    """Outcome of one job. value is whatever the job returned."""
+    def __init__(self, key, ok, value=None, error=None, seconds=0.0):
+        self.key = key
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+
+def default_workers():
+    """Leave one core free for ArcGIS Pro / the OS."""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _use_python_exe():
+    #inside ArcGIS Pro sys.executable is ArcGISPro.exe, which can't host workers
+    if os.path.basename(sys.executable).lower().startswith('arcgispro'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+
+
+def _run_one(func, key, args):
+    start = time.time()
+    try:
+        value = func(*args)
+        return JobResult(key, True, value, seconds=time.time() - start)
+    except Exception:
+        return JobResult(key, False, error=traceback.format_exc(), seconds=time.time() - start)
+
+
+def run_jobs(func, jobs, workers=None, initializer=None, initargs=(), onDone=None):
+    """
+    Run func(*args) for every (key, args) in jobs and return the JobResults
+    in the same order as jobs, whatever order they finished in. func and its
+    arguments have to be picklable, i.e. func is a module-level function.
+    With workers=1 everything runs in this process, which is handy for
+    debugging. onDone(result) is called in this process as each job
+    finishes, in the order they finish.
+    """
+    jobs = list(jobs)
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        results = []
+        for key, args in jobs:
+            results.append(_run_one(func, key, args))
+            if onDone is not None:
+                onDone(results[-1])
+        return results
+    _use_python_exe()
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        futures = dict((pool.submit(_run_one, func, key, args), i) for i, (key, args) in enumerate(jobs))
+        results = [None] * len(jobs)
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception: #the worker process itself died
+                results[i] = JobResult(jobs[i][0], False, error=traceback.format_exc())
+            if onDone is not None:
+                onDone(results[i])
+        return results
+
+
+def write_report(results, outCSV):
+    """Write one line per job (key, status, seconds, error) to a CSV file."""
+    with open(outCSV, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['job', 'status', 'seconds', 'error'])
+        for r in results:
+            w.writerow([r.key, 'OK' if r.ok else 'FAILED', round(r.seconds, 1), (r.error or '').strip()])
+    return outCSV
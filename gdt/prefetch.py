@@ -0,0 +1,267 @@
+"""
+Source Name:   prefetch.py
+Description:   Read-ahead and a local tile cache for rasters on the N:\\ share
+               (e.g. the Weld County total_mosaic.img), so the network reads
+               overlap the computing and a rerun reads its windows from the
+               local disk instead.
+
+               CachedSource wraps any gdt.tiling source. The raster is cut
+               into fixed blocks on its own grid (so overlapping windows,
+               like neighbouring buffered quads, share blocks) and every
+               block read from the share is kept, in the raster's own pixel
+               type when the source can read it that way (read_raw, e.g.
+               arcio.RasterSource), in a TileCache: one .npy
+               file per block under GDT_TILE_CACHE, keyed by the raster's
+               identity (path, size and modification time, see
+               arcio.raster_identity) and the block's window. A changed
+               raster gets a new identity, so stale blocks are never read,
+               and the oldest blocks are evicted once the cache is over its
+               size cap.
+
+               prefetch(window) queues the blocks of a window that are not
+               cached yet on background threads; read() waits for a block
+               that is already on its way instead of reading it twice.
+               Reads from the wrapped source go one at a time (arcpy isn't
+               made for concurrent reads), so the overlap is between the
+               share and the computing, not between reads.
+
+               The cache has no index: a block is there when its file is,
+               files are written to a temporary name and renamed, and the
+               last-used time is the file's modification time. Several
+               processes can use the same cache folder at once.
+"""
+#-----------------------------------------------------------------------------
+
+import hashlib, os, tempfile, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_ROOT = os.environ.get('GDT_TILE_CACHE', os.path.join(tempfile.gettempdir(), 'gdt_tiles'))
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3 #20 GB
+DEFAULT_THREADS = int(os.environ.get('GDT_PREFETCH_THREADS', 2)) #0 = no background reads
+BLOCK_SIZE = 1024 #cells per side of a cached block, ~4 MB for a float32 DEM
+HOT_BLOCKS = 16 #blocks kept in memory, so halos and neighbouring tiles don't reload them
+
+
+_default = None
+
+def default_cache():
+    """The tile cache under GDT_TILE_CACHE (or the temp folder), opened once per process."""
+    global _default
+    if _default is None:
+        _default = TileCache()
+    return _default
+
+
+def block_key(identity, row0, col0, nrows, ncols):
+    """Cache key for one window of the raster with this identity."""
+    text = '{}|{}|{}|{}|{}'.format(identity, row0, col0, nrows, ncols)
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+class TileCache(object):
+    """
+    On-disk LRU of blocks, safe to share between processes. hits, misses
+    and evictions count this process's lookups.
+    """
+    def __init__(self, root=DEFAULT_ROOT, maxBytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.hits = self.misses = self.evictions = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.npy')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            array = np.load(path)
+        except (IOError, OSError, ValueError): #missing, or evicted / half-written by another process
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array):
+        path = self._path(key)
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+        with self._lock:
+            self._written += array.nbytes
+            check = self._written > self.maxBytes // 20 #look at the folder again after every 5% written
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+
+    def size(self):
+        return sum(e.stat().st_size for e in os.scandir(self.root) if e.name.endswith('.npy'))
+
+    def evict(self):
+        """Remove the least recently used blocks until the cache is under 90% of its cap."""
+        entries = []
+        for e in os.scandir(self.root):
+            if e.name.endswith('.npy'):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxBytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+            except OSError:
+                pass
+
+    def report(self):
+        return 'tile cache: {} hits, {} misses, {} evictions ({:.0f} of {:.0f} MB)'.format(
+            self.hits, self.misses, self.evictions, self.size() / 1024.0 ** 2, self.maxBytes / 1024.0 ** 2)
+
+
+class CachedSource(object):
+    """
+    A gdt.tiling source over another one (e.g. arcio.RasterSource on the
+    share), read through a TileCache block by block, with read-ahead on
+    threads background threads. Call close() when done with it.
+    """
+    def __init__(self, source, identity, tileCache=None, blockSize=BLOCK_SIZE, threads=DEFAULT_THREADS):
+        self.source = source
+        self.identity = identity
+        self.cache = tileCache if tileCache is not None else default_cache()
+        self.blockSize = blockSize
+        self.rows, self.cols = source.rows, source.cols
+        self.info = getattr(source, 'info', None)
+        self._readRaw = getattr(source, 'read_raw', source.read) #blocks are cached and held as read
+        self._asFloat = getattr(source, 'as_float', None)
+        self.sourceReads = 0
+        self._readLock = threading.Lock() #one read of the wrapped source at a time
+        self._lock = threading.Lock()
+        self._pending = {} #block -> Future
+        self._warming = [] #Futures of prefetch(keep=False)
+        self._hot = OrderedDict()
+        self._pool = ThreadPoolExecutor(threads) if threads > 0 else None
+
+    def _blocks(self, row0, col0, nrows, ncols):
+        b = self.blockSize
+        for br in range(row0 // b, (row0 + nrows - 1) // b + 1):
+            for bc in range(col0 // b, (col0 + ncols - 1) // b + 1):
+                yield br, bc
+
+    def _window(self, block):
+        r0, c0 = block[0] * self.blockSize, block[1] * self.blockSize
+        return r0, c0, min(self.blockSize, self.rows - r0), min(self.blockSize, self.cols - c0)
+
+    def _fetch(self, block):
+        #cache, or the wrapped source (and into the cache)
+        window = self._window(block)
+        key = block_key(self.identity, *window)
+        array = self.cache.get(key)
+        if array is None:
+            with self._readLock:
+                array = self._readRaw(*window)
+                self.sourceReads += 1
+            self.cache.put(key, array)
+        return array
+
+    def _warm(self, block):
+        #into the cache only, for a block some other reader (process) is going to need
+        window = self._window(block)
+        key = block_key(self.identity, *window)
+        if key not in self.cache:
+            with self._readLock:
+                array = self._readRaw(*window)
+                self.sourceReads += 1
+            self.cache.put(key, array)
+
+    def _get(self, block):
+        with self._lock:
+            if block in self._hot:
+                self._hot.move_to_end(block)
+                return self._hot[block]
+            future = self._pending.pop(block, None)
+        array = future.result() if future is not None else self._fetch(block)
+        with self._lock:
+            self._hot[block] = array
+            while len(self._hot) > HOT_BLOCKS:
+                self._hot.popitem(last=False)
+        return array
+
+    def prefetch(self, row0, col0, nrows, ncols, keep=True):
+        """
+        Start fetching the blocks of a window in the background, in the order
+        asked for; returns how many were queued. With keep=False the blocks
+        only go into the tile cache, for windows another process will read
+        (this source then holds none of them in memory).
+        """
+        if self._pool is None:
+            return 0
+        top, left = max(row0, 0), max(col0, 0)
+        bottom, right = min(row0 + nrows, self.rows), min(col0 + ncols, self.cols)
+        if bottom <= top or right <= left:
+            return 0
+        queued = 0
+        with self._lock:
+            self._warming = [f for f in self._warming if not f.done()]
+            for block in self._blocks(top, left, bottom - top, right - left):
+                if block in self._pending or block in self._hot:
+                    continue
+                if keep:
+                    self._pending[block] = self._pool.submit(self._fetch, block)
+                else:
+                    self._warming.append(self._pool.submit(self._warm, block))
+                queued += 1
+        return queued
+
+    def read(self, row0, col0, nrows, ncols):
+        out = None
+        for block in self._blocks(row0, col0, nrows, ncols):
+            r0, c0, br, bc = self._window(block)
+            array = self._get(block)
+            if out is None:
+                out = np.empty((nrows, ncols), dtype=array.dtype)
+            top, left = max(row0, r0), max(col0, c0)
+            bottom, right = min(row0 + nrows, r0 + br), min(col0 + ncols, c0 + bc)
+            out[top - row0:bottom - row0, left - col0:right - col0] = array[top - r0:bottom - r0, left - c0:right - c0]
+        return self._asFloat(out) if self._asFloat is not None else out.astype(np.float64, copy=False)
+
+    def close(self):
+        """Stop the read-ahead; blocks still queued are dropped, ones being read are finished."""
+        with self._lock:
+            for future in list(self._pending.values()) + self._warming:
+                future.cancel()
+            self._pending.clear()
+            self._warming = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._hot.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
@@ -0,0 +1,183 @@
+"""
+Source Name:   profiling.py
+Description:   Per-stage timing for the tools and scripts. A Trace collects
+               wall time, CPU time, peak RSS and the cell / feature counts
+               going in and out of each stage, prints one line per stage
+               through the message function it was given (arcpy.AddMessage
+               in the toolbox, print in the scripts) and, when GDT_TRACE
+               names a folder, writes the whole run there as a JSON file.
+
+               With GDT_PROFILE=1 the run is also captured with cProfile;
+               the .prof file goes next to the JSON trace (or into the temp
+               folder) and the top functions by cumulative time are
+               reported with the stages.
+
+               Peak RSS is the process high-water mark when the stage ended,
+               so it only ever grows; rssGrowthMB is how much a stage pushed
+               it up.
+"""
+#-----------------------------------------------------------------------------
+
+import cProfile, io, json, os, pstats, sys, tempfile, time
+
+TRACE_DIR = os.environ.get('GDT_TRACE') #None = no JSON trace
+PROFILE = os.environ.get('GDT_PROFILE', '') not in ('', '0')
+TOP_FUNCTIONS = 15
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it can't be had."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0 #bytes on macOS, KB elsewhere
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        c = Counters()
+        c.cb = ctypes.sizeof(c)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(c), c.cb):
+            return c.PeakWorkingSetSize / 1024.0 ** 2
+    except (ImportError, AttributeError, OSError):
+        pass
+    return None
+
+
+class Stage(object):
+    """
+    One timed stage. The counts can be passed to Trace.stage or filled in
+    inside the with block, once they're known.
+    """
+    def __init__(self, name, cellsIn=None, cellsOut=None, featuresIn=None, featuresOut=None):
+        self.name = name
+        self.cellsIn = cellsIn
+        self.cellsOut = cellsOut
+        self.featuresIn = featuresIn
+        self.featuresOut = featuresOut
+        self.wall = self.cpu = 0.0
+        self.peakRssMB = self.rssGrowthMB = None
+        self.error = None
+
+    def __enter__(self):
+        self._rss = peak_rss_mb()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+        self.peakRssMB = peak_rss_mb()
+        if self.peakRssMB is not None and self._rss is not None:
+            self.rssGrowthMB = self.peakRssMB - self._rss
+        if exc is not None:
+            self.error = '{}: {}'.format(excType.__name__, exc)
+        self.trace._finished(self)
+        return False
+
+    def as_dict(self):
+        return dict((k, v) for k, v in self.__dict__.items() if not k.startswith('_') and k != 'trace')
+
+    def summary(self):
+        parts = ['{:.2f} s wall, {:.2f} s cpu'.format(self.wall, self.cpu)]
+        if self.peakRssMB is not None:
+            parts.append('peak RSS {:.0f} MB (+{:.0f})'.format(self.peakRssMB, self.rssGrowthMB or 0))
+        for label, value in [('cells in', self.cellsIn), ('cells out', self.cellsOut),
+                             ('features in', self.featuresIn), ('features out', self.featuresOut)]:
+            if value is not None:
+                parts.append('{} {}'.format(value, label))
+        text = '{}: {}'.format(self.name, ', '.join(parts))
+        return text + (' FAILED ({})'.format(self.error) if self.error else '')
+
+
+class Trace(object):
+    """
+    Stages of one tool run. message(text) gets a line per finished stage
+    (None for silent, e.g. inside worker processes); traceDir and profile
+    default to GDT_TRACE and GDT_PROFILE. Used in a with block, the trace is
+    closed when the block ends, whether or not a stage failed.
+
+        with profiling.Trace('Rockfall', arcpy.AddMessage) as trace:
+            with trace.stage('slope', cellsIn=dem.size) as st:
+                ...
+                st.cellsOut = slope.size
+    """
+    _profiling = False
+
+    def __init__(self, tool, message=print, traceDir=TRACE_DIR, profile=PROFILE):
+        self.tool = tool
+        self.message = message
+        self.traceDir = traceDir
+        self.stages = []
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.profiler = None
+        if profile and not Trace._profiling: #one cProfile at a time; a nested trace shows up in the outer one
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            Trace._profiling = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def stage(self, name, **counts):
+        s = Stage(name, **counts)
+        s.trace = self
+        return s
+
+    def _finished(self, stage):
+        self.stages.append(stage)
+        if self.message is not None:
+            self.message(stage.summary())
+
+    def close(self):
+        """Report the total, write the JSON trace / profile if asked for; returns the trace file or None."""
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak = peak_rss_mb()
+        if self.message is not None:
+            self.message('{} total: {:.2f} s wall, {:.2f} s cpu{}'.format(
+                self.tool, wall, cpu, ', peak RSS {:.0f} MB'.format(peak) if peak is not None else ''))
+        base = '{}_{}{:03d}_{}'.format(''.join(c if c.isalnum() else '_' for c in self.tool),
+                                       time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started)),
+                                       int(self.started * 1000) % 1000, os.getpid())
+        profileFile = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            Trace._profiling = False
+            profileFile = os.path.join(self.traceDir or tempfile.gettempdir(), base + '.prof')
+            self._ensure_dir(os.path.dirname(profileFile))
+            self.profiler.dump_stats(profileFile)
+            if self.message is not None:
+                out = io.StringIO()
+                pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                self.message('cProfile written to {}\n{}'.format(profileFile, out.getvalue()))
+        if not self.traceDir:
+            return None
+        self._ensure_dir(self.traceDir)
+        traceFile = os.path.join(self.traceDir, base + '.json')
+        with open(traceFile, 'w') as f:
+            json.dump({'tool': self.tool, 'started': self.started, 'pid': os.getpid(), 'wall': wall, 'cpu': cpu,
+                       'peakRssMB': peak, 'profile': profileFile, 'stages': [s.as_dict() for s in self.stages]},
+                      f, indent=1)
+        if self.message is not None:
+            self.message('trace written to {}'.format(traceFile))
+        return traceFile
+
+    def _ensure_dir(self, folder):
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
@@ -0,0 +1,131 @@
+"""
+Source Name:   spatial.py
+Description:   In-process spatial index and polygon rasterizing, so picking
+               the quads in an AOI and clipping a mosaic to a buffered quad
+               don't need SelectLayerByLocation on layers of an open ArcGIS
+               Pro project.
+
+               STRtree is a Sort-Tile-Recursive packed R-tree over bounding
+               boxes (xmin, ymin, xmax, ymax): the boxes are sorted into
+               vertical slices by x, each slice by y, and packed nodeCapacity
+               to a node, level by level. Queries walk the levels with array
+               operations and return candidate ids; the exact geometry test
+               is left to the caller and only runs on those.
+"""
+#-----------------------------------------------------------------------------
+
+import math
+
+import numpy as np
+
+NODE_CAPACITY = 16
+
+
+class STRtree(object):
+    """
+    Packed R-tree over n boxes, an (n, 4) array. Node j of a level covers
+    entries j * nodeCapacity up to (j + 1) * nodeCapacity of the level
+    below; the bottom level is the boxes themselves in STR order.
+    """
+    def __init__(self, boxes, nodeCapacity=NODE_CAPACITY):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.boxes = boxes
+        self.nodeCapacity = nodeCapacity
+        self.order = self._str_order(boxes, nodeCapacity)
+        self.levels = [boxes[self.order]] #bottom up
+        while len(self.levels[-1]) > 1:
+            self.levels.append(self._pack(self.levels[-1], nodeCapacity))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @staticmethod
+    def _str_order(boxes, m):
+        n = len(boxes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2.0
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2.0
+        slices = int(math.ceil(math.sqrt(math.ceil(n / float(m)))))
+        perSlice = slices * m
+        byX = np.argsort(cx, kind='stable')
+        sliceOf = np.empty(n, dtype=np.int64)
+        sliceOf[byX] = np.arange(n) // perSlice
+        return np.lexsort((cy, sliceOf))
+
+    @staticmethod
+    def _pack(level, m):
+        groups = -(-len(level) // m)
+        padded = np.full((groups * m, 4), np.nan)
+        padded[:len(level)] = level
+        padded = padded.reshape(groups, m, 4)
+        return np.column_stack([np.nanmin(padded[:, :, 0], axis=1), np.nanmin(padded[:, :, 1], axis=1),
+                                np.nanmax(padded[:, :, 2], axis=1), np.nanmax(padded[:, :, 3], axis=1)])
+
+    def _walk(self, box, leafTest):
+        if not len(self.boxes):
+            return np.zeros(0, dtype=np.int64)
+        xmin, ymin, xmax, ymax = box
+        m = self.nodeCapacity
+        nodes = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            b = self.levels[depth][nodes]
+            if depth == 0:
+                hit = leafTest(b, xmin, ymin, xmax, ymax)
+                return np.sort(self.order[nodes[hit]])
+            hit = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+            children = (nodes[hit][:, None] * m + np.arange(m)).ravel()
+            nodes = children[children < len(self.levels[depth - 1])]
+
+    def within(self, box):
+        """Ids of the boxes that lie inside box, i.e. the candidates for a WITHIN test."""
+        return self._walk(box, lambda b, xmin, ymin, xmax, ymax:
+                          (b[:, 0] >= xmin) & (b[:, 2] <= xmax) & (b[:, 1] >= ymin) & (b[:, 3] <= ymax))
+
+
+def ring_mask(rings, x0, yTop, cellWidth, cellHeight, rows, cols):
+    """
+    Cells of a (rows, cols) grid whose top-left corner is at (x0, yTop) that
+    have their centre inside the polygon (even-odd over all rings, so holes
+    work). Scanline fill: every edge contributes its crossings with the
+    cell-centre rows it spans, crossings are sorted along each row and the
+    spans between pairs are filled with a cumulative sum.
+    """
+    xs, ys, xe, ye = [], [], [], []
+    for ring in rings:
+        r = np.asarray(ring, dtype=np.float64)
+        xs.append(r[:, 0]); ys.append(r[:, 1])
+        xe.append(np.roll(r[:, 0], -1)); ye.append(np.roll(r[:, 1], -1))
+    mask = np.zeros((rows, cols), dtype=bool)
+    if not xs:
+        return mask
+    x1, y1, x2, y2 = np.concatenate(xs), np.concatenate(ys), np.concatenate(xe), np.concatenate(ye)
+    #edge spans in (fractional) row units, row r has its centre at r + 0.5
+    r1 = (yTop - y1) / cellHeight - 0.5
+    r2 = (yTop - y2) / cellHeight - 0.5
+    lo, hi = np.minimum(r1, r2), np.maximum(r1, r2)
+    first = np.maximum(np.ceil(lo), 0).astype(np.int64)
+    last = np.minimum(np.ceil(hi) - 1, rows - 1).astype(np.int64) #half-open so shared vertices count once
+    span = last - first + 1
+    keep = (span > 0) & (r1 != r2)
+    if not keep.any():
+        return mask
+    first, span = first[keep], span[keep]
+    x1, x2, r1, r2 = x1[keep], x2[keep], r1[keep], r2[keep]
+    edge = np.repeat(np.arange(len(first)), span)
+    row = np.repeat(first, span) + (np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span))
+    t = (row - r1[edge]) / (r2[edge] - r1[edge])
+    col = (x1[edge] + t * (x2[edge] - x1[edge]) - x0) / cellWidth - 0.5 #in cell-centre units
+    order = np.lexsort((col, row))
+    row, col = row[order], col[order]
+    #pairs of consecutive crossings on the same row bound the inside spans
+    start, end = row[0::2], row[1::2]
+    if len(start) != len(end) or np.any(start != end):
+        raise ValueError('odd number of ring crossings on a row')
+    c0 = np.clip(np.ceil(col[0::2]), 0, cols).astype(np.int64)
+    c1 = np.clip(np.ceil(col[1::2]), 0, cols).astype(np.int64)
+    diff = np.zeros((rows, cols + 1), dtype=np.int32)
+    np.add.at(diff, (start, c0), 1)
+    np.add.at(diff, (start, c1), -1)
+    mask[:] = np.cumsum(diff, axis=1)[:, :cols] > 0
+    return mask
@@ -0,0 +1,181 @@
+"""
+Source Name:   store.py
+Description:   In-process store for the intermediates of one run, so the
+               rasters and polygons that only exist to feed the next stage
+               (_rc, _rtp, the quad buffers, ...) never get written to a
+               scratch geodatabase, read back and deleted at the end.
+
+               Rasters are plain NumPy arrays, handed from stage to stage by
+               reference. Once the arrays held in memory would go over the
+               memory budget (GDT_STORE_BUDGET bytes, 2 GB by default) new
+               ones are backed by memory-mapped .npy files in a spill folder
+               instead; the callers don't see the difference. Closing the
+               store drops everything and removes the spill files.
+
+               Features are kept as columns: the geometries in one object
+               array and every attribute as its own typed array, so filters
+               like Shape_Area > 1000 are a NumPy mask instead of a Select
+               and only the finished output goes to the geodatabase.
+"""
+#-----------------------------------------------------------------------------
+
+import os, shutil, tempfile
+
+import numpy as np
+
+DEFAULT_BUDGET = int(os.environ.get('GDT_STORE_BUDGET', 2 * 1024 ** 3))
+
+
+class FeatureColumns(object):
+    """
+    Features as columns: shapes is an object array of geometries and
+    columns maps a field name to an array with one value per feature.
+    """
+    def __init__(self, shapes, columns=None):
+        self.shapes = np.asarray(shapes, dtype=object).reshape(-1)
+        self.columns = dict((name, np.asarray(values)) for name, values in (columns or {}).items())
+        for name, values in self.columns.items():
+            if len(values) != len(self.shapes):
+                raise ValueError('column {} has {} values for {} features'.format(name, len(values), len(self.shapes)))
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        return self.shapes.nbytes + sum(v.nbytes for v in self.columns.values())
+
+    def take(self, which):
+        """The features picked by a boolean mask or index array."""
+        return FeatureColumns(self.shapes[which], dict((name, v[which]) for name, v in self.columns.items()))
+
+    def stamp(self, keyField, names, lookup):
+        """
+        Add the columns names from lookup ({key value: tuple of values}),
+        looked up once per distinct key rather than once per feature.
+        """
+        keys, inverse = np.unique(self.columns[keyField], return_inverse=True)
+        for i, name in enumerate(names):
+            values = np.array([lookup[k][i] for k in keys.tolist()], dtype=object)
+            self.columns[name] = values[inverse.reshape(-1)]
+        return self
+
+
+class IntermediateStore(object):
+    """
+    Named intermediates of one run, in memory up to budget bytes and spilled
+    to memory-mapped files after that. Use as a context manager, or call
+    close() when the run is done.
+
+        with store.IntermediateStore() as st:
+            classes = st.allocate('classes', (rows, cols), np.int32, -1)
+            ...
+    """
+    def __init__(self, budget=DEFAULT_BUDGET, spillDir=None):
+        self.budget = budget
+        self.spillDir = spillDir
+        self.items = {}
+        self.spilled = {} #name -> .npy file
+        self.sizes = {} #name -> bytes it counts against the budget
+        self.inMemory = 0
+        self.peakInMemory = 0
+        self.spills = 0
+        self._ownSpillDir = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def _spill_path(self, name):
+        if self.spillDir is None:
+            self.spillDir = tempfile.mkdtemp(prefix='gdt_store_')
+            self._ownSpillDir = True
+        elif not os.path.isdir(self.spillDir):
+            os.makedirs(self.spillDir)
+        return os.path.join(self.spillDir, '{}_{}.npy'.format(''.join(c if c.isalnum() else '_' for c in name), os.getpid()))
+
+    def _fits(self, nbytes):
+        return self.inMemory + nbytes <= self.budget
+
+    def _hold(self, name, value, nbytes):
+        self.items[name] = value
+        self.sizes[name] = 0 if name in self.spilled else nbytes
+        self.inMemory += self.sizes[name]
+        self.peakInMemory = max(self.peakInMemory, self.inMemory)
+        return value
+
+    def allocate(self, name, shape, dtype, fill=None):
+        """
+        A new writable array for an intermediate, e.g. the target of a tiled
+        pass. Memory-mapped when it doesn't fit in what is left of the budget.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        self.drop(name)
+        if self._fits(nbytes):
+            array = np.empty(shape, dtype=dtype)
+        else:
+            path = self._spill_path(name)
+            array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+            self.spilled[name] = path
+            self.spills += 1
+        if fill is not None:
+            array[...] = fill
+        return self._hold(name, array, nbytes)
+
+    def put(self, name, value):
+        """
+        Keep an intermediate. Arrays are kept by reference when they fit in
+        the budget (no copy) and copied to a memory-mapped file when they
+        don't; FeatureColumns and anything else are kept as they are.
+        Returns what the store holds, so later stages should use that.
+        """
+        self.drop(name)
+        if isinstance(value, np.ndarray) and not isinstance(value, np.memmap) and not self._fits(value.nbytes):
+            spill = self.allocate(name, value.shape, value.dtype)
+            spill[...] = value
+            return spill
+        inMemory = isinstance(value, (np.ndarray, FeatureColumns)) and not isinstance(value, np.memmap)
+        return self._hold(name, value, value.nbytes if inMemory else 0)
+
+    def get(self, name):
+        return self.items[name]
+
+    def drop(self, name):
+        """Forget an intermediate, freeing its memory (or removing its spill file)."""
+        if name not in self.items:
+            return
+        value = self.items.pop(name)
+        self.inMemory -= self.sizes.pop(name)
+        path = self.spilled.pop(name, None)
+        if path is None:
+            return
+        if isinstance(value, np.memmap):
+            value.flush()
+        del value
+        try:
+            os.remove(path)
+        except OSError:
+            pass #still mapped somewhere (Windows); close() has another go at the folder
+
+    def close(self):
+        for name in list(self.items):
+            self.drop(name)
+        self.inMemory = 0
+        if self._ownSpillDir and self.spillDir is not None:
+            shutil.rmtree(self.spillDir, ignore_errors=True)
+            self.spillDir = None
+            self._ownSpillDir = False
+
+    def report(self):
+        return 'intermediate store: peak {:.0f} of {:.0f} MB in memory, {} spilled to disk'.format(
+            self.peakInMemory / 1024.0 ** 2, self.budget / 1024.0 ** 2, self.spills)
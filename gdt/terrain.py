@@ -0,0 +1,182 @@
+"""
+Source Name:   terrain.py
+Description:   Vectorized terrain derivatives for the hazard tools. Slope,
+               aspect and hillshade all come from one set of Horn gradients
+               per cell, and the 3D Analyst Slope -> Int -> Reclassify chain
+               is reproduced on a NumPy array so the class raster can be
+               built without writing the _sl, _int and _rc rasters to the
+               scratch workspace.
+
+               DEM arrays are float with NoData as NaN, row 0 is the top
+               (north) row, the same layout arcpy.RasterToNumPyArray gives.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+ROCKFALL_REMAP = '0 30 1; 30.01 90 2' #same break table Rockfall.execute has always used
+CLASS_NODATA = -1 #NoData value for integer class rasters
+
+
+def _neighbourhood(dem):
+    """
+    Return the eight 3x3 neighbours (a b c / d . f / g h i) of every cell.
+    Like the Esri tools, a neighbour that is NoData or off the edge of the
+    raster takes the value of the centre cell.
+    """
+    padded = np.pad(dem, 1, mode='constant', constant_values=np.nan)
+    rows, cols = dem.shape
+    def shift(r, c):
+        n = padded[r:r + rows, c:c + cols]
+        return np.where(np.isnan(n), dem, n)
+    return (shift(0, 0), shift(0, 1), shift(0, 2),
+            shift(1, 0), shift(1, 2),
+            shift(2, 0), shift(2, 1), shift(2, 2))
+
+
+def horn_gradients(dem, cellWidth, cellHeight=None, zFactor=1.0):
+    """
+    dz/dx and dz/dy from Horn's 3x3 weighted differences. Slope, aspect and
+    hillshade are all built from these, so compute them once and hand them
+    to the functions below. x increases east, y increases south (row order).
+    """
+    if cellHeight is None:
+        cellHeight = cellWidth
+    dem = np.asarray(dem, dtype=np.float64)
+    a, b, c, d, f, g, h, i = _neighbourhood(dem)
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8.0 * cellWidth)
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8.0 * cellHeight)
+    if zFactor != 1.0:
+        dzdx *= zFactor
+        dzdy *= zFactor
+    nodata = np.isnan(dem)
+    dzdx[nodata] = np.nan
+    dzdy[nodata] = np.nan
+    return dzdx, dzdy
+
+
+def slope_from_gradients(dzdx, dzdy):
+    """Slope in degrees as float32, like the raster Slope_3d writes."""
+    return np.degrees(np.arctan(np.hypot(dzdx, dzdy))).astype(np.float32)
+
+
+def aspect_from_gradients(dzdx, dzdy):
+    """
+    Compass aspect in degrees (0 = north, clockwise) as float32, with -1 for
+    flat cells, following the Aspect_3d conventions.
+    """
+    math = np.degrees(np.arctan2(dzdy, -dzdx))
+    out = np.where(math < 0, 90.0 - math, np.where(math > 90, 450.0 - math, 90.0 - math))
+    out[(dzdx == 0) & (dzdy == 0)] = -1.0
+    return out.astype(np.float32)
+
+
+def hillshade_from_gradients(dzdx, dzdy, azimuth=315.0, altitude=45.0):
+    """
+    Hillshade brightness 0-255 (truncated to whole values, NaN for NoData)
+    as float32, using the same illumination model as HillShade_3d.
+    """
+    zenith = np.radians(90.0 - altitude)
+    azimuthMath = np.radians((360.0 - azimuth + 90.0) % 360.0)
+    slopeRad = np.arctan(np.hypot(dzdx, dzdy))
+    aspectRad = np.arctan2(dzdy, -dzdx)
+    aspectRad[aspectRad < 0] += 2 * np.pi
+    shade = 255.0 * (np.cos(zenith) * np.cos(slopeRad) +
+                     np.sin(zenith) * np.sin(slopeRad) * np.cos(azimuthMath - aspectRad))
+    np.clip(shade, 0, 255, out=shade)
+    return np.trunc(shade).astype(np.float32)
+
+
+def slope(dem, cellWidth, cellHeight=None, zFactor=1.0):
+    """
+    Slope in degrees using Horn's 3x3 method, returned as float32 to match
+    the raster Slope_3d writes. NoData cells stay NaN.
+    """
+    return slope_from_gradients(*horn_gradients(dem, cellWidth, cellHeight, zFactor))
+
+
+def derivatives(dem, cellWidth, cellHeight=None, products=('slope', 'aspect', 'hillshade'),
+                zFactor=1.0, azimuth=315.0, altitude=45.0):
+    """
+    Any subset of slope, aspect and hillshade from a single gradient pass.
+    Returns a dict keyed by product name, so it can be handed to
+    tiling.map_tiles with a dict of writers.
+    """
+    dzdx, dzdy = horn_gradients(dem, cellWidth, cellHeight, zFactor)
+    out = {}
+    for p in products:
+        if p == 'slope':
+            out[p] = slope_from_gradients(dzdx, dzdy)
+        elif p == 'aspect':
+            out[p] = aspect_from_gradients(dzdx, dzdy)
+        elif p == 'hillshade':
+            out[p] = hillshade_from_gradients(dzdx, dzdy, azimuth, altitude)
+        else:
+            raise ValueError('unknown terrain product: {}'.format(p))
+    return out
+
+
+def parse_remap(remap):
+    """
+    Parse a Reclassify remap string such as '0 30 1; 30.01 90 2' into a list
+    of (start, end, new value) tuples.
+    """
+    ranges = []
+    for item in remap.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        start, end, new = item.split()
+        ranges.append((float(start), float(end), int(new)))
+    return ranges
+
+
+def reclassify(values, remap, nodata=CLASS_NODATA):
+    """
+    Reclassify an array by value ranges the way Reclassify_3d does: a value
+    on the boundary of two ranges goes to the first (lower) one, values not
+    covered by the table keep their own value and NaN becomes nodata.
+    """
+    if isinstance(remap, str):
+        remap = parse_remap(remap)
+    values = np.asarray(values)
+    out = np.full(values.shape, nodata, dtype=np.int32)
+    done = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(values.shape, bool)
+    for start, end, new in remap:
+        hit = (values >= start) & (values <= end) & ~done
+        out[hit] = new
+        done |= hit
+    out[~done] = values[~done]
+    return out
+
+
+def classify_slope(sl, remap=ROCKFALL_REMAP):
+    """
+    Fused Int -> Reclassify stage on a slope array. Returns the int32 class
+    raster the old Slope_3d / Int_3d / Reclassify_3d chain produced
+    (1 = 0-30 degrees, 2 = steeper than 30 by default) with CLASS_NODATA
+    where the slope has no data.
+    """
+    return reclassify(np.trunc(sl), remap) #Int_3d truncates toward zero
+
+
+def severity_bands(sl, thresholds, nodata=CLASS_NODATA):
+    """
+    Severity band of every cell against a list of slope breakpoints, in one
+    sorted-breakpoint lookup: band k means the truncated slope is above k of
+    the thresholds, so 0 is below all of them. thresholds=[30] gives the
+    same cut as the rockfall remap (band 1 = class 2). NaN becomes nodata.
+    """
+    breaks = np.sort(np.asarray(thresholds, dtype=np.float64))
+    sl = np.asarray(sl)
+    valid = ~np.isnan(sl)
+    out = np.full(sl.shape, nodata, dtype=np.int32)
+    out[valid] = np.searchsorted(breaks, np.trunc(sl[valid]), side='left')
+    return out
+
+
+def band_names(thresholds):
+    """Names of bands 1..n for severity_bands, e.g. ['25-30', '30-35', '>35']."""
+    breaks = sorted(float(t) for t in thresholds)
+    fmt = lambda t: '{:g}'.format(t)
+    return ['{}-{}'.format(fmt(a), fmt(b)) for a, b in zip(breaks, breaks[1:])] + ['>' + fmt(breaks[-1])]
@@ -0,0 +1,130 @@
+"""
+Source Name:   tiling.py
+Description:   Windowed processing for DEMs that are too big to hold in memory
+               (e.g. the Weld County total_mosaic.img). The raster is walked
+               in fixed-size tiles, each read with a halo of neighbouring
+               cells so 3x3 operators like slope come out exactly as they
+               would on the whole raster, and each finished tile is handed to
+               a writer straight away. Peak memory depends on the tile size,
+               not the raster size.
+
+               A source is anything with rows, cols and
+               read(row0, col0, nrows, ncols) returning a float array with
+               NoData as NaN. A writer is anything with
+               write(row0, col0, array) and close(). A source that also has
+               prefetch(row0, col0, nrows, ncols) (gdt.prefetch) is told
+               about the next tile before the current one is computed, so
+               it can read ahead.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+DEFAULT_TILE_SIZE = 2048 #cells per side, ~32 MB per float64 tile
+
+
+class WindowSource(object):
+    """
+    Source over a window of another source, e.g. the cells of a mosaic under
+    a clip polygon's bounding box, so nothing outside the window is read.
+    mask(row0, col0, nrows, ncols), in window coordinates, gives the cells of
+    a block to keep; the others read as NaN.
+    """
+    def __init__(self, source, row0, col0, rows, cols, mask=None):
+        if row0 < 0 or col0 < 0 or row0 + rows > source.rows or col0 + cols > source.cols:
+            raise ValueError('window ({}, {}, {}, {}) is not inside the source'.format(row0, col0, rows, cols))
+        self.source = source
+        self.row0, self.col0 = row0, col0
+        self.rows, self.cols = rows, cols
+        self.mask = mask
+
+    def read(self, row0, col0, nrows, ncols):
+        block = self.source.read(self.row0 + row0, self.col0 + col0, nrows, ncols)
+        if self.mask is not None:
+            block[~self.mask(row0, col0, nrows, ncols)] = np.nan
+        return block
+
+    def prefetch(self, row0, col0, nrows, ncols):
+        top, left = max(row0, 0), max(col0, 0)
+        bottom, right = min(row0 + nrows, self.rows), min(col0 + ncols, self.cols)
+        if not hasattr(self.source, 'prefetch') or bottom <= top or right <= left:
+            return 0
+        return self.source.prefetch(self.row0 + top, self.col0 + left, bottom - top, right - left)
+
+
+class ArrayWriter(object):
+    """
+    Writer that fills an output array. Pass a np.memmap as out to stream to
+    disk without holding the result in memory.
+    """
+    def __init__(self, rows, cols, dtype=np.float32, fill=np.nan, out=None):
+        if out is None:
+            out = np.full((rows, cols), fill, dtype=dtype)
+        self.array = out
+
+    def write(self, row0, col0, array):
+        nrows, ncols = array.shape
+        self.array[row0:row0 + nrows, col0:col0 + ncols] = array
+
+    def close(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        return self.array
+
+
+def windows(rows, cols, tileSize=DEFAULT_TILE_SIZE):
+    """Yield (row0, col0, nrows, ncols) for each tile, row by row from the top."""
+    if tileSize < 1:
+        raise ValueError('tileSize must be at least 1 cell')
+    for row0 in range(0, rows, tileSize):
+        for col0 in range(0, cols, tileSize):
+            yield row0, col0, min(tileSize, rows - row0), min(tileSize, cols - col0)
+
+
+def read_with_halo(source, window, halo=1):
+    """
+    Read a window plus halo cells on every side. Halo cells that fall off
+    the raster are NaN, which is exactly what the whole-raster operators see
+    past the edge, so edge tiles come out the same too.
+    """
+    row0, col0, nrows, ncols = window
+    top = max(row0 - halo, 0)
+    left = max(col0 - halo, 0)
+    bottom = min(row0 + nrows + halo, source.rows)
+    right = min(col0 + ncols + halo, source.cols)
+    block = source.read(top, left, bottom - top, right - left)
+    pad = ((top - (row0 - halo), row0 + nrows + halo - bottom),
+           (left - (col0 - halo), col0 + ncols + halo - right))
+    if any(pad[0]) or any(pad[1]):
+        block = np.pad(block, pad, mode='constant', constant_values=np.nan)
+    return block
+
+
+def map_tiles(source, func, writer, tileSize=DEFAULT_TILE_SIZE, halo=1, others=()):
+    """
+    Run func over the source tile by tile and stream the results to writer.
+
+    func gets the haloed block and returns an array of the same shape, or a
+    dict of such arrays when it makes several products at once; in that case
+    writer is a dict with a writer for each key. others are more sources on
+    the same grid (e.g. burned geology labels), read with the same window
+    and halo and passed to func after the block. Returns whatever the
+    writer(s) return from close().
+    """
+    readAhead = hasattr(source, 'prefetch')
+    tiles = list(windows(source.rows, source.cols, tileSize))
+    for k, window in enumerate(tiles):
+        row0, col0, nrows, ncols = window
+        block = read_with_halo(source, window, halo)
+        if readAhead and k + 1 < len(tiles):
+            r, c, nr, nc = tiles[k + 1]
+            source.prefetch(r - halo, c - halo, nr + 2 * halo, nc + 2 * halo)
+        result = func(block, *[read_with_halo(other, window, halo) for other in others])
+        if isinstance(result, dict):
+            for key, array in result.items():
+                writer[key].write(row0, col0, array[halo:halo + nrows, halo:halo + ncols])
+        else:
+            writer.write(row0, col0, result[halo:halo + nrows, halo:halo + ncols])
+    if isinstance(writer, dict):
+        return dict((key, w.close()) for key, w in writer.items())
+    return writer.close()
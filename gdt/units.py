@@ -0,0 +1,113 @@
+"""
+Source Name:   units.py
+Description:   Data-driven geologic unit classifier shared by all of the
+               hazard tools. The unit-code rules for every hazard live in
+               unit_rules.csv (county '*' means statewide); they are compiled
+               into one regular expression so each distinct map unit is
+               scanned once, no matter how many rules there are.
+
+               A rule code matches a unit symbol that starts with it, as long
+               as the code sits at the start of a token. So 'Qls' matches
+               'Qls', 'Qlsy' and 'Qls/Kp' but not 'PQls', and 'Pm' no longer
+               matches 'PPm'. Matching is case-sensitive ('Ta' used to be
+               lower-cased and matched nearly everything).
+"""
+#-----------------------------------------------------------------------------
+
+import csv, os, re
+
+RULES_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unit_rules.csv')
+LANDSLIDE = 'landslide'
+PROBLEMATIC_ROCK = 'problematic_rock'
+PROBLEMATIC_SOIL = 'problematic_soil'
+DEBRIS_FLOW = 'debris_flow'
+
+
+class Rule(object):
+    """
+    One row of the rule table. slope is the slope (degrees) above which the
+    unit is a hazard, for units whose hazard depends on slope; None otherwise.
+    """
+    def __init__(self, hazard, county, code, description='', slope=None):
+        self.hazard = hazard
+        self.county = county
+        self.code = code
+        self.description = description
+        self.slope = slope
+
+
+def load_rules(path=RULES_CSV):
+    with open(path, newline='') as f:
+        return [Rule(r['hazard'], r['county'], r['code'], r.get('description', ''),
+                     float(r['slope']) if r.get('slope') else None)
+                for r in csv.DictReader(f)]
+
+
+class UnitClassifier(object):
+    """
+    The rules that apply to one county, compiled into a single matcher.
+    classify() returns {unit: {hazard: code}} for every unit that matched
+    at least one rule, where code is the most specific rule code that hit.
+    """
+    def __init__(self, rules, county=None):
+        rules = [r for r in rules if r.county == '*' or (county and r.county.lower() == county.lower())]
+        self.codes = {} #code -> {hazard: code}, including hazards of shorter prefix codes
+        self.slopes = {} #(hazard, code) -> slope threshold
+        for r in rules:
+            self.codes.setdefault(r.code, {})[r.hazard] = r.code
+            if r.slope is not None:
+                self.slopes[(r.hazard, r.code)] = r.slope
+        for code, hazards in self.codes.items():
+            for other in sorted(self.codes, key=len, reverse=True):
+                if other != code and code.startswith(other):
+                    for hazard, c in self.codes[other].items():
+                        hazards.setdefault(hazard, c)
+        #longest codes first so the alternation picks the most specific one
+        alternation = '|'.join(re.escape(c) for c in sorted(self.codes, key=lambda c: (-len(c), c)))
+        self.pattern = re.compile(r'(?<![A-Za-z0-9])(' + alternation + ')') if self.codes else None
+
+    def match(self, unit):
+        """{hazard: code} for one unit, empty when nothing matches."""
+        hit = {}
+        if self.pattern is None or not unit:
+            return hit
+        for m in self.pattern.finditer(unit):
+            for hazard, code in self.codes[m.group(1)].items():
+                hit.setdefault(hazard, code)
+        return hit
+
+    def classify(self, units):
+        out = {}
+        for unit in units:
+            hit = self.match(unit)
+            if hit:
+                out[unit] = hit
+        return out
+
+    def slope_thresholds(self, unitClasses, hazard):
+        """{unit: slope threshold} for the units of a hazard whose rule has one."""
+        out = {}
+        for unit, hit in unitClasses.items():
+            if (hazard, hit.get(hazard)) in self.slopes:
+                out[unit] = self.slopes[(hazard, hit[hazard])]
+        return out
+
+
+_classifiers = {}
+
+def classifier(county=None):
+    """Compiled classifier for a county (statewide rules only when None), cached."""
+    key = county.lower() if county else None
+    if key not in _classifiers:
+        _classifiers[key] = UnitClassifier(load_rules(), county)
+    return _classifiers[key]
+
+
+def classify(units, county=None):
+    """{unit: {hazard: code}} for all of the distinct units, in one pass."""
+    return classifier(county).classify(units)
+
+
+def units_for(unitClasses, hazard, code=None):
+    """Sorted units that fall in a hazard class, optionally only those matched by one code."""
+    return sorted(u for u, h in unitClasses.items() if hazard in h and (code is None or h[hazard] == code))
@@ -0,0 +1,52 @@
+"""
+Source Name:   zonal.py
+Description:   Per-unit slope thresholds on a label raster. The geology unit
+               of every DEM cell is rasterized once (label 0 = no unit) and
+               each cell's threshold is looked up from a label -> threshold
+               array, so the hazard mask for all units comes out of one
+               vectorized pass instead of a clip/int/reclassify/polygonize
+               round per formation.
+
+               zonal_bands does the same for several breakpoints at once:
+               each unit's threshold plus a list of offsets, looked up in
+               one sorted search, so trying five cutoffs costs about the
+               same as one.
+"""
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+from gdt.terrain import CLASS_NODATA
+
+
+def threshold_array(idToUnit, unitThresholds):
+    """
+    Lookup array indexed by label id: the unit's slope threshold, or NaN for
+    label 0 and for units without a threshold (they never become hazards).
+    """
+    size = max(idToUnit) + 1 if idToUnit else 1
+    table = np.full(size, np.nan)
+    for labelId, unit in idToUnit.items():
+        if unit in unitThresholds:
+            table[labelId] = unitThresholds[unit]
+    return table
+
+
+def zonal_bands(slope, labels, thresholds, offsets=(0.0,), nodata=CLASS_NODATA):
+    """
+    Severity bands per unit. The breakpoints of a unit are its threshold
+    plus each of offsets; band k (1..len(offsets)) means the truncated
+    slope is above k of them, as in the old Int -> Reclassify 'T+0.01 90 2'
+    step. Cells get (label - 1) * len(offsets) + band, and nodata below the
+    first breakpoint or outside the units. With offsets=(0,) a cell is its
+    label id where the unit is steeper than its threshold.
+    """
+    offsets = np.sort(np.asarray(offsets, dtype=np.float64))
+    labels = np.asarray(labels)
+    if labels.size and labels.max() >= len(thresholds):
+        thresholds = np.concatenate([thresholds, np.full(labels.max() + 1 - len(thresholds), np.nan)])
+    excess = np.trunc(slope) - thresholds[labels]
+    valid = ~np.isnan(excess)
+    band = np.zeros(labels.shape, dtype=np.int64)
+    band[valid] = np.searchsorted(offsets, excess[valid], side='left')
+    return np.where(band > 0, (labels.astype(np.int64) - 1) * len(offsets) + band, nodata).astype(np.int32)